@@ -0,0 +1,248 @@
+# BulkIngest.py
+# 多文件 / zip 压缩包的并行入库：多进程并行执行 transform_nessus_data，
+# 结果按提交顺序由当前线程依次写入，ID 区间由 MySqlSource.reserve_id_range 原子预留。
+# 所有批量任务共享一个以 spawn 方式启动的进程池，进程总数不超过 [INGEST] max_processes；
+# 在多线程的 uvicorn 进程中 fork 会把锁、连接池和套接字的状态复制进子进程。
+#
+# 命令行用法:
+#   python BulkIngest.py --username rag [--processes 8] [--no-index] scan1.csv scan2.csv bundle.zip ...
+import argparse
+import multiprocessing
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import zipfile
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+import pandas as pd
+
+# Add the current directory to the Python path for module imports
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+import CsvDataOp
+import IngestJobs
+import IngestPipeline
+import MySqlPool
+import MySqlSource
+import NessusXmlOp
+
+SUPPORTED_SUFFIXES = ('.csv', '.nessus')
+
+# 解压 zip 的上限（[INGEST] max_bundle_files / max_bundle_mb），防止压缩炸弹占满磁盘
+INGEST_CONFIG = IngestJobs.load_ingest_config()
+
+# 所有批量任务共享的转换进程池，首次使用时创建
+_transform_pool = None
+_transform_pool_lock = threading.Lock()
+
+
+def get_transform_pool(max_processes: int = None) -> ProcessPoolExecutor:
+    """
+    返回共享的转换进程池（spawn 启动），首次调用时按 max_processes（缺省为 CPU 核数）创建。
+    之后的调用无论 max_processes 为何都返回同一个池，因此并发的批量任务合计也不会超过这个进程数。
+    """
+    global _transform_pool
+    with _transform_pool_lock:
+        if _transform_pool is None:
+            _transform_pool = ProcessPoolExecutor(max_workers=max_processes or os.cpu_count() or 1,
+                                                  mp_context=multiprocessing.get_context('spawn'))
+        return _transform_pool
+
+
+def shutdown_transform_pool(pool: ProcessPoolExecutor = None):
+    """关闭共享的转换进程池；给出 pool 时只有它仍是当前的池才关闭（用于丢弃崩溃的池）。"""
+    global _transform_pool
+    with _transform_pool_lock:
+        if _transform_pool is None or (pool is not None and pool is not _transform_pool):
+            return
+        _transform_pool, pool = None, _transform_pool
+    pool.shutdown(wait=False, cancel_futures=True)
+
+
+def _extract_member(bundle: zipfile.ZipFile, member: zipfile.ZipInfo, target: str, budget: int) -> int:
+    # 按实际解压出的字节数计数（不信任 zip 头中声明的大小），超过 budget 立即中止
+    written = 0
+    with bundle.open(member) as src, open(target, 'wb') as dst:
+        while chunk := src.read(1024 * 1024):
+            written += len(chunk)
+            if written > budget:
+                raise ValueError("压缩包解压后的总大小超过上限。")
+            dst.write(chunk)
+    return written
+
+
+def expand_bundle(paths: list, work_dir: str, max_files: int = None, max_bytes: int = None) -> list:
+    """
+    把输入路径展开为待处理的扫描文件列表：zip 中的 .csv / .nessus 成员以流式方式解压到 work_dir，
+    其他文件原样保留。解压后的文件名由序号和成员的基本名组成，避免压缩包内的路径穿越。
+    扫描文件总数超过 max_files、或解压出的字节数合计超过 max_bytes 时抛出 ValueError。
+    """
+    max_files = max_files or INGEST_CONFIG['max_bundle_files']
+    max_bytes = max_bytes or INGEST_CONFIG['max_bundle_mb'] * 1024 * 1024
+    files = []
+    extracted = 0
+    for path in paths:
+        if zipfile.is_zipfile(path):
+            with zipfile.ZipFile(path) as bundle:
+                members = [member for member in bundle.infolist()
+                           if not member.is_dir() and member.filename.lower().endswith(SUPPORTED_SUFFIXES)]
+                if len(files) + len(members) > max_files:
+                    raise ValueError(f"上传内容中的扫描文件超过 {max_files} 个。")
+                if extracted + sum(member.file_size for member in members) > max_bytes:
+                    raise ValueError(f"压缩包解压后的总大小超过 {max_bytes // (1024 * 1024)} MB。")
+                for member in members:
+                    target = os.path.join(work_dir, f"{len(files):05d}_{os.path.basename(member.filename)}")
+                    extracted += _extract_member(bundle, member, target, max_bytes - extracted)
+                    files.append(target)
+        elif path.lower().endswith(SUPPORTED_SUFFIXES):
+            if len(files) + 1 > max_files:
+                raise ValueError(f"上传内容中的扫描文件超过 {max_files} 个。")
+            files.append(path)
+        else:
+            print(f"警告: 跳过不支持的文件 '{path}'（仅支持 .csv、.nessus 和 .zip）。")
+    return files
+
+
+def transform_scan_file(path: str) -> pd.DataFrame:
+    """在工作进程中执行：把单个扫描文件转换为可入库的 DataFrame。"""
+    if path.lower().endswith('.nessus'):
+        batches = list(NessusXmlOp.iter_nessus_xml_chunks(path))
+        return pd.concat(batches, ignore_index=True) if batches else pd.DataFrame()
+    return CsvDataOp.transform_nessus_data(path)
+
+
+def ingest_bundle(job, db_name: str, table_name: str, collection_name: str, paths: list,
+                  chroma_client=None, max_processes: int = None, delta: bool = False,
+                  delete_source: bool = False) -> dict:
+    """
+    并行转换多个扫描文件（或 zip 包）并写入同一张表。
+
+    - 转换在共享的进程池（get_transform_pool）中并行执行，并发的批量任务合计不超过 max_processes 个进程。
+    - 写入只发生在当前线程，并严格按文件提交顺序进行，文件之间的 ID 顺序与上传顺序一致。
+    - 最多只有 2 * max_processes 个转换结果在内存中等待写入，避免结果无限堆积。
+
+    :param job: IngestJobs.IngestJob，用于上报进度
+    :param paths: .csv / .nessus / .zip 文件路径列表
+    :param chroma_client: 为 None 时跳过 ChromaDB 同步
+    :param delta: 为 True 时按发现项历史增量入库，未变化的发现项只记录出现
+    :param delete_source: 为 True 时，任务结束后删除 paths 中的（上传落盘的）临时文件
+    """
+    work_dir = tempfile.mkdtemp(prefix='nessus_bundle_')
+    try:
+        files = expand_bundle(paths, work_dir)
+        if not files:
+            raise ValueError("上传内容中没有可处理的 .csv 或 .nessus 文件。")
+        print(f"开始并行处理 {len(files)} 个扫描文件...")
+
+        # 整个任务独占一个从连接池借出的连接，pymysql 连接不能在线程间共享
+        mysql_pool = MySqlPool.get_pool()
+        connection = mysql_pool.acquire()
+        try:
+            IngestPipeline.prepare_target_table(connection, db_name, table_name, delta)
+            # 增量入库的租户不维护按天的汇总；每个任务只判断一次
+            summaries = not MySqlSource.uses_delta_ingest(connection, db_name)
+            job.start_stage('parse')
+            job.start_stage('insert')
+
+            pool = get_transform_pool(max_processes)
+            processes = max_processes or os.cpu_count() or 1
+            transformed = 0
+            per_file = []
+            pending = deque()
+            try:
+                next_file = 0
+                while next_file < len(files) or pending:
+                    while next_file < len(files) and len(pending) < 2 * processes:
+                        pending.append((files[next_file], pool.submit(transform_scan_file, files[next_file])))
+                        next_file += 1
+
+                    # 按提交顺序等待并写入
+                    path, future = pending.popleft()
+                    try:
+                        df = future.result()
+                    except BrokenProcessPool:
+                        # 工作进程异常退出后池不可再用，丢弃它，下一个任务会重新创建
+                        shutdown_transform_pool(pool)
+                        raise
+                    job.add_rows('parse', len(df))
+                    transformed += len(df)
+                    duplicates_before = job.stages['insert']['duplicates']
+                    inserted = IngestPipeline.write_batch(job, connection, db_name, table_name, df, delta,
+                                                          outbox=chroma_client is None, summaries=summaries) \
+                        if not df.empty else 0
+                    duplicates = job.stages['insert']['duplicates'] - duplicates_before
+                    per_file.append({"file": os.path.basename(path), "rows_parsed": len(df),
+                                     "rows_inserted": inserted, "rows_duplicate": duplicates})
+                    print(f"  - 文件 '{os.path.basename(path)}' 已写入: 解析 {len(df)} 行，"
+                          f"新增 {inserted} 行，重复 {duplicates} 行")
+            finally:
+                # 任务失败时取消本任务尚未开始的转换，不再占用共享的进程池
+                for _, future in pending:
+                    future.cancel()
+            job.finish_stage('parse')
+            job.finish_stage('insert')
+
+            if transformed == 0:
+                raise ValueError("Processed files are empty or invalid.")
+
+            processed = 0
+            if chroma_client is not None:
+                processed = IngestPipeline.index_table(job, connection, chroma_client,
+                                                       db_name, table_name, collection_name)
+            else:
+                job.finish_stage('index', status='deferred')
+
+            result = {
+                "message": f"{len(files)} files processed and stored successfully.",
+                "database": db_name,
+                "table": table_name,
+                "collection": collection_name,
+                "files": per_file,
+                "rows_parsed": transformed,
+                "rows_inserted": job.stages['insert']['rows'],
+                "rows_duplicate": job.stages['insert']['duplicates'],
+                "rows_unchanged": job.stages['insert']['unchanged'],
+                "rows_indexed": processed,
+            }
+            IngestPipeline.register_upload(job, connection, db_name, table_name, result)
+            return result
+        finally:
+            mysql_pool.release(connection)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+        if delete_source:
+            for path in paths:
+                if os.path.exists(path):
+                    os.remove(path)
+
+
+if __name__ == "__main__":
+    import VectorDatabase
+    import utils
+
+    parser = argparse.ArgumentParser(description="并行导入多个 Nessus 扫描文件（.csv / .nessus / .zip）。")
+    parser.add_argument('paths', nargs='+', help="扫描文件或 zip 包路径")
+    parser.add_argument('--username', required=True, help="用户名，即 MySQL 数据库名和 ChromaDB 集合名")
+    parser.add_argument('--table', default=None, help="目标表名，默认为今天的日期 YYYY_MM_DD")
+    parser.add_argument('--processes', type=int, default=None, help="转换进程数，默认为 CPU 核数")
+    parser.add_argument('--no-index', action='store_true', help="只写入 MySQL，不同步到 ChromaDB")
+    parser.add_argument('--delta', action='store_true', help="增量入库：未变化的发现项只记录出现")
+    args = parser.parse_args()
+
+    cli_job = IngestJobs.IngestJob(args.username, ', '.join(args.paths))
+    result = ingest_bundle(
+        cli_job,
+        db_name=args.username,
+        table_name=args.table or utils.get_today_date_formatted(),
+        collection_name=args.username,
+        paths=args.paths,
+        chroma_client=None if args.no_index else VectorDatabase.connect_to_chromadb(),
+        max_processes=args.processes,
+        delta=args.delta,
+    )
+    shutdown_transform_pool()
+    print(result)
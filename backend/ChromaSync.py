@@ -0,0 +1,297 @@
+# ChromaSync.py
+# 后台 MySQL -> ChromaDB 同步：常驻工作线程按顺序消费各租户的 chroma_outbox（写入漏洞表时同一事务记录的 id 区间），
+# 把对应的行分批写入租户的 ChromaDB 集合，并按配置限速；定期再按 is_indexed_to_chroma 扫描全部每日表兜底。
+# 上传任务只需把数据提交到 MySQL 即可返回，向量索引由本模块在后台追平。
+#
+# 可以独立运行:
+#   python ChromaSync.py [--once] [--tenant rag] [--interval 10] [--max-rows-per-second 2000]
+# 也可以由 backend_app 在启动时以后台线程方式运行（[CHROMA_SYNC] enabled = true）。
+import argparse
+import configparser
+import os
+import sys
+import threading
+import time
+
+# Add the current directory to the Python path for module imports
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+import MySqlPool
+import MySqlSource
+
+
+def load_sync_config(config_path='config.ini') -> dict:
+    """从 config.ini 的 [CHROMA_SYNC] 节读取后台同步配置，缺省时使用默认值。"""
+    config = configparser.ConfigParser()
+    config.read(os.path.join(os.path.dirname(__file__), config_path))
+    tenants = config.get('CHROMA_SYNC', 'tenants', fallback='')
+    return {
+        'enabled': config.getboolean('CHROMA_SYNC', 'enabled', fallback=False),
+        'poll_interval': config.getfloat('CHROMA_SYNC', 'poll_interval', fallback=10.0),
+        'batch_size': config.getint('CHROMA_SYNC', 'batch_size', fallback=1000),
+        'max_rows_per_table': config.getint('CHROMA_SYNC', 'max_rows_per_table', fallback=20000) or None,
+        'max_rows_per_second': config.getfloat('CHROMA_SYNC', 'max_rows_per_second', fallback=0) or None,
+        'outbox_batch': config.getint('CHROMA_SYNC', 'outbox_batch', fallback=100),
+        'reconcile_interval': config.getfloat('CHROMA_SYNC', 'reconcile_interval', fallback=3600.0),
+        'tenants': [t.strip() for t in tenants.split(',') if t.strip()] or None,
+    }
+
+
+class ChromaSyncWorker:
+    """
+    常驻的 ChromaDB 同步工作者。
+
+    - 发件箱：每一轮读取每个租户最早的 outbox_batch 条 chroma_outbox 记录，按 seq 顺序处理
+      （同步对应 id 区间内未索引的行），处理完即删除记录；
+      发现待办工作只需按主键读取发件箱，开销与积压量成正比，与每日表的数量无关。
+    - 兜底扫描：每隔 reconcile_interval 秒（启动后第一轮也会执行）重新加载表结构目录，发现所有每日表，
+      按 is_indexed_to_chroma 统计并同步积压，覆盖发件箱之前写入的历史数据；0 表示不扫描。
+    - 每个区间 / 每张表每轮最多同步 max_rows_per_table 行，积压很大的租户不会让其他租户一直等待。
+    - 检查点：行是否已索引以 is_indexed_to_chroma 为准（写入 ChromaDB 之后才提交标记，写入是幂等的 upsert），
+      发件箱记录在区间同步完成后才删除，进程中断后重启会从未完成的记录继续；每张表的进度另记在 chroma_sync_state 表中。
+    - 限速：max_rows_per_second 不为空时，每个批次写完后按累计行数休眠，使平均速率不超过该值。
+    - lag() 返回各租户的发件箱积压（记录数、id 数、最早记录的等待秒数）和兜底扫描看到的各表积压。
+    """
+
+    def __init__(self, chroma_client, poll_interval: float = 10.0, batch_size: int = 1000,
+                 max_rows_per_table: int = 20000, max_rows_per_second: float = None, tenants=None,
+                 outbox_batch: int = 100, reconcile_interval: float = 3600.0):
+        self.chroma_client = chroma_client
+        self.poll_interval = poll_interval
+        self.batch_size = batch_size
+        self.max_rows_per_table = max_rows_per_table
+        self.max_rows_per_second = max_rows_per_second
+        self.tenants = tenants
+        self.outbox_batch = outbox_batch
+        self.reconcile_interval = reconcile_interval
+        self._stop = threading.Event()
+        self._wake = threading.Event()
+        self._thread = None
+        self._lock = threading.Lock()
+        self._lag = {}  # {db_name: {table_name: {'pending_rows', 'last_synced_at', 'last_error'}}}
+        self._outbox_lag = {}  # {db_name: {'entries', 'ids', 'lag_seconds'}}
+        self._cycles = 0
+        self._last_cycle = None
+        self._last_reconcile = None
+
+    def start(self):
+        """在后台守护线程中运行 run_forever。"""
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self.run_forever, name='chroma-sync-worker', daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float = None):
+        """请求停止：当前批次完成后退出。"""
+        self._stop.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def wake(self):
+        """提前开始下一轮（例如刚有上传任务提交到 MySQL）。"""
+        self._wake.set()
+
+    def run_forever(self):
+        print(f"ChromaDB 后台同步已启动（轮询间隔 {self.poll_interval}s）。")
+        while not self._stop.is_set():
+            try:
+                summary = self.run_once()
+                busy = summary['rows_indexed'] > 0 and (summary['pending_rows'] > 0 or summary['outbox_entries'] > 0)
+            except Exception as e:
+                print(f"错误: ChromaDB 后台同步本轮失败: {e}")
+                busy = False
+            # 仍有积压时立即开始下一轮，否则等待轮询间隔或被唤醒
+            if not busy:
+                self._wake.wait(self.poll_interval)
+            self._wake.clear()
+        print("ChromaDB 后台同步已停止。")
+
+    def run_once(self, reconcile: bool = None) -> dict:
+        """
+        执行一轮：先消费各租户的发件箱，到期时再做一次兜底扫描，返回本轮汇总。
+        reconcile 为 None 时按 reconcile_interval 决定是否扫描。
+        """
+        cycle_start = time.perf_counter()
+        if reconcile is None:
+            reconcile = bool(self.reconcile_interval) and (
+                self._last_reconcile is None or time.monotonic() - self._last_reconcile >= self.reconcile_interval)
+
+        with MySqlPool.connection() as connection:
+            outbox_tenants = MySqlSource.list_outbox_tenants(connection, self.tenants)
+            tables = MySqlSource.list_indexable_tables(connection, self.tenants, refresh=True) if reconcile else []
+
+        rows_indexed = 0
+        outbox_entries = 0
+        for db_name in outbox_tenants:
+            if self._stop.is_set():
+                break
+            indexed, remaining_entries = self._drain_outbox(db_name)
+            rows_indexed += indexed
+            outbox_entries += remaining_entries
+
+        pending_rows = 0
+        for db_name, table_name in tables:
+            if self._stop.is_set():
+                break
+            indexed, pending = self._sync_table(db_name, table_name)
+            rows_indexed += indexed
+            pending_rows += pending
+        if reconcile and not self._stop.is_set():
+            self._last_reconcile = time.monotonic()
+
+        summary = {
+            'tenants': len(outbox_tenants),
+            'tables_scanned': len(tables),
+            'rows_indexed': rows_indexed,
+            'outbox_entries': outbox_entries,
+            'pending_rows': pending_rows,
+            'duration_s': round(time.perf_counter() - cycle_start, 3),
+            'finished_at': time.time(),
+        }
+        with self._lock:
+            self._cycles += 1
+            self._last_cycle = summary
+        if rows_indexed:
+            print(f"ChromaDB 后台同步: 本轮索引 {rows_indexed} 行，发件箱剩余 {outbox_entries} 条记录"
+                  f"{f'，兜底扫描 {len(tables)} 张表，剩余积压 {pending_rows} 行' if reconcile else ''}。")
+        return summary
+
+    def _drain_outbox(self, db_name: str) -> (int, int):
+        """按 seq 顺序处理一个租户的发件箱记录，返回 (本次索引的行数, 剩余记录数)。"""
+        rows_indexed = 0
+        with MySqlPool.connection(db_name) as connection:
+            entries = MySqlSource.fetch_outbox_entries(connection, db_name, self.outbox_batch)
+            done = []
+            for entry in entries:
+                if self._stop.is_set():
+                    break
+                table_name = entry['table_name']
+                id_range = (entry['start_id'], entry['end_id'])
+                if not MySqlSource.table_exists(connection, table_name, db_name, strict=True):
+                    # 表已被删除，区间内没有需要索引的行
+                    done.append(entry['seq'])
+                    continue
+                processed, remaining, error = self._sync(connection, db_name, table_name, id_range)
+                rows_indexed += processed
+                if error or remaining:
+                    # 保持顺序：出错或本轮额度用完时停在这条记录，下一轮从这里继续
+                    break
+                done.append(entry['seq'])
+            MySqlSource.complete_outbox_entries(connection, db_name, done)
+            lag = MySqlSource.get_outbox_lag(connection, db_name)
+        with self._lock:
+            self._outbox_lag[db_name] = lag
+        return rows_indexed, lag['entries']
+
+    def _sync_table(self, db_name: str, table_name: str) -> (int, int):
+        """兜底扫描：同步一张表，返回 (本次索引的行数, 剩余积压行数)。"""
+        with MySqlPool.connection(db_name) as connection:
+            pending = MySqlSource.count_unindexed_rows(connection, db_name, table_name)
+            if pending <= 0:
+                self._record_lag(db_name, table_name, max(pending, 0))
+                return 0, max(pending, 0)
+            processed, remaining, error = self._sync(connection, db_name, table_name)
+        self._record_lag(db_name, table_name, remaining, error)
+        return processed, remaining
+
+    def _sync(self, connection, db_name: str, table_name: str, id_range=None) -> (int, int, str):
+        """同步一张表（或其中一个 id 区间）中未索引的行并记录进度，返回 (索引的行数, 剩余行数, 错误信息)。"""
+        progress = {'last_id': None}
+        started = time.perf_counter()
+
+        def on_batch(metrics):
+            progress['last_id'] = metrics['last_id']
+            self._throttle(metrics['processed'], started)
+
+        processed, _ = MySqlSource.sync_mysql_to_chromadb(
+            connection=connection,
+            chroma_client=self.chroma_client,
+            db_name=db_name,
+            table_name=table_name,
+            collection_name=db_name,
+            batch_size=self.batch_size,
+            on_batch=on_batch,
+            max_rows=self.max_rows_per_table,
+            id_range=id_range,
+        )
+        error = None
+        if processed < 0:
+            error = f"同步表 '{table_name}' 到 ChromaDB 失败。"
+            processed = 0
+        remaining = max(MySqlSource.count_unindexed_rows(connection, db_name, table_name, id_range), 0)
+        MySqlSource.save_sync_checkpoint(connection, db_name, table_name, progress['last_id'],
+                                         processed, remaining, error)
+        return processed, remaining, error
+
+    def _throttle(self, processed: int, started: float):
+        if not self.max_rows_per_second:
+            return
+        ahead = processed / self.max_rows_per_second - (time.perf_counter() - started)
+        if ahead > 0:
+            self._stop.wait(ahead)
+
+    def _record_lag(self, db_name: str, table_name: str, pending_rows: int, error: str = None):
+        with self._lock:
+            self._lag.setdefault(db_name, {})[table_name] = {
+                'pending_rows': pending_rows,
+                'last_synced_at': time.time(),
+                'last_error': error,
+            }
+
+    def lag(self) -> dict:
+        """返回同步延迟快照：各租户的发件箱积压、兜底扫描看到的各表积压，以及上一轮的汇总。"""
+        with self._lock:
+            tenants = {}
+            for db_name in set(self._lag) | set(self._outbox_lag):
+                tables = self._lag.get(db_name, {})
+                tenants[db_name] = {
+                    'outbox': dict(self._outbox_lag.get(db_name, {'entries': 0, 'ids': 0, 'lag_seconds': 0})),
+                    'pending_rows': sum(t['pending_rows'] for t in tables.values()),
+                    'tables': {name: dict(info) for name, info in tables.items()
+                               if info['pending_rows'] or info['last_error']},
+                }
+            return {
+                'running': self._thread is not None and self._thread.is_alive(),
+                'cycles': self._cycles,
+                'last_cycle': dict(self._last_cycle) if self._last_cycle else None,
+                'outbox_entries': sum(t['outbox']['entries'] for t in tenants.values()),
+                'lag_seconds': max((t['outbox']['lag_seconds'] for t in tenants.values()), default=0),
+                'pending_rows': sum(t['pending_rows'] for t in tenants.values()),
+                'tenants': tenants,
+            }
+
+
+if __name__ == "__main__":
+    import VectorDatabase
+
+    sync_config = load_sync_config()
+    parser = argparse.ArgumentParser(description="把所有租户数据库中未索引的行持续同步到 ChromaDB。")
+    parser.add_argument('--once', action='store_true', help="只执行一轮（包含兜底扫描）后退出")
+    parser.add_argument('--tenant', action='append', default=None, help="只同步指定租户，可重复")
+    parser.add_argument('--interval', type=float, default=sync_config['poll_interval'], help="轮询间隔（秒）")
+    parser.add_argument('--batch-size', type=int, default=sync_config['batch_size'])
+    parser.add_argument('--max-rows-per-second', type=float, default=sync_config['max_rows_per_second'],
+                        help="写入 ChromaDB 的速率上限，默认不限速")
+    args = parser.parse_args()
+
+    worker = ChromaSyncWorker(
+        VectorDatabase.connect_to_chromadb(),
+        poll_interval=args.interval,
+        batch_size=args.batch_size,
+        max_rows_per_table=sync_config['max_rows_per_table'],
+        max_rows_per_second=args.max_rows_per_second,
+        tenants=args.tenant or sync_config['tenants'],
+        outbox_batch=sync_config['outbox_batch'],
+        reconcile_interval=sync_config['reconcile_interval'],
+    )
+    try:
+        if args.once:
+            print(worker.run_once(reconcile=True))
+        else:
+            worker.run_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        MySqlPool.close_pool()
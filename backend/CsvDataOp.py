@@ -1,6 +1,7 @@
 # transform_data.py
 import os
 import time
+from typing import Iterator
 
 import numpy as np
 import pandas as pd
@@ -10,65 +11,300 @@ from hashids import Hashids
 
 import MySqlSource
 
+try:
+    import pyarrow as pa
+    import pyarrow.csv as pa_csv
+except ImportError:  # pyarrow 为可选依赖，仅 engine='arrow' 时需要
+    pa = None
+    pa_csv = None
 
-# nessus->pd
-def transform_nessus_data(csv_file_path: str) -> pd.DataFrame:
-    """
-    清理、转换和丰富原始 Nessus 数据框，使其具备数据库存储条件。工作流程遵循以下具体步骤：
 
-    1.过滤风险值无效的行
-    2.合并重复发现项（基于插件 ID、主机和端口），并整合 CVE 信息
-    3.为每个结果行生成唯一指纹
-    4.基于源文件的创建时间添加 YYYY_MM_DD 格式的时间戳
-    5.标准化数据类型（包括日期格式）以适配数据库存储
+# Nessus 导出中用于识别“同一漏洞发现项”的分组键
+NESSUS_GROUPING_KEY = ['Plugin ID', 'Host', 'Port']
 
-    参数说明：
-    :param csv_file_path: 原始 CSV 文件的路径，用于获取文件创建时间
-    """
-    # ... (前面的代码部分保持不变) ...
-    df = pd.read_csv(csv_file_path)
+# Nessus CSV 列名 -> 数据库列名
+NESSUS_COLUMN_MAPPING = {
+    'Plugin ID': 'plugin_id', 'CVE': 'cve', 'CVSS v2.0 Base Score': 'cvss_v2_0_base_score',
+    'fingerprint': 'fingerprint',
+    'Risk': 'risk', 'Host': 'host', 'Protocol': 'protocol', 'Port': 'port', 'Name': 'name',
+    'Synopsis': 'synopsis', 'Description': 'description', 'Solution': 'solution',
+    'See Also': 'see_also', 'Plugin Output': 'plugin_output', 'STIG Severity': 'stig_severity',
+    'CVSS v3.0 Base Score': 'cvss_v3_0_base_score', 'CVSS v2.0 Temporal Score': 'cvss_v2_0_temporal_score',
+    'CVSS v3.0 Temporal Score': 'cvss_v3_0_temporal_score', 'Risk Factor': 'risk_factor',
+    'BID': 'bid', 'XREF': 'xref', 'MSKB': 'mskb',
+    'Plugin Publication Date': 'plugin_publication_date',
+    'Plugin Modification Date': 'plugin_modification_date',
+    'timestamp': 'timestamp',
+    'is_indexed_to_chroma': 'is_indexed_to_chroma'
+}
 
-    if len(df) < 1:
-        raise ValueError(f"CSV文件 '{csv_file_path}' 有效信息为空或仅包含表头。")
-    if 'Risk' in df.columns:
-        df = df.dropna(subset=['Risk'])
-        if df.empty:
-            print("警告：在删除'Risk'为空的行后，DataFrame为空。")
-            return df
+# 参与内容哈希的数据库列：除指纹三要素（plugin_id/host/port）和扫描时间外，发现项的全部内容
+FINDING_CONTENT_COLUMNS = [
+    'cve', 'cvss_v2_0_base_score', 'risk', 'protocol', 'name', 'synopsis', 'description',
+    'solution', 'see_also', 'plugin_output', 'stig_severity', 'cvss_v3_0_base_score',
+    'cvss_v2_0_temporal_score', 'cvss_v3_0_temporal_score', 'risk_factor', 'bid', 'xref', 'mskb',
+    'plugin_publication_date', 'plugin_modification_date'
+]
 
-    if len(df) < 1:
-        raise ValueError(f"CSV文件 '{csv_file_path}' 有效信息为空或仅包含表头。")
 
-    print("步骤 2: 合并重复漏洞的CVE并去重...")
-    grouping_key = ['Plugin ID', 'Host', 'Port']
-    agg_functions = {
-        col: 'first' for col in df.columns if col not in grouping_key
+# 与 pd.read_csv 默认一致的空值标记（包括 'None'，Risk 为 None 的信息类发现项会因此被丢弃）
+NESSUS_NA_VALUES = ['', '#N/A', '#N/A N/A', '#NA', '-1.#IND', '-1.#QNAN', '-NaN', '-nan', '1.#IND',
+                    '1.#QNAN', '<NA>', 'N/A', 'NA', 'NULL', 'NaN', 'None', 'n/a', 'nan', 'null']
+
+def _nessus_arrow_column_types() -> dict:
+    """
+    Nessus CSV 的显式 Arrow Schema：文本为 Arrow 字符串，低基数列为字典（分类）类型，分数一次解析到位。
+    日期列按字符串读取，由 _finalize_nessus_frame 与 pandas 引擎一样宽松地转换（无法解析的值为空），
+    不会因为一个格式不同的日期让整个文件解析失败。
+    """
+    categorical = pa.dictionary(pa.int32(), pa.string())
+    column_types = {
+        'Plugin ID': pa.int64(),
+        'Port': pa.int64(),
+        'Risk': categorical,
+        'Protocol': categorical,
+        'Risk Factor': categorical,
+        'CVSS v2.0 Base Score': pa.float64(),
+        'CVSS v3.0 Base Score': pa.float64(),
+        'CVSS v2.0 Temporal Score': pa.float64(),
+        'CVSS v3.0 Temporal Score': pa.float64(),
     }
-    if 'CVE' in df.columns:
-        agg_functions['CVE'] = lambda cves: ','.join(
-            sorted(c for c in cves.unique() if pd.notna(c) and c != '')
-        )
-    df_transformed = df.groupby(grouping_key).agg(agg_functions).reset_index()
-    print(f"  - 合并后，记录数从 {len(df)} 减少到 {len(df_transformed)}")
-    df = df_transformed
+    for col in ('CVE', 'Host', 'Name', 'Synopsis', 'Description', 'Solution', 'See Also',
+                'Plugin Output', 'STIG Severity', 'BID', 'XREF', 'MSKB',
+                'Plugin Publication Date', 'Plugin Modification Date'):
+        column_types[col] = pa.string()
+    return column_types
 
-    print("步骤 3: 为每条记录生成指纹和时间戳...")
-    print("  - 正在生成指纹...")
-    raw_strings_for_fingerprint = (df['Plugin ID'].astype(str) + '-' +
-                                   df['Host'].astype(str) + '-' +
-                                   df['Port'].astype(str))
-    fingerprints = [xxhash.xxh64(s.encode('utf-8')).hexdigest() for s in raw_strings_for_fingerprint]
 
-    print("  - 正在添加时间戳...")
+def _arrow_types_mapper(arrow_type):
+    # 字典类型交给 pandas 默认转换为 Categorical，其余类型保持 Arrow 存储
+    if pa.types.is_dictionary(arrow_type):
+        return None
+    return pd.ArrowDtype(arrow_type)
+
+
+def _read_nessus_csv(csv_file_path, engine: str = 'pandas') -> pd.DataFrame:
+    """
+    读取 Nessus CSV。
+
+    :param engine: 'pandas' 使用 pd.read_csv 自动推断类型；
+                   'arrow' 使用 pyarrow 按显式 Schema 一次性解析，字符串不再是 Python 对象，内存占用更小。
+                   arrow 引擎需要文件路径或二进制文件对象。
+    """
+    if engine == 'pandas':
+        return pd.read_csv(csv_file_path)
+    if engine != 'arrow':
+        raise ValueError(f"不支持的 CSV 读取引擎: '{engine}'，可选值为 'pandas' 或 'arrow'。")
+    if pa_csv is None:
+        raise ImportError("engine='arrow' 需要安装 pyarrow。")
+
+    table = pa_csv.read_csv(
+        csv_file_path,
+        # Plugin Output 等字段中包含换行
+        parse_options=pa_csv.ParseOptions(newlines_in_values=True),
+        convert_options=pa_csv.ConvertOptions(
+            column_types=_nessus_arrow_column_types(),
+            null_values=NESSUS_NA_VALUES,
+            strings_can_be_null=True,
+        ),
+    )
+    return table.to_pandas(types_mapper=_arrow_types_mapper)
+
+
+def _get_scan_date(csv_file_path) -> str:
+    """基于源文件的创建时间生成 YYYY_MM_DD 格式的扫描日期；拿不到文件时间时使用当前日期。"""
     try:
         file_creation_time = os.path.getctime(csv_file_path)
         # <-- 关键修改: 格式化为 YYYY_MM_DD
-        scan_date = time.strftime('%Y_%m_%d', time.localtime(file_creation_time))
+        return time.strftime('%Y_%m_%d', time.localtime(file_creation_time))
     except FileNotFoundError:
         print(f"警告: 找不到源文件 '{csv_file_path}'，将使用当前日期作为时间戳。")
-        # <-- 关键修改: 格式化为 YYYY_MM_DD
-        scan_date = pd.to_datetime('today').strftime('%Y_%m_%d')
+    except TypeError:
+        # 上传接口传入的是内存中的文件对象，没有创建时间可用
+        print("信息: 数据源不是文件路径，将使用当前日期作为时间戳。")
+    # <-- 关键修改: 格式化为 YYYY_MM_DD
+    return pd.to_datetime('today').strftime('%Y_%m_%d')
+
+
+def _merge_duplicate_findings(df: pd.DataFrame, cves_are_joined: bool = False) -> pd.DataFrame:
+    """
+    按 (Plugin ID, Host, Port) 合并重复发现项：其余列取第一个非空值，CVE 去重排序后以逗号拼接。
+
+    CVE 的合并完全使用列式操作完成，避免对每个分组调用 Python 函数：
+    先过滤空值并去重，再按 (分组键, CVE) 排序，最后按组内名次逐轮拼接字符串。
+    拼接的轮数等于单个分组中 CVE 的最大数量，而不是分组数量。
+
+    :param cves_are_joined: 为 True 时，CVE 列中的值已经是逗号拼接的结果（分块合并的中间状态），
+                            需要先拆分再合并，保证最终结果与一次性合并完全一致。
+    """
+    other_columns = [col for col in df.columns if col not in NESSUS_GROUPING_KEY]
+    merged = df.groupby(NESSUS_GROUPING_KEY).agg(
+        {col: 'first' for col in other_columns if col != 'CVE'}
+    )
+    if 'CVE' in df.columns:
+        merged['CVE'] = _join_cves_by_group(df[NESSUS_GROUPING_KEY + ['CVE']], cves_are_joined) \
+            .reindex(merged.index, fill_value='')
+    return merged[other_columns].reset_index()
+
+
+def _join_cves_by_group(cves: pd.DataFrame, cves_are_joined: bool) -> pd.Series:
+    """返回以分组键为索引、值为“排序去重后逗号拼接的 CVE”的 Series；没有 CVE 的分组不出现在结果中。"""
+    if cves_are_joined:
+        cves = cves.assign(CVE=cves['CVE'].str.split(',')).explode('CVE')
+    # 分组键为空的行在 groupby 中不属于任何分组（与其余列的合并一致，直接丢弃），
+    # 否则 cumcount 会返回 NaN
+    cves = cves.dropna(subset=NESSUS_GROUPING_KEY)
+    cves = cves[cves['CVE'].notna() & (cves['CVE'] != '')].drop_duplicates()
+    cves = cves.sort_values(NESSUS_GROUPING_KEY + ['CVE'])
+
+    grouped = cves.groupby(NESSUS_GROUPING_KEY, sort=False)
+    group_no = grouped.ngroup().to_numpy()
+    rank = grouped.cumcount().to_numpy()
+    values = cves['CVE'].to_numpy(dtype=object)
+
+    # 数据已按分组键排序，名次为 0 的行依次对应第 0, 1, 2... 个分组
+    is_first = rank == 0
+    joined = values[is_first].copy()
+    for r in range(1, int(rank.max()) + 1 if len(rank) else 1):
+        selected = rank == r
+        positions = group_no[selected]
+        joined[positions] = joined[positions] + ',' + values[selected]
+
+    return pd.Series(joined, index=pd.MultiIndex.from_frame(cves.loc[is_first, NESSUS_GROUPING_KEY]),
+                     name='CVE')
+
+
+class _IncrementalFindingMerger:
+    """
+    分块增量合并重复发现项，最终结果与对全部行一次性调用 _merge_duplicate_findings 相同。
+
+    已合并的发现项按分组键建立索引（分组键 -> 段号和段内位置）：每个新块先在块内合并，
+    其中首次出现的分组追加为新的一段；已出现过的分组用新值补齐之前仍为空的列（保持“第一个非空值”语义），
+    并把两边已拼接的 CVE 一起交给 _join_cves_by_group 重新合并（每块一次）。
+    每块的开销只与块大小有关，不会像 concat 后整体重新分组那样随已累积的发现项数量增长。
+    所有块的列集合必须相同。
+    """
+
+    def __init__(self):
+        self._parts = []  # 每块中首次出现的分组（以分组键为索引，CVE 为已拼接的字符串），按文件顺序
+        self._where = {}  # 分组键 -> (段号, 段内位置)
+        self._columns = None
+
+    def __len__(self) -> int:
+        return len(self._where)
+
+    def add(self, chunk: pd.DataFrame, cves_are_joined: bool = False):
+        """合并一个数据块。cves_are_joined 的含义与 _merge_duplicate_findings 相同。"""
+        if self._columns is None:
+            self._columns = [col for col in chunk.columns if col not in NESSUS_GROUPING_KEY]
+        has_cves = 'CVE' in chunk.columns
+        grouped = chunk.drop(columns='CVE', errors='ignore').groupby(NESSUS_GROUPING_KEY).first()
+        if has_cves:
+            grouped['CVE'] = _join_cves_by_group(chunk[NESSUS_GROUPING_KEY + ['CVE']], cves_are_joined) \
+                .reindex(grouped.index, fill_value='')
+
+        located = [self._where.get(key) for key in grouped.index]
+        is_new = np.fromiter((loc is None for loc in located), dtype=bool, count=len(located))
+        if is_new.any():
+            new = grouped[is_new]
+            part_no = len(self._parts)
+            self._where.update(zip(new.index, ((part_no, row) for row in range(len(new)))))
+            self._parts.append(new)
+        if is_new.all():
+            return
 
+        # 已出现过的分组：之前的值在文件中更靠前，只填补其中的空值，CVE 取并集
+        seen = grouped[~is_new]
+        part_nos, rows = np.array([loc for loc in located if loc is not None]).T
+        merged_cves = self._merge_seen_cves(seen, part_nos, rows) if has_cves else None
+        for part_no in np.unique(part_nos):
+            in_part = part_nos == part_no
+            part = self._parts[part_no]
+            current = part.iloc[rows[in_part]]
+            missing = current.isna().any()
+            for col in missing.index[missing]:
+                values = current[col].where(current[col].notna(), seen[col].to_numpy()[in_part])
+                if values.dtype != part[col].dtype:
+                    # 例如该段中全为空的 float 列遇到了字符串
+                    part[col] = part[col].astype(object)
+                part.iloc[rows[in_part], part.columns.get_loc(col)] = values.to_numpy()
+            if merged_cves is not None:
+                changed = in_part & pd.notna(merged_cves)
+                if changed.any():
+                    part.iloc[rows[changed], part.columns.get_loc('CVE')] = merged_cves[changed]
+
+    def _merge_seen_cves(self, seen: pd.DataFrame, part_nos, rows):
+        """返回与 seen 对齐的数组：本块带来了 CVE 的分组为合并后的 CVE，其余为 None。"""
+        incoming = seen['CVE'].to_numpy(dtype=object)
+        changed = incoming != ''
+        merged = np.full(len(seen), None, dtype=object)
+        if not changed.any():
+            return merged
+        previous = np.empty(len(seen), dtype=object)
+        for part_no in np.unique(part_nos[changed]):
+            in_part = changed & (part_nos == part_no)
+            previous[in_part] = self._parts[part_no]['CVE'].to_numpy(dtype=object)[rows[in_part]]
+        keys = seen.index[changed]
+        key_frame = keys.to_frame(index=False)
+        cves = pd.concat([key_frame.assign(CVE=previous[changed]), key_frame.assign(CVE=incoming[changed])],
+                         ignore_index=True)
+        merged[changed] = _join_cves_by_group(cves, cves_are_joined=True).reindex(keys).to_numpy()
+        return merged
+
+    def result(self) -> pd.DataFrame:
+        """返回按分组键排序的合并结果，列顺序与 _merge_duplicate_findings 一致；没有任何数据时返回 None。"""
+        if not self._parts:
+            return None
+        merged = pd.concat(self._parts).sort_index()
+        return merged[self._columns].reset_index()
+
+
+def generate_fingerprints(plugin_ids: pd.Series, hosts: pd.Series, ports: pd.Series) -> list:
+    """
+    批量生成 'PluginID-Host-Port' 的 xxh64 指纹。
+
+    直接在 Python 列表上拼接字符串并调用一次性的 xxh64_hexdigest，
+    省去了 pandas 对象列的逐元素拼接，以及每行创建一个哈希对象的开销。结果与逐行计算完全一致。
+
+    含空值的整数列会被读成 float（443 -> 443.0），而分块读取时每块、arrow 引擎和 .nessus 解析得到的类型各不相同；
+    取值全为整数的 float 列按整数拼接，同一发现项无论从哪条路径入库，指纹都相同。
+    """
+    def as_text(series: pd.Series) -> list:
+        if pd.api.types.is_float_dtype(series) and series.dropna().mod(1).eq(0).all():
+            series = series.astype('Int64')
+        # 整数列和对象列的 str() 结果与 astype(str) 相同，可以跳过 astype 的额外拷贝
+        if pd.api.types.is_integer_dtype(series) or pd.api.types.is_object_dtype(series):
+            return series.tolist()
+        return series.astype(str).tolist()
+
+    hexdigest = xxhash.xxh64_hexdigest
+    return [
+        hexdigest(f'{plugin_id}-{host}-{port}'.encode('utf-8'))
+        for plugin_id, host, port in zip(as_text(plugin_ids), as_text(hosts), as_text(ports))
+    ]
+
+
+def generate_content_hashes(df: pd.DataFrame) -> list:
+    """
+    为已对齐数据库列名的发现项批量生成内容哈希（xxh64）。
+    指纹标识“是哪一个发现项”，内容哈希标识“它的内容有没有变化”；两次扫描之间指纹和内容哈希都相同的
+    发现项即为未变化项，增量入库时只记录一次出现，不再写入完整行和向量。
+    """
+    content = df[FINDING_CONTENT_COLUMNS].astype(object).where(df[FINDING_CONTENT_COLUMNS].notna(), '')
+    hexdigest = xxhash.xxh64_hexdigest
+    return [
+        hexdigest('\x1f'.join(map(str, values)).encode('utf-8'))
+        for values in content.itertuples(index=False, name=None)
+    ]
+
+
+def _finalize_nessus_frame(df: pd.DataFrame, scan_date: str) -> pd.DataFrame:
+    """对已合并的发现项执行步骤 3~5：生成指纹和时间戳、标准化数据类型、对齐数据库列名。"""
+    print("步骤 3: 为每条记录生成指纹和时间戳...")
+    print("  - 正在生成指纹...")
+    fingerprints = generate_fingerprints(df['Plugin ID'], df['Host'], df['Port'])
+
+    print("  - 正在添加时间戳...")
     print("  - 正在将新列添加到DataFrame...")
     df = df.assign(
         fingerprint=fingerprints,
@@ -89,34 +325,92 @@ def transform_nessus_data(csv_file_path: str) -> pd.DataFrame:
             # 这会将该列的数据类型变为字符串，但格式符合要求
             df[col] = pd.to_datetime(df[col], errors='coerce').dt.strftime('%Y_%m_%d')
 
-    # ... (后面的列名映射和对齐部分保持不变) ...
     print("步骤 5: 对齐列名以匹配数据库 Schema...")
-    column_mapping = {
-        'Plugin ID': 'plugin_id', 'CVE': 'cve', 'CVSS v2.0 Base Score': 'cvss_v2_0_base_score',
-        'fingerprint': 'fingerprint',
-        'Risk': 'risk', 'Host': 'host', 'Protocol': 'protocol', 'Port': 'port', 'Name': 'name',
-        'Synopsis': 'synopsis', 'Description': 'description', 'Solution': 'solution',
-        'See Also': 'see_also', 'Plugin Output': 'plugin_output', 'STIG Severity': 'stig_severity',
-        'CVSS v3.0 Base Score': 'cvss_v3_0_base_score', 'CVSS v2.0 Temporal Score': 'cvss_v2_0_temporal_score',
-        'CVSS v3.0 Temporal Score': 'cvss_v3_0_temporal_score', 'Risk Factor': 'risk_factor',
-        'BID': 'bid', 'XREF': 'xref', 'MSKB': 'mskb',
-        'Plugin Publication Date': 'plugin_publication_date',
-        'Plugin Modification Date': 'plugin_modification_date',
-        'timestamp': 'timestamp',
-        'is_indexed_to_chroma': 'is_indexed_to_chroma'
-    }
-    df.rename(columns=column_mapping, inplace=True)
-    final_columns = list(column_mapping.values())
+    df = df.rename(columns=NESSUS_COLUMN_MAPPING)
+    final_columns = list(NESSUS_COLUMN_MAPPING.values())
     for col in final_columns:
         if col not in df.columns:
             df[col] = None
-    df_final = df[final_columns]
+    return df[final_columns]
+
+
+# nessus->pd
+def transform_nessus_data(csv_file_path: str, engine: str = 'pandas') -> pd.DataFrame:
+    """
+    清理、转换和丰富原始 Nessus 数据框，使其具备数据库存储条件。工作流程遵循以下具体步骤：
+
+    1.过滤风险值无效的行
+    2.合并重复发现项（基于插件 ID、主机和端口），并整合 CVE 信息
+    3.为每个结果行生成唯一指纹
+    4.基于源文件的创建时间添加 YYYY_MM_DD 格式的时间戳
+    5.标准化数据类型（包括日期格式）以适配数据库存储
+
+    参数说明：
+    :param csv_file_path: 原始 CSV 文件的路径，用于获取文件创建时间
+    :param engine: CSV 读取引擎，'pandas'（默认）或 'arrow'（需要 pyarrow，按显式 Schema 解析，见 _read_nessus_csv）
+    """
+    df = _read_nessus_csv(csv_file_path, engine)
+
+    if len(df) < 1:
+        raise ValueError(f"CSV文件 '{csv_file_path}' 有效信息为空或仅包含表头。")
+    if 'Risk' in df.columns:
+        df = df.dropna(subset=['Risk'])
+        if df.empty:
+            print("警告：在删除'Risk'为空的行后，DataFrame为空。")
+            return df
+
+    if len(df) < 1:
+        raise ValueError(f"CSV文件 '{csv_file_path}' 有效信息为空或仅包含表头。")
+
+    print("步骤 2: 合并重复漏洞的CVE并去重...")
+    df_transformed = _merge_duplicate_findings(df)
+    print(f"  - 合并后，记录数从 {len(df)} 减少到 {len(df_transformed)}")
+
+    df_final = _finalize_nessus_frame(df_transformed, _get_scan_date(csv_file_path))
     print("最终输出列名:", df_final.columns.tolist())
-    df_final.to_csv(r'H:\RagCline\out.csv', index=False)
     print("数据转换完成。")
     return df_final
 
 
+def iter_nessus_data_chunks(csv_file_path, chunksize: int = 50000,
+                            batch_size: int = 5000) -> Iterator[pd.DataFrame]:
+    """
+    transform_nessus_data 的流式版本：分块读取 CSV，增量合并重复发现项，
+    最后按 batch_size 产出可直接交给 add_ids_and_uuid / insert_vulnerability_data 的 DataFrame 批次。
+
+    峰值内存只取决于 chunksize 和不重复发现项的数量，与文件大小无关。
+    重复项可能出现在文件任意位置，因此必须读完整个文件后才能产出第一个批次。
+
+    :param csv_file_path: CSV 文件路径或文件对象
+    :param chunksize: 每次从 CSV 读取的原始行数
+    :param batch_size: 每个产出批次的最大行数
+    """
+    merger = _IncrementalFindingMerger()
+    total_rows = 0
+    for chunk_no, chunk in enumerate(pd.read_csv(csv_file_path, chunksize=chunksize), start=1):
+        total_rows += len(chunk)
+        if 'Risk' in chunk.columns:
+            chunk = chunk.dropna(subset=['Risk'])
+        if chunk.empty:
+            continue
+
+        merger.add(chunk)
+        print(f"  - 已读取第 {chunk_no} 块，累计原始行数 {total_rows}，当前不重复发现项 {len(merger)} 条")
+
+    if total_rows < 1:
+        raise ValueError(f"CSV文件 '{csv_file_path}' 有效信息为空或仅包含表头。")
+    merged = merger.result()
+    if merged is None:
+        print("警告：在删除'Risk'为空的行后，DataFrame为空。")
+        return
+
+    print(f"  - 合并后，记录数从 {total_rows} 减少到 {len(merged)}")
+    scan_date = _get_scan_date(csv_file_path)
+    for start in range(0, len(merged), batch_size):
+        yield _finalize_nessus_frame(merged.iloc[start:start + batch_size], scan_date)
+    print("分块数据转换完成。")
+
+
 # def add_ids_and_uuid_inplace(
 #         connection,
 #         df: pd.DataFrame,
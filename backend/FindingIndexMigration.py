@@ -0,0 +1,96 @@
+# FindingIndexMigration.py
+# 为 finding_cve 和过滤列索引出现之前创建的漏洞表补建索引（idx_host_risk、idx_plugin_id、idx_timestamp），
+# 把这些表中逗号拼接的 cve 列展开写入 finding_cve，并从原始行重建每天的汇总表（MySqlSource.FINDING_SUMMARY_TABLES）。
+# 新写入的数据由 MySqlSource.insert_vulnerability_data 直接维护；汇总表在某天被重建或完整写入之前不会用于该天的统计。
+# 各步骤都可以重复执行：已有的索引和已存在的关联行会被跳过，每天的汇总整体重算。
+#
+# 命令行用法:
+#   python FindingIndexMigration.py --username rag [--skip-indexes] [--skip-cves] [--skip-summaries] [--batch-size 50000]
+import argparse
+import os
+import sys
+
+# Add the current directory to the Python path for module imports
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+import MySqlCatalog
+import MySqlPool
+import MySqlSource
+
+
+def list_vulnerability_tables(connection, db_name: str) -> list:
+    """租户数据库中带有漏洞表列的物理表（每日表和 findings 表），按名称排序。"""
+    catalog = MySqlCatalog.get_catalog()
+    return [
+        table_name for table_name in catalog.tables(connection, db_name, refresh=True)
+        if 'is_indexed_to_chroma' in (catalog.columns(connection, db_name, table_name) or ())
+    ]
+
+
+def list_logical_tables(connection, db_name: str, physical_tables: list) -> list:
+    """把物理表展开为逻辑表名：每日表就是它本身，findings 表展开为其中出现过的每个扫描日期（YYYY_MM_DD）。"""
+    logical = []
+    for table_name in physical_tables:
+        if table_name != MySqlSource.FINDINGS_TABLE:
+            logical.append(table_name)
+            continue
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"SELECT DISTINCT `scan_date` FROM `{db_name}`.`{MySqlSource.FINDINGS_TABLE}` ORDER BY `scan_date`"
+            )
+            logical.extend(f"{row['scan_date']:%Y_%m_%d}" for row in cursor.fetchall())
+    return logical
+
+
+def migrate_tenant(db_name: str, indexes: bool = True, cves: bool = True, summaries: bool = True,
+                   batch_size: int = 50000) -> dict:
+    """
+    补建一个租户的过滤列索引、CVE 关联和每日汇总，
+    返回 {'indexes': {表: [新建索引]}, 'cve_rows': 新写入的关联行数, 'summary_days': 重建汇总的天数}。
+    """
+    result = {'indexes': {}, 'cve_rows': 0, 'summary_days': 0}
+    with MySqlPool.connection(db_name) as connection:
+        tables = list_vulnerability_tables(connection, db_name)
+        if not tables:
+            print(f"数据库 '{db_name}' 中没有漏洞表。")
+            return result
+        print(f"数据库 '{db_name}' 中有 {len(tables)} 张漏洞表。")
+
+        if indexes:
+            for table_name in tables:
+                created = MySqlSource.ensure_vulnerability_indexes(connection, db_name, table_name)
+                if created:
+                    result['indexes'][table_name] = created
+        if summaries and MySqlSource.uses_delta_ingest(connection, db_name):
+            # 增量入库的租户不提供按天统计，汇总无从使用
+            print(f"数据库 '{db_name}' 使用增量入库，跳过汇总重建。")
+            summaries = False
+        logical_tables = list_logical_tables(connection, db_name, tables) if cves or summaries else []
+        if cves:
+            for table_name in logical_tables:
+                result['cve_rows'] += MySqlSource.backfill_finding_cves(connection, db_name, table_name, batch_size)
+        if summaries:
+            # CVE 汇总取自 finding_cve，因此放在补写关联之后
+            for table_name in logical_tables:
+                if MySqlSource.rebuild_finding_summaries(connection, db_name, table_name):
+                    result['summary_days'] += 1
+    print(f"完成: {len(result['indexes'])} 张表新建了索引，CVE 关联新写入 {result['cve_rows']} 行，"
+          f"重建了 {result['summary_days']} 天的汇总。")
+    return result
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="为已有的漏洞表补建过滤列索引、finding_cve 关联和每日汇总。")
+    parser.add_argument('--username', required=True, action='append', help="用户名，即 MySQL 数据库名，可重复")
+    parser.add_argument('--skip-indexes', action='store_true', help="不补建 host/risk、plugin_id、timestamp 索引")
+    parser.add_argument('--skip-cves', action='store_true', help="不补写 finding_cve")
+    parser.add_argument('--skip-summaries', action='store_true', help="不重建每日汇总表")
+    parser.add_argument('--batch-size', type=int, default=50000, help="补写 CVE 关联时每批读取的行数")
+    args = parser.parse_args()
+
+    try:
+        for username in args.username:
+            migrate_tenant(username, indexes=not args.skip_indexes, cves=not args.skip_cves,
+                           summaries=not args.skip_summaries, batch_size=args.batch_size)
+    finally:
+        MySqlPool.close_pool()
@@ -0,0 +1,113 @@
+# FindingsMigration.py
+# 把租户已有的每日表（YYYY_MM_DD）合并进按扫描日期分区的 findings 表。
+# 每张每日表按主键区间分块复制（INSERT IGNORE ... SELECT，保留原 id、UUID 和索引状态），
+# 核对行数后删除源表；UUID、发件箱、发现项历史中的逻辑表名不变，迁移后由 MySqlSource.resolve_findings_table 解析到 findings。
+#
+# 命令行用法（建议在入库任务和后台同步停止时执行）:
+#   python FindingsMigration.py --username rag [--keep-source] [--chunk-size 50000] [--dry-run]
+import argparse
+import os
+import sys
+
+# Add the current directory to the Python path for module imports
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+import MySqlCatalog
+import MySqlPool
+import MySqlSource
+
+
+def list_daily_tables(connection, db_name: str) -> list:
+    """租户数据库中所有按日期命名、且带有漏洞表列的每日表，按日期排序。"""
+    catalog = MySqlCatalog.get_catalog()
+    return [
+        table_name for table_name in catalog.tables(connection, db_name, refresh=True)
+        if MySqlSource.DAILY_TABLE_PATTERN.match(table_name)
+        and 'is_indexed_to_chroma' in (catalog.columns(connection, db_name, table_name) or ())
+    ]
+
+
+def migrate_daily_table(connection, db_name: str, table_name: str, chunk_size: int = 50000,
+                        drop_source: bool = True) -> dict:
+    """
+    把一张每日表复制进 findings 表，返回 {'table', 'source_rows', 'copied', 'dropped'}。
+    每个主键区间单独提交，大表不会形成一个巨大的事务；目标中已存在的 (scan_date, id) 会被忽略，中断后可以重复执行。
+    只有 findings 中该日期的行数不少于源表行数时才删除源表。
+    """
+    scan_date = table_name.replace('_', '-')
+    columns = [col for col in MySqlSource.VULNERABILITY_TABLE_TEMPLATE
+               if col in (MySqlCatalog.get_catalog().columns(connection, db_name, table_name) or ())]
+    column_list = ", ".join(f"`{col}`" for col in columns)
+
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"SELECT COUNT(*) AS source_rows, MIN(`id`) AS min_id, MAX(`id`) AS max_id FROM `{db_name}`.`{table_name}`"
+        )
+        stats = cursor.fetchone()
+    source_rows = stats['source_rows']
+
+    copied = 0
+    if source_rows:
+        for start in range(int(stats['min_id']), int(stats['max_id']) + 1, chunk_size):
+            with connection.cursor() as cursor:
+                copied += cursor.execute(
+                    f"INSERT IGNORE INTO `{db_name}`.`{MySqlSource.FINDINGS_TABLE}` ({column_list}, `scan_date`) "
+                    f"SELECT {column_list}, %s FROM `{db_name}`.`{table_name}` WHERE `id` BETWEEN %s AND %s",
+                    (scan_date, start, start + chunk_size - 1)
+                )
+            connection.commit()
+
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"SELECT COUNT(*) AS target_rows FROM `{db_name}`.`{MySqlSource.FINDINGS_TABLE}` WHERE `scan_date` = %s",
+            (scan_date,)
+        )
+        target_rows = cursor.fetchone()['target_rows']
+
+    dropped = False
+    if target_rows < source_rows:
+        print(f"错误: 表 '{table_name}' 有 {source_rows} 行，findings 中该日期只有 {target_rows} 行，保留源表。")
+    elif drop_source:
+        with connection.cursor() as cursor:
+            cursor.execute(f"DROP TABLE `{db_name}`.`{table_name}`")
+        connection.commit()
+        MySqlCatalog.invalidate(db_name)
+        dropped = True
+    print(f"  - 表 '{table_name}': 源表 {source_rows} 行，新复制 {copied} 行"
+          f"{'，源表已删除' if dropped else ''}")
+    return {'table': table_name, 'source_rows': source_rows, 'copied': copied, 'dropped': dropped}
+
+
+def migrate_tenant(db_name: str, chunk_size: int = 50000, drop_source: bool = True, dry_run: bool = False) -> list:
+    """把一个租户的全部每日表合并进 findings 表，返回每张表的迁移结果。"""
+    with MySqlPool.connection(db_name) as connection:
+        tables = list_daily_tables(connection, db_name)
+        if not tables:
+            print(f"数据库 '{db_name}' 中没有需要迁移的每日表。")
+            return []
+        print(f"数据库 '{db_name}' 中有 {len(tables)} 张每日表待迁移: {tables[0]} ... {tables[-1]}")
+        if dry_run:
+            return [{'table': table_name, 'dry_run': True} for table_name in tables]
+
+        if not MySqlSource.create_findings_table(connection, db_name, tables):
+            raise RuntimeError(f"无法在数据库 '{db_name}' 中创建或扩展 findings 表。")
+        results = [migrate_daily_table(connection, db_name, table_name, chunk_size, drop_source)
+                   for table_name in tables]
+    print(f"迁移完成: {sum(r['copied'] for r in results)} 行已复制，"
+          f"{sum(r['dropped'] for r in results)}/{len(results)} 张每日表已删除。")
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="把租户的每日表（YYYY_MM_DD）合并进按扫描日期分区的 findings 表。")
+    parser.add_argument('--username', required=True, action='append', help="用户名，即 MySQL 数据库名，可重复")
+    parser.add_argument('--chunk-size', type=int, default=50000, help="每次复制的主键区间大小")
+    parser.add_argument('--keep-source', action='store_true', help="复制后保留每日表（不删除）")
+    parser.add_argument('--dry-run', action='store_true', help="只列出待迁移的表")
+    args = parser.parse_args()
+
+    try:
+        for username in args.username:
+            migrate_tenant(username, args.chunk_size, drop_source=not args.keep_source, dry_run=args.dry_run)
+    finally:
+        MySqlPool.close_pool()
@@ -0,0 +1,201 @@
+# IngestJobs.py
+# 上传文件的后台入库任务队列：有界线程池 + 按租户限制并发 + 分阶段进度查询。
+import configparser
+import os
+import threading
+import time
+import traceback
+import uuid
+from collections import OrderedDict, defaultdict, deque
+from concurrent.futures import ThreadPoolExecutor
+
+# 每个入库任务依次经历的阶段
+INGEST_STAGES = ('parse', 'insert', 'index')
+
+
+def load_ingest_config(config_path='config.ini') -> dict:
+    """从 config.ini 的 [INGEST] 节读取任务队列配置，缺省时使用默认值。"""
+    config = configparser.ConfigParser()
+    config.read(os.path.join(os.path.dirname(__file__), config_path))
+    return {
+        'max_workers': config.getint('INGEST', 'max_workers', fallback=4),
+        'max_jobs_per_tenant': config.getint('INGEST', 'max_jobs_per_tenant', fallback=1),
+        'max_finished_jobs': config.getint('INGEST', 'max_finished_jobs', fallback=1000),
+        'spool_dir': config.get('INGEST', 'spool_dir', fallback=''),
+        'max_processes': config.getint('INGEST', 'max_processes', fallback=0) or None,
+        'max_bundle_files': config.getint('INGEST', 'max_bundle_files', fallback=500),
+        'max_bundle_mb': config.getint('INGEST', 'max_bundle_mb', fallback=10240),
+    }
+
+
+class IngestJob:
+    """一个入库任务的状态记录。各阶段的进度由执行任务的工作线程更新，由 HTTP 线程读取。"""
+
+    def __init__(self, tenant: str, filename: str, content_hash: str = None, options_key: str = '',
+                 table_name: str = None):
+        self.job_id = uuid.uuid4().hex
+        self.tenant = tenant
+        self.filename = filename
+        self.content_hash = content_hash  # 上传文件的整体内容哈希，成功后登记到租户的上传登记表
+        self.options_key = options_key  # 影响入库结果的选项，与内容哈希、目标表一起构成上传登记的键
+        self.table_name = table_name  # 写入的逻辑表名
+        self.status = 'queued'  # queued -> running -> succeeded / failed
+        self.stages = {stage: {'status': 'pending', 'rows': 0} for stage in INGEST_STAGES}
+        self.stages['insert']['duplicates'] = 0  # 插入前按指纹过滤掉的已存在发现项
+        self.stages['insert']['unchanged'] = 0  # 增量入库时内容未变化、只记录出现的发现项
+        self.result = None
+        self.error = None
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self._lock = threading.Lock()
+
+    def start_stage(self, stage: str):
+        with self._lock:
+            self.stages[stage]['status'] = 'running'
+            self.stages[stage]['started_at'] = time.time()
+
+    def add_rows(self, stage: str, rows: int, key: str = 'rows'):
+        with self._lock:
+            self.stages[stage][key] += rows
+
+    def finish_stage(self, stage: str, status: str = 'done'):
+        with self._lock:
+            self.stages[stage]['status'] = status
+            self.stages[stage]['finished_at'] = time.time()
+
+    def to_dict(self) -> dict:
+        with self._lock:
+            return {
+                'job_id': self.job_id,
+                'tenant': self.tenant,
+                'filename': self.filename,
+                'content_hash': self.content_hash,
+                'options_key': self.options_key,
+                'table_name': self.table_name,
+                'status': self.status,
+                'stages': {stage: self._stage_with_rate(info) for stage, info in self.stages.items()},
+                'result': self.result,
+                'error': self.error,
+                'created_at': self.created_at,
+                'started_at': self.started_at,
+                'finished_at': self.finished_at,
+            }
+
+
+    @staticmethod
+    def _stage_with_rate(info: dict) -> dict:
+        # 阶段吞吐量：运行中的阶段按当前时间计算
+        info = dict(info)
+        if 'started_at' in info:
+            elapsed = info.get('finished_at', time.time()) - info['started_at']
+            info['rows_per_second'] = round(info['rows'] / elapsed, 1) if elapsed > 0 else None
+        return info
+
+
+class IngestJobManager:
+    """
+    有界的后台入库任务调度器。
+
+    - 所有任务共享一个大小为 max_workers 的线程池。
+    - 同一租户同时运行的任务数不超过 max_jobs_per_tenant，多出的任务在该租户自己的队列中等待，
+      不会占用线程池，因此一个用户的大文件不会饿死其他用户。
+    - 已结束的任务最多保留 max_finished_jobs 个，供 /api/jobs/{id} 查询。
+    """
+
+    def __init__(self, max_workers: int = 4, max_jobs_per_tenant: int = 1, max_finished_jobs: int = 1000):
+        self.max_jobs_per_tenant = max_jobs_per_tenant
+        self.max_finished_jobs = max_finished_jobs
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='ingest')
+        self._lock = threading.Lock()
+        self._jobs = OrderedDict()  # job_id -> IngestJob，按创建顺序
+        self._running = defaultdict(int)  # tenant -> 正在运行的任务数
+        self._pending = defaultdict(deque)  # tenant -> 等待中的 (job, func, args, kwargs)
+
+    def submit(self, tenant: str, filename: str, func, *args, content_hash: str = None, options_key: str = '',
+               table_name: str = None, **kwargs) -> IngestJob:
+        """
+        提交一个入库任务并立即返回。func 会在工作线程中以 func(job, *args, **kwargs) 的形式调用，
+        其返回值保存为任务结果。content_hash / options_key / table_name 只记录在 job 上，不传给 func。
+        """
+        job = IngestJob(tenant, filename, content_hash, options_key, table_name)
+        with self._lock:
+            self._enqueue(job, func, args, kwargs)
+        return job
+
+    def submit_unless_active(self, tenant: str, filename: str, func, *args, content_hash: str,
+                             options_key: str = '', table_name: str = None, **kwargs):
+        """
+        与 submit 相同，但在同一把锁内先查找同一租户、同一内容、同一选项和目标表的任务：
+        仍在排队/运行或已经成功的任务直接返回，不再提交。并发的相同上传因此只会入库一次。
+
+        :return: (任务, 是否为新提交的任务)
+        """
+        with self._lock:
+            previous = self._find_upload_locked(tenant, content_hash, options_key, table_name)
+            if previous is not None:
+                return previous, False
+            job = IngestJob(tenant, filename, content_hash, options_key, table_name)
+            self._enqueue(job, func, args, kwargs)
+        return job, True
+
+    def get(self, job_id: str):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def _find_upload_locked(self, tenant: str, content_hash: str, options_key: str, table_name: str):
+        # 调用方持有 self._lock；失败的任务不算，相同的上传可以重试
+        for job in reversed(self._jobs.values()):
+            if job.tenant == tenant and job.content_hash == content_hash and job.options_key == options_key \
+                    and job.table_name == table_name and job.status != 'failed':
+                return job
+        return None
+
+    def _enqueue(self, job: IngestJob, func, args, kwargs):
+        # 调用方持有 self._lock
+        self._jobs[job.job_id] = job
+        self._prune_finished_jobs()
+        if self._running[job.tenant] < self.max_jobs_per_tenant:
+            self._running[job.tenant] += 1
+            self._executor.submit(self._run, job, func, args, kwargs)
+        else:
+            print(f"信息: 租户 '{job.tenant}' 已有 {self._running[job.tenant]} 个任务在运行，"
+                  f"任务 {job.job_id} 进入等待队列。")
+            self._pending[job.tenant].append((job, func, args, kwargs))
+
+    def _run(self, job: IngestJob, func, args, kwargs):
+        job.status = 'running'
+        job.started_at = time.time()
+        try:
+            job.result = func(job, *args, **kwargs)
+            job.status = 'succeeded'
+        except Exception as e:
+            traceback.print_exc()
+            job.error = str(e)
+            job.status = 'failed'
+            for stage, info in job.stages.items():
+                if info['status'] == 'running':
+                    job.finish_stage(stage, status='failed')
+        finally:
+            job.finished_at = time.time()
+            self._on_job_finished(job.tenant)
+
+    def _on_job_finished(self, tenant: str):
+        # 该租户的下一个任务直接占用刚释放出来的名额
+        with self._lock:
+            if self._pending[tenant]:
+                job, func, args, kwargs = self._pending[tenant].popleft()
+                self._executor.submit(self._run, job, func, args, kwargs)
+            else:
+                self._running[tenant] -= 1
+                del self._pending[tenant]
+                if self._running[tenant] == 0:
+                    del self._running[tenant]
+
+    def _prune_finished_jobs(self):
+        finished = [job_id for job_id, job in self._jobs.items() if job.finished_at is not None]
+        for job_id in finished[:max(0, len(finished) - self.max_finished_jobs)]:
+            del self._jobs[job_id]
+
+    def shutdown(self, wait: bool = False):
+        self._executor.shutdown(wait=wait, cancel_futures=True)
@@ -0,0 +1,229 @@
+# IngestPipeline.py
+# 上传文件的完整入库流程：解析 -> 分配ID并写入 MySQL -> 同步到 ChromaDB。
+# 由 IngestJobs 在后台工作线程中执行，每个任务从 MySqlPool 借出自己的 MySQL 连接。
+import os
+
+import pandas as pd
+
+import CsvDataOp
+import MySqlPool
+import MySqlSource
+import NessusXmlOp
+import utils
+
+
+def iter_transformed_batches(source, source_format: str = 'csv', chunked: bool = False,
+                             engine: str = 'pandas'):
+    """根据文件格式和读取模式，统一产出可入库的 DataFrame 批次。"""
+    if source_format == 'nessus':
+        yield from NessusXmlOp.iter_nessus_xml_chunks(source)
+    elif chunked:
+        yield from CsvDataOp.iter_nessus_data_chunks(source)
+    else:
+        df = CsvDataOp.transform_nessus_data(source, engine=engine)
+        if not df.empty:
+            yield df
+
+
+def ingest_nessus_upload(job, db_name: str, table_name: str, collection_name: str, source,
+                         chroma_client, source_format: str = 'csv', chunked: bool = False,
+                         engine: str = 'pandas', delta: bool = False, delete_source: bool = False) -> dict:
+    """
+    执行一次上传的入库任务，并在 job 上记录 parse / insert / index 三个阶段的进度。
+
+    :param job: IngestJobs.IngestJob，用于上报进度
+    :param source: 文件路径或文件对象
+    :param source_format: 'csv' 或 'nessus'
+    :param chroma_client: 为 None 时不在任务内同步 ChromaDB，index 阶段标记为 deferred，由后台同步追平
+    :param delta: 为 True 时按发现项历史增量入库，未变化的发现项只记录出现
+    :param delete_source: 为 True 时，任务结束后删除 source 指向的（上传落盘的）临时文件
+    :return: 任务结果，即原同步接口返回的 JSON 内容
+    """
+    try:
+        return _run_ingest(job, db_name, table_name, collection_name, source, chroma_client,
+                           source_format, chunked, engine, delta)
+    finally:
+        if delete_source and isinstance(source, str) and os.path.exists(source):
+            os.remove(source)
+
+
+# [STORAGE] mode：'daily' 每天一张表；'partitioned' 写入租户的 findings 分区表
+STORAGE_CONFIG = MySqlSource.load_storage_config()
+
+
+def prepare_target_table(connection, db_name: str, table_name: str, delta: bool = False):
+    """
+    Ensure MySQL database and table exist（增量入库时同时确保发现项历史表存在）
+    合并存储时确保 findings 表及 table_name 对应月份的分区存在，不再创建每日表。
+
+    租户可以随时改为增量入库，但从此不再提供按天的汇总和统计（未变化的发现项不再写入当天的表，按天统计会少计）：
+    先创建发现项历史表，之后的写入不再维护汇总，再删除之前的汇总表。
+    """
+    MySqlSource.create_database(connection, db_name)
+    if STORAGE_CONFIG['mode'] == 'partitioned':
+        if not MySqlSource.create_findings_table(connection, db_name, [table_name]):
+            raise RuntimeError(f"无法在数据库 '{db_name}' 中创建或扩展 findings 表。")
+    else:
+        MySqlSource.create_pd_table(connection, db_name, table_name, use_vulnerability_template=True)
+    if delta:
+        if not MySqlSource.create_finding_history_tables(connection, db_name):
+            raise RuntimeError(f"无法在数据库 '{db_name}' 中创建发现项历史表。")
+        if MySqlSource.uses_finding_summaries(connection, db_name):
+            print(f"信息: 租户 '{db_name}' 改为增量入库，删除按天的汇总表，此后不再提供按天统计。")
+            if not MySqlSource.drop_finding_summary_tables(connection, db_name):
+                raise RuntimeError(f"无法删除数据库 '{db_name}' 中的汇总表。")
+
+
+def drop_existing_findings(connection, db_name: str, table_name: str, batch):
+    """
+    在分配 ID 之前去掉表中已存在（以及批次内重复）的发现项，返回 (新发现项, 重复行数)。
+    重复上传同一份扫描时，不再为注定被 INSERT IGNORE 丢弃的行消耗 ID 区间、生成 UUID 和清洗数据。
+    """
+    new_rows = batch.drop_duplicates(subset='fingerprint')
+    existing = MySqlSource.get_existing_fingerprints(connection, db_name, table_name, new_rows['fingerprint'])
+    if existing:
+        new_rows = new_rows[~new_rows['fingerprint'].isin(existing)]
+    return new_rows.reset_index(drop=True), len(batch) - len(new_rows)
+
+
+def split_unchanged_findings(connection, db_name: str, table_name: str, batch):
+    """
+    增量入库：按指纹和内容哈希与租户的发现项历史比对，返回 (新增或变化的发现项, 全部出现记录)。
+    未变化的发现项只记录一次出现，其完整行和向量仍是历史中 last_table 那张表里的那一份。
+    """
+    batch = batch.assign(content_hash=CsvDataOp.generate_content_hashes(batch))
+    history = MySqlSource.get_finding_history(connection, db_name, batch['fingerprint'])
+    previous = batch['fingerprint'].map(lambda fp: history.get(fp, {}).get('content_hash'))
+    unchanged = previous.eq(batch['content_hash'])
+
+    sighting_columns = ['fingerprint', 'content_hash', 'timestamp']
+    sightings = pd.concat([
+        batch.loc[~unchanged, sighting_columns].assign(source_table=table_name),
+        batch.loc[unchanged, sighting_columns].assign(
+            source_table=batch.loc[unchanged, 'fingerprint'].map(lambda fp: history[fp]['last_table'])
+        ),
+    ], ignore_index=True)
+    return batch[~unchanged].reset_index(drop=True), sightings
+
+
+def write_batch(job, connection, db_name: str, table_name: str, batch, delta: bool = False,
+                outbox: bool = True, summaries: bool = True) -> int:
+    """
+    为一个批次中的新发现项分配 ID/UUID 并写入 MySQL，返回实际插入的行数。
+    ID 区间通过 MySqlSource.reserve_id_range 原子预留，多个任务可以同时写入同一张表。
+    delta=True 时只写入相对历史新增或内容有变化的发现项，并为批次中的每个发现项记录一次出现。
+    outbox=True 时把写入的 id 区间记入 chroma_outbox，留给后台同步索引；任务自己同步 ChromaDB 时
+    应传 False，否则只有 ChromaSync 才会清理的发件箱会无限增长。
+    summaries=True 时同时累加按天的汇总；增量入库的租户不维护汇总，由调用方在任务开始时用 uses_delta_ingest 判断一次。
+    """
+    sightings = None
+    if delta:
+        batch, sightings = split_unchanged_findings(connection, db_name, table_name, batch)
+        job.add_rows('insert', len(sightings) - len(batch), key='unchanged')
+
+    rows, existing = _insert_new_findings(job, connection, db_name, table_name, batch, outbox, summaries)
+
+    if sightings is not None:
+        # 当天的表中已有同一指纹的行时，新内容不会写入（INSERT IGNORE），历史也不能改成新内容的哈希；
+        # 批次内同一指纹重复时与写入一致，只取第一条
+        sightings = sightings[~sightings['fingerprint'].isin(existing)].drop_duplicates(subset='fingerprint')
+
+    # 完整行提交之后再记录出现，保证历史中的 last_table 总能找到对应的行
+    if sightings is not None and MySqlSource.record_finding_sightings(connection, db_name, sightings) < 0:
+        raise RuntimeError(f"记录表 '{table_name}' 的发现项出现失败。")
+    return rows
+
+
+def _insert_new_findings(job, connection, db_name: str, table_name: str, batch, outbox: bool = True,
+                         summaries: bool = True):
+    """写入批次中表里还没有的发现项，返回 (插入行数, 表中已存在而未写入的指纹集合)。"""
+    new_rows, duplicates = drop_existing_findings(connection, db_name, table_name, batch)
+    existing = set(batch['fingerprint']) - set(new_rows['fingerprint'])
+    batch = new_rows
+    job.add_rows('insert', duplicates, key='duplicates')
+    if batch.empty:
+        print(f"信息: 批次中没有需要写入表 '{table_name}' 的新发现项（重复 {duplicates} 条），跳过插入。")
+        return 0, existing
+    batch = utils.add_ids_and_uuid(connection, db_name, batch, table_name)
+    rows = MySqlSource.insert_vulnerability_data(connection, db_name, table_name, batch, outbox=outbox,
+                                                 summaries=summaries)
+    if rows < 0:
+        raise RuntimeError(f"批量插入表 '{table_name}' 失败。")
+    job.add_rows('insert', rows)
+    return rows, existing
+
+
+def index_table(job, connection, chroma_client, db_name: str, table_name: str, collection_name: str) -> int:
+    """Sync data from MySQL to ChromaDB（直到表中没有未索引的行），返回本次索引的行数。"""
+    job.start_stage('index')
+    processed, _ = MySqlSource.sync_mysql_to_chromadb(
+        connection=connection,
+        chroma_client=chroma_client,
+        db_name=db_name,
+        table_name=table_name,
+        collection_name=collection_name,
+        batch_size=1000,
+        on_batch=lambda metrics: job.add_rows('index', metrics['rows'])
+    )
+    if processed < 0:
+        raise RuntimeError(f"同步表 '{table_name}' 到 ChromaDB 失败。")
+    job.finish_stage('index')
+    return processed
+
+
+def register_upload(job, connection, db_name: str, table_name: str, result: dict):
+    """任务成功后，把上传内容哈希、入库选项和任务结果登记到租户的上传登记表，供相同上传再次提交时直接返回。"""
+    if job.content_hash:
+        MySqlSource.save_upload_record(connection, db_name, job.content_hash, job.filename,
+                                       job.job_id, table_name, result, job.options_key)
+
+
+def _run_ingest(job, db_name, table_name, collection_name, source, chroma_client,
+                source_format, chunked, engine, delta) -> dict:
+    # 整个任务独占一个从连接池借出的连接，pymysql 连接不能在线程间共享
+    pool = MySqlPool.get_pool()
+    connection = pool.acquire()
+
+    try:
+        prepare_target_table(connection, db_name, table_name, delta)
+        # 增量入库的租户不提供按天统计，也就不维护汇总；每个任务只判断一次
+        summaries = not MySqlSource.uses_delta_ingest(connection, db_name)
+
+        job.start_stage('parse')
+        transformed = 0
+        for batch in iter_transformed_batches(source, source_format, chunked, engine):
+            if transformed == 0:
+                job.start_stage('insert')
+            transformed += len(batch)
+            job.add_rows('parse', len(batch))
+            # 任务内同步 ChromaDB 时不写发件箱；只有交给后台同步（chroma_client 为 None）时才需要
+            write_batch(job, connection, db_name, table_name, batch, delta,
+                        outbox=chroma_client is None, summaries=summaries)
+        job.finish_stage('parse')
+
+        if transformed == 0:
+            raise ValueError("Processed file is empty or invalid.")
+        job.finish_stage('insert')
+
+        processed = 0
+        if chroma_client is not None:
+            processed = index_table(job, connection, chroma_client, db_name, table_name, collection_name)
+        else:
+            # 由 ChromaSync 后台同步负责索引
+            job.finish_stage('index', status='deferred')
+
+        result = {
+            "message": f"File '{job.filename}' processed and stored successfully.",
+            "database": db_name,
+            "table": table_name,
+            "collection": collection_name,
+            "rows_parsed": transformed,
+            "rows_inserted": job.stages['insert']['rows'],
+            "rows_duplicate": job.stages['insert']['duplicates'],
+            "rows_unchanged": job.stages['insert']['unchanged'],
+            "rows_indexed": processed,
+        }
+        register_upload(job, connection, db_name, table_name, result)
+        return result
+    finally:
+        pool.release(connection)
@@ -0,0 +1,138 @@
+# MySqlCatalog.py
+# 进程内的表结构目录：缓存租户数据库、表、列和索引名，热路径上的“表是否存在 / 有哪些列”不再查询 information_schema。
+# information_schema 在库和表很多时查询很慢；目录按数据库整体加载（每个库一次 COLUMNS + 一次 STATISTICS 查询），
+# 本进程内的 DDL（create_pd_table、delete_database 等）会主动失效对应的库，其他进程的变更在 ttl 内可见。
+import configparser
+import os
+import threading
+import time
+
+# 不属于任何租户的系统库
+SYSTEM_SCHEMAS = ('mysql', 'sys', 'information_schema', 'performance_schema')
+
+
+def load_catalog_config(config_path='config.ini') -> dict:
+    """从 config.ini 的 [MYSQL_CATALOG] 节读取目录缓存配置，缺省时使用默认值。"""
+    config = configparser.ConfigParser()
+    config.read(os.path.join(os.path.dirname(__file__), config_path))
+    return {
+        'ttl': config.getfloat('MYSQL_CATALOG', 'ttl', fallback=300.0),
+        'miss_refresh_interval': config.getfloat('MYSQL_CATALOG', 'miss_refresh_interval', fallback=5.0),
+    }
+
+
+class SchemaCatalog:
+    """
+    线程安全的表结构目录缓存。
+
+    - 每个数据库的快照包含 {表: [列, ...]} 和 {表: {索引名, ...}}，首次使用时加载，超过 ttl 秒后重新加载。
+    - 查找的表不在快照中时，若快照已超过 miss_refresh_interval 秒则立即重新加载一次（strict=True 时总是重新加载），
+      其他进程刚创建的表很快就能被看到，而不存在的表不会让每次调用都查询 information_schema。
+    - cache_miss=True 用于大多数租户都没有、却在热路径上反复检查的标记表（如 finding_history）：
+      不存在的结果一直沿用到 invalidate 或 ttl 到期，不触发上面的重新加载。
+    - invalidate(db_name) 丢弃一个库（或全部）的快照，由执行 DDL 的函数调用。
+    查询使用调用方传入的连接，目录本身不持有连接。
+    """
+
+    def __init__(self, ttl: float = 300.0, miss_refresh_interval: float = 5.0):
+        self.ttl = ttl
+        self.miss_refresh_interval = miss_refresh_interval
+        self._lock = threading.Lock()
+        self._schemas = {}  # {db_name: {'tables': {...}, 'indexes': {...}, 'loaded_at': float}}
+        self._databases = None  # (数据库列表, 加载时间)
+
+    def _load_schema(self, connection, db_name: str) -> dict:
+        tables = {}
+        indexes = {}
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT TABLE_NAME AS table_name, COLUMN_NAME AS column_name FROM information_schema.COLUMNS "
+                "WHERE TABLE_SCHEMA = %s ORDER BY TABLE_NAME, ORDINAL_POSITION",
+                (db_name,)
+            )
+            for row in cursor.fetchall():
+                tables.setdefault(row['table_name'], []).append(row['column_name'])
+            cursor.execute(
+                "SELECT DISTINCT TABLE_NAME AS table_name, INDEX_NAME AS index_name FROM information_schema.STATISTICS "
+                "WHERE TABLE_SCHEMA = %s",
+                (db_name,)
+            )
+            for row in cursor.fetchall():
+                indexes.setdefault(row['table_name'], set()).add(row['index_name'])
+        return {'tables': tables, 'indexes': indexes, 'loaded_at': time.monotonic()}
+
+    def _schema(self, connection, db_name: str, refresh: bool = False) -> dict:
+        with self._lock:
+            schema = self._schemas.get(db_name)
+        if refresh or schema is None or time.monotonic() - schema['loaded_at'] > self.ttl:
+            schema = self._load_schema(connection, db_name)
+            with self._lock:
+                self._schemas[db_name] = schema
+        return schema
+
+    def _schema_with_table(self, connection, db_name: str, table_name: str, strict: bool = False,
+                           cache_miss: bool = False) -> dict:
+        schema = self._schema(connection, db_name)
+        if table_name not in schema['tables'] and \
+                (strict or not cache_miss and time.monotonic() - schema['loaded_at'] > self.miss_refresh_interval):
+            schema = self._schema(connection, db_name, refresh=True)
+        return schema
+
+    def databases(self, connection, refresh: bool = False) -> list:
+        """所有非系统数据库的名称（即各租户的数据库）。"""
+        with self._lock:
+            cached = self._databases
+        if refresh or cached is None or time.monotonic() - cached[1] > self.ttl:
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    f"SELECT SCHEMA_NAME AS db_name FROM information_schema.SCHEMATA "
+                    f"WHERE SCHEMA_NAME NOT IN ({', '.join(['%s'] * len(SYSTEM_SCHEMAS))}) ORDER BY SCHEMA_NAME",
+                    SYSTEM_SCHEMAS
+                )
+                cached = ([row['db_name'] for row in cursor.fetchall()], time.monotonic())
+            with self._lock:
+                self._databases = cached
+        return list(cached[0])
+
+    def tables(self, connection, db_name: str, refresh: bool = False) -> list:
+        """数据库中所有表的名称（按名称排序）。"""
+        return sorted(self._schema(connection, db_name, refresh)['tables'])
+
+    def columns(self, connection, db_name: str, table_name: str, strict: bool = False) -> list:
+        """表的列名（按定义顺序）；表不存在时返回 None。"""
+        columns = self._schema_with_table(connection, db_name, table_name, strict)['tables'].get(table_name)
+        return list(columns) if columns is not None else None
+
+    def table_exists(self, connection, db_name: str, table_name: str, strict: bool = False,
+                     cache_miss: bool = False) -> bool:
+        return table_name in self._schema_with_table(connection, db_name, table_name, strict, cache_miss)['tables']
+
+    def has_index(self, connection, db_name: str, table_name: str, index_name: str) -> bool:
+        return index_name in self._schema_with_table(connection, db_name, table_name)['indexes'].get(table_name, ())
+
+    def invalidate(self, db_name: str = None):
+        """丢弃 db_name 的快照；db_name 为空时丢弃全部快照和数据库列表。"""
+        with self._lock:
+            if db_name is None:
+                self._schemas.clear()
+            else:
+                self._schemas.pop(db_name, None)
+            self._databases = None
+
+
+_catalog = None
+_catalog_lock = threading.Lock()
+
+
+def get_catalog() -> SchemaCatalog:
+    """返回进程内共享的表结构目录，首次调用时按 config.ini 创建。"""
+    global _catalog
+    with _catalog_lock:
+        if _catalog is None:
+            _catalog = SchemaCatalog(**load_catalog_config())
+        return _catalog
+
+
+def invalidate(db_name: str = None):
+    """DDL 之后调用：MySqlCatalog.invalidate('tenant')。"""
+    get_catalog().invalidate(db_name)
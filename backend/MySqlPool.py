@@ -0,0 +1,229 @@
+# MySqlPool.py
+# 线程安全的 MySQL 连接池：pymysql 连接本身不是线程安全的，每个请求 / 后台任务从池中借出一个连接独占使用，
+# 用完归还，避免多线程共用同一个连接，也避免每次查询都重新解析配置、建立 TCP 连接和认证。
+import configparser
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+import pymysql
+import pymysql.cursors
+from dotenv import load_dotenv
+
+
+def load_mysql_config(config_path='config.ini'):
+    """
+    读取 MySQL 连接参数（配置与密钥分离）：
+    - 从 config.ini 的 [DATABASE] 节读取非敏感配置，port 转换为整数，local_infile 转换为布尔值。
+    - 从 .env 的 MYSQL_PASSWORD 读取密码。
+    :return: 可直接传给 pymysql.connect 的参数字典；配置缺失或有误时返回 None
+    """
+    config_parser = configparser.ConfigParser()
+    full_path = os.path.join(os.path.dirname(__file__), config_path)
+
+    if not config_parser.read(full_path):
+        print(f"错误: 找不到或无法读取 config.ini 文件于: {full_path}")
+        return None
+
+    try:
+        db_config = dict(config_parser['DATABASE'])
+    except KeyError:
+        print("错误: config.ini 文件中缺少 [DATABASE] 节。")
+        return None
+
+    # --- 关键修正：将 port 转换为整数 ---
+    if 'port' in db_config:
+        try:
+            # 将字符串类型的端口号转换为整数类型
+            db_config['port'] = int(db_config['port'])
+        except ValueError:
+            print(f"错误: config.ini 中的 port '{db_config['port']}' 不是一个有效的数字。")
+            return None
+
+    # local_infile 开启后 insert_vulnerability_data 可以使用 LOAD DATA LOCAL INFILE 批量导入
+    if 'local_infile' in db_config:
+        db_config['local_infile'] = config_parser.getboolean('DATABASE', 'local_infile')
+
+    load_dotenv()
+    db_password = os.getenv('MYSQL_PASSWORD')
+    if not db_password:
+        print("错误: .env 文件中未设置 DB_PASSWORD。")
+        return None
+
+    db_config['password'] = db_password
+    db_config['cursorclass'] = pymysql.cursors.DictCursor
+    return db_config
+
+
+def load_pool_config(config_path='config.ini') -> dict:
+    """从 config.ini 的 [MYSQL_POOL] 节读取连接池配置，缺省时使用默认值。"""
+    config = configparser.ConfigParser()
+    config.read(os.path.join(os.path.dirname(__file__), config_path))
+    return {
+        'min_size': config.getint('MYSQL_POOL', 'min_size', fallback=2),
+        'max_size': config.getint('MYSQL_POOL', 'max_size', fallback=10),
+        'health_check_interval': config.getfloat('MYSQL_POOL', 'health_check_interval', fallback=30.0),
+        'acquire_timeout': config.getfloat('MYSQL_POOL', 'acquire_timeout', fallback=10.0),
+    }
+
+
+class MySqlConnectionPool:
+    """
+    有界的 MySQL 连接池。
+
+    - 始终保持至少 min_size 个连接，最多同时存在 max_size 个连接；连接用尽时借用方最多等待 acquire_timeout 秒。
+    - 空闲超过 health_check_interval 秒的连接在借出前先 ping 一次，失效的连接直接丢弃并重建。
+    - 借出时总会切换默认数据库：指定 db_name 时切换到该租户的数据库，否则切换回配置中的数据库（[DATABASE] db），
+      上一个借用方 select_db 或 USE 过的租户库不会带给下一个借用方；归还时回滚未提交的事务。
+    """
+
+    def __init__(self, connect_kwargs: dict, min_size: int = 2, max_size: int = 10,
+                 health_check_interval: float = 30.0, acquire_timeout: float = 10.0):
+        if max_size < 1 or min_size > max_size:
+            raise ValueError(f"无效的连接池大小: min_size={min_size}, max_size={max_size}")
+        self._connect_kwargs = dict(connect_kwargs)
+        self._default_db = self._connect_kwargs.get('database') or self._connect_kwargs.get('db')
+        self.min_size = min_size
+        self.max_size = max_size
+        self.health_check_interval = health_check_interval
+        self.acquire_timeout = acquire_timeout
+        self._condition = threading.Condition()
+        self._idle = []  # [(connection, 归还时间)]，后进先出，最近用过的连接最可能仍然有效
+        self._size = 0  # 已创建且未关闭的连接数（空闲 + 借出）
+        self._closed = False
+
+        for _ in range(min_size):
+            self._idle.append((self._connect(), time.monotonic()))
+            self._size += 1
+
+    def _connect(self):
+        return pymysql.connect(**self._connect_kwargs)
+
+    def _discard(self, connection):
+        # 调用方需持有 self._condition
+        self._size -= 1
+        try:
+            connection.close()
+        except Exception:
+            pass
+
+    def acquire(self, db_name: str = None):
+        """借出一个连接，并切换到 db_name（为空时切换到配置中的默认数据库）。等待超时抛出 TimeoutError。"""
+        deadline = time.monotonic() + self.acquire_timeout
+        with self._condition:
+            while True:
+                if self._closed:
+                    raise RuntimeError("MySQL 连接池已关闭。")
+                if self._idle:
+                    connection, released_at = self._idle.pop()
+                    break
+                if self._size < self.max_size:
+                    # 先占住名额，再在锁外建立连接，避免握手期间阻塞其他借用方
+                    self._size += 1
+                    connection, released_at = None, None
+                    break
+                remaining = deadline - time.monotonic()
+                if remaining <= 0 or not self._condition.wait(remaining):
+                    raise TimeoutError(f"等待 MySQL 连接超时（{self.acquire_timeout}s，连接池上限 {self.max_size}）。")
+
+        try:
+            if connection is None:
+                connection = self._connect()
+            elif time.monotonic() - released_at > self.health_check_interval:
+                connection = self._check_health(connection)
+        except Exception:
+            with self._condition:
+                self._size -= 1
+                self._condition.notify()
+            raise
+
+        target_db = db_name or self._default_db
+        if target_db:
+            try:
+                connection.select_db(target_db)
+            except Exception:
+                self.release(connection)
+                raise
+        return connection
+
+    def _check_health(self, connection):
+        try:
+            connection.ping(reconnect=False)
+            return connection
+        except pymysql.MySQLError:
+            print("信息: 连接池中的空闲连接已失效，重新建立连接。")
+            try:
+                connection.close()
+            except Exception:
+                pass
+            return self._connect()
+
+    def release(self, connection):
+        """归还连接。已断开的连接直接丢弃，空出的名额留给下一个借用方重建。"""
+        try:
+            if connection.open:
+                connection.rollback()
+        except pymysql.MySQLError:
+            pass
+        with self._condition:
+            if self._closed or not connection.open:
+                self._discard(connection)
+            else:
+                self._idle.append((connection, time.monotonic()))
+            self._condition.notify()
+
+    @contextmanager
+    def connection(self, db_name: str = None):
+        connection = self.acquire(db_name)
+        try:
+            yield connection
+        finally:
+            self.release(connection)
+
+    def stats(self) -> dict:
+        with self._condition:
+            return {'size': self._size, 'idle': len(self._idle), 'in_use': self._size - len(self._idle),
+                    'min_size': self.min_size, 'max_size': self.max_size}
+
+    def close(self):
+        """关闭所有空闲连接；借出中的连接在归还时关闭。"""
+        with self._condition:
+            self._closed = True
+            for connection, _ in self._idle:
+                self._discard(connection)
+            self._idle.clear()
+            self._condition.notify_all()
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_pool() -> MySqlConnectionPool:
+    """返回进程内共享的连接池，首次调用时按 config.ini 创建。"""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            connect_kwargs = load_mysql_config()
+            if connect_kwargs is None:
+                raise RuntimeError("无法读取 MySQL 连接配置。")
+            _pool = MySqlConnectionPool(connect_kwargs, **load_pool_config())
+            print(f"MySQL 连接池已创建: {_pool.stats()}")
+        return _pool
+
+
+@contextmanager
+def connection(db_name: str = None):
+    """从共享连接池借出一个连接：with MySqlPool.connection('tenant') as conn: ..."""
+    with get_pool().connection(db_name) as conn:
+        yield conn
+
+
+def close_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.close()
+            _pool = None
+            print("MySQL 连接池已关闭。")
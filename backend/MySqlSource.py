@@ -1,54 +1,36 @@
 import configparser
+import csv
+import json
 import os
+import queue
+import re
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime
 
 import numpy as np
 import pandas as pd
 import pymysql
 import pymysql.cursors
-from dotenv import load_dotenv
+from pymysql.constants import CLIENT
 
+import MySqlCatalog
+import MySqlPool
 import VectorDatabase
 
 
 def connect_to_mysql(db_name=None):
     """
     1. 连接到 MySQL 服务器 (配置与密钥分离的最佳实践)
-    - 从 config.ini 读取非敏感配置。
-    - 从 .env 安全地加载密码。
-    - 确保配置项类型正确 (如 port 为整数)。
+    - 连接参数由 MySqlPool.load_mysql_config 从 config.ini 和 .env 读取。
+    - 创建一个独立的新连接，适用于脚本和一次性任务；服务内的请求和后台任务请使用 MySqlPool.connection()。
     """
-    config_parser = configparser.ConfigParser()
-    script_dir = os.path.dirname(__file__)
-    config_path = os.path.join(script_dir, 'config.ini')
-
-    if not config_parser.read(config_path):
-        print(f"错误: 找不到或无法读取 config.ini 文件于: {config_path}")
-        return None
-
-    try:
-        db_config = dict(config_parser['DATABASE'])
-    except KeyError:
-        print("错误: config.ini 文件中缺少 [DATABASE] 节。")
-        return None
-
-    # --- 关键修正：将 port 转换为整数 ---
-    if 'port' in db_config:
-        try:
-            # 将字符串类型的端口号转换为整数类型
-            db_config['port'] = int(db_config['port'])
-        except ValueError:
-            print(f"错误: config.ini 中的 port '{db_config['port']}' 不是一个有效的数字。")
-            return None
-
-    load_dotenv()
-    db_password = os.getenv('MYSQL_PASSWORD')
-    if not db_password:
-        print("错误: .env 文件中未设置 DB_PASSWORD。")
+    db_config = MySqlPool.load_mysql_config()
+    if db_config is None:
         return None
 
-    db_config['password'] = db_password
-    db_config['cursorclass'] = pymysql.cursors.DictCursor
-
     if db_name:
         db_config['db'] = db_name
 
@@ -73,6 +55,7 @@ def create_database(connection, db_name):
         with connection.cursor() as cursor:
             cursor.execute(f"CREATE DATABASE IF NOT EXISTS `{db_name}` CHARACTER SET utf8mb4")
         connection.commit()
+        MySqlCatalog.invalidate(db_name)
         print(f"数据库 '{db_name}' 创建成功或已存在。")
         return True
     except pymysql.MySQLError as e:
@@ -85,6 +68,7 @@ def delete_database(connection, db_name):
         with connection.cursor() as cursor:
             cursor.execute(f"DROP DATABASE IF EXISTS `{db_name}`")
         connection.commit()
+        MySqlCatalog.invalidate(db_name)
         print(f"数据库 '{db_name}' 已被删除。")
         return True
     except pymysql.MySQLError as e:
@@ -96,22 +80,63 @@ def delete_database(connection, db_name):
 
 
 # 辅助函数：检查表是否存在
-def table_exists(connection, table_name, db_name=None):
+def table_exists(connection, table_name, db_name=None, strict=False, cache_miss=False):
+    """
+    给出 db_name 时查询进程内的表结构目录（MySqlCatalog），命中时不访问 information_schema；
+    strict=True 时目录中没有该表会立即重新加载该库再判断（用于“不存在就丢弃”之类的决定）；
+    cache_miss=True 时表不存在的结果沿用到目录失效为止（用于热路径上检查的标记表，本进程创建它们时会使目录失效）。
+    """
     try:
+        if db_name:
+            return MySqlCatalog.get_catalog().table_exists(connection, db_name, table_name, strict, cache_miss)
         with connection.cursor() as cursor:
-            if db_name:
-                cursor.execute(
-                    "SELECT 1 FROM information_schema.tables "
-                    "WHERE table_schema = %s AND table_name = %s",
-                    (db_name, table_name)
-                )
-            else:
-                cursor.execute("SHOW TABLES LIKE %s", (table_name,))
+            cursor.execute("SHOW TABLES LIKE %s", (table_name,))
             return cursor.fetchone() is not None
     except:
         return False
 
 
+# 漏洞表模板（create_pd_table 的 use_vulnerability_template 和合并存储的 findings 表共用）
+VULNERABILITY_TABLE_TEMPLATE = {
+    # 您原有的字段 (我保留了您之前的定义，不做改动)
+    'id': 'INT UNSIGNED',
+    'uuid': 'VARCHAR(20)',
+    'fingerprint': 'VARCHAR(32)',
+    'plugin_id': 'INT UNSIGNED',
+    'cve': 'TEXT',
+    'cvss_v2_0_base_score': 'DECIMAL(3, 1)',
+    'risk': 'VARCHAR(10)',
+    'host': 'VARCHAR(255)',
+    'protocol': 'VARCHAR(10)',
+    'port': 'INT UNSIGNED',
+    'name': 'VARCHAR(255)',
+    'synopsis': 'TEXT',
+    'description': 'TEXT',
+    'solution': 'TEXT',
+    'see_also': 'TEXT',
+    'plugin_output': 'MEDIUMTEXT',
+    'stig_severity': 'VARCHAR(10)',
+    'cvss_v3_0_base_score': 'DECIMAL(3, 1)',
+    'cvss_v2_0_temporal_score': 'DECIMAL(3, 1)',
+    'cvss_v3_0_temporal_score': 'DECIMAL(3, 1)',
+    'risk_factor': 'VARCHAR(15)',
+    'bid': 'VARCHAR(255)',
+    'xref': 'TEXT',
+    'mskb': 'VARCHAR(255)',
+    'plugin_publication_date': 'DATE',
+    'plugin_modification_date': 'DATE',
+    'timestamp': 'VARCHAR(15)',
+    'is_indexed_to_chroma': 'BOOLEAN NOT NULL DEFAULT FALSE'
+}
+
+# 漏洞表常用过滤列上的二级索引 {索引名: (列, ...)}：按主机/风险、插件和扫描时间过滤时走索引，而不是全表扫描
+VULNERABILITY_INDEXES = {
+    'idx_host_risk': ('host', 'risk'),
+    'idx_plugin_id': ('plugin_id',),
+    'idx_timestamp': ('timestamp',),
+}
+
+
 def create_pd_table(connection, db_name, table_name,
                     columns_definition=None, primary_key=None, unique_keys=None, foreign_keys=None,
                     check_exists=True, use_vulnerability_template=False):
@@ -134,37 +159,7 @@ def create_pd_table(connection, db_name, table_name,
     if use_vulnerability_template:
         print(f"检测到 'use_vulnerability_template=True'，将使用预定义的、包含同步状态字段的漏洞表模板。")
         # --- 核心修改在此处 ---
-        columns_definition = {
-            # 您原有的字段 (我保留了您之前的定义，不做改动)
-            'id': 'INT UNSIGNED',
-            'uuid': 'VARCHAR(20)',
-            'fingerprint': 'VARCHAR(32)',
-            'plugin_id': 'INT UNSIGNED',
-            'cve': 'TEXT',
-            'cvss_v2_0_base_score': 'DECIMAL(3, 1)',
-            'risk': 'VARCHAR(10)',
-            'host': 'VARCHAR(255)',
-            'protocol': 'VARCHAR(10)',
-            'port': 'INT UNSIGNED',
-            'name': 'VARCHAR(255)',
-            'synopsis': 'TEXT',
-            'description': 'TEXT',
-            'solution': 'TEXT',
-            'see_also': 'TEXT',
-            'plugin_output': 'MEDIUMTEXT',
-            'stig_severity': 'VARCHAR(10)',
-            'cvss_v3_0_base_score': 'DECIMAL(3, 1)',
-            'cvss_v2_0_temporal_score': 'DECIMAL(3, 1)',
-            'cvss_v3_0_temporal_score': 'DECIMAL(3, 1)',
-            'risk_factor': 'VARCHAR(15)',
-            'bid': 'VARCHAR(255)',
-            'xref': 'TEXT',
-            'mskb': 'VARCHAR(255)',
-            'plugin_publication_date': 'DATE',
-            'plugin_modification_date': 'DATE',
-            'timestamp': 'VARCHAR(15)',
-            'is_indexed_to_chroma': 'BOOLEAN NOT NULL DEFAULT FALSE'
-        }
+        columns_definition = dict(VULNERABILITY_TABLE_TEMPLATE)
         primary_key = 'id'
         unique_keys = ['fingerprint']  # 保留您之前的唯一键定义
         # --- 结束修改 ---
@@ -193,9 +188,10 @@ def create_pd_table(connection, db_name, table_name,
                     uk_name = f"uq_{uk_col}"
                     columns_sql.append(f"UNIQUE KEY `{uk_name}` (`{uk_col}`)")
 
-            # --- 为状态字段创建索引 ---
+            # --- 为状态字段和常用过滤列创建索引 ---
             if use_vulnerability_template:
                 columns_sql.append("INDEX `idx_is_indexed_to_chroma` (`is_indexed_to_chroma`)")
+                columns_sql.extend(_index_definitions(VULNERABILITY_INDEXES))
 
             if foreign_keys:
                 for fk_col, ref_table, ref_col in foreign_keys:
@@ -217,6 +213,7 @@ def create_pd_table(connection, db_name, table_name,
             print("--------------------")
 
             cursor.execute(create_sql)
+            MySqlCatalog.invalidate(db_name)
             print(f"表 '{db_name}.{table_name}' 创建成功，并已包含 'is_indexed_to_chroma' 字段及索引。")
             return True
 
@@ -225,184 +222,1340 @@ def create_pd_table(connection, db_name, table_name,
         return False
 
 
+def _index_definitions(indexes: dict) -> list:
+    return [f"INDEX `{name}` ({', '.join(f'`{col}`' for col in cols)})" for name, cols in indexes.items()]
+
+
+def ensure_vulnerability_indexes(connection, db_name: str, table_name: str) -> list:
+    """
+    为已有的漏洞表补建 VULNERABILITY_INDEXES 中缺少的索引（一条 ALTER TABLE，在线 DDL，不阻塞读写），
+    返回新建的索引名列表；表不存在时返回空列表。新建的表在 create_pd_table / create_findings_table 中已带有这些索引。
+    """
+    catalog = MySqlCatalog.get_catalog()
+    if not catalog.table_exists(connection, db_name, table_name, strict=True):
+        return []
+    missing = {name: cols for name, cols in VULNERABILITY_INDEXES.items()
+               if not catalog.has_index(connection, db_name, table_name, name)}
+    if not missing:
+        return []
+    additions = ", ".join(f"ADD {definition}" for definition in _index_definitions(missing))
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"ALTER TABLE `{db_name}`.`{table_name}` {additions}, ALGORITHM=INPLACE, LOCK=NONE"
+            )
+        connection.commit()
+        MySqlCatalog.invalidate(db_name)
+        print(f"表 '{db_name}.{table_name}' 已新建索引: {', '.join(missing)}")
+        return list(missing)
+    except pymysql.MySQLError as e:
+        print(f"为表 '{db_name}.{table_name}' 创建索引失败: {e}")
+        return []
+
+
+# 合并存储：每个租户一张 findings 表，按扫描日期（即每日表名 YYYY_MM_DD 对应的日期）RANGE 分区，每月一个分区。
+# 每日表名仍是逻辑上的“表”：ID 序列、UUID、发件箱、发现项历史都照旧使用 YYYY_MM_DD，
+# 只有读写漏洞行时由 resolve_findings_table 映射到 findings 表中 scan_date 等于该日期的那部分行。
+FINDINGS_TABLE = 'findings'
+DAILY_TABLE_PATTERN = re.compile(r'^\d{4}_\d{2}_\d{2}$')
+
+
+def load_storage_config(config_path='config.ini') -> dict:
+    """从 config.ini 的 [STORAGE] 节读取存储方式：'daily'（每天一张表，默认）或 'partitioned'（合并的分区表）。"""
+    config = configparser.ConfigParser()
+    config.read(os.path.join(os.path.dirname(__file__), config_path))
+    mode = config.get('STORAGE', 'mode', fallback='daily').strip().lower()
+    if mode not in ('daily', 'partitioned'):
+        print(f"警告: 未知的存储方式 '{mode}'，使用 'daily'。")
+        mode = 'daily'
+    return {'mode': mode}
+
+
+def resolve_findings_table(connection, db_name: str, table_name: str):
+    """
+    把逻辑表名解析为 (物理表名, 扫描日期)：每日表存在时就是它本身，扫描日期为 None；
+    每日表不存在而租户已有 findings 表时，返回 (findings, 'YYYY-MM-DD')。
+    只读取表结构目录的快照，不会因为每日表“不存在”而反复刷新目录。
+    """
+    if DAILY_TABLE_PATTERN.match(table_name):
+        tables = MySqlCatalog.get_catalog().tables(connection, db_name)
+        if table_name not in tables and FINDINGS_TABLE in tables:
+            return FINDINGS_TABLE, table_name.replace('_', '-')
+    return table_name, None
+
+
+def _table_scope(connection, db_name: str, table_name: str):
+    """返回 (物理表名, WHERE 前缀, 参数)：合并存储时前缀为 "`scan_date` = %s AND "，否则为空。"""
+    physical_table, scan_date = resolve_findings_table(connection, db_name, table_name)
+    if scan_date:
+        return physical_table, "`scan_date` = %s AND ", (scan_date,)
+    return physical_table, "", ()
+
+
+def _month_start(day: date) -> date:
+    return day.replace(day=1)
+
+
+def _next_month(day: date) -> date:
+    return date(day.year + day.month // 12, day.month % 12 + 1, 1)
+
+
+def _month_partitions(first_day: date, last_day: date) -> list:
+    """first_day 到 last_day 所在月份的分区定义（每月一个，上界为下月一日）。"""
+    partitions = []
+    month = _month_start(first_day)
+    while month <= last_day:
+        upper = _next_month(month)
+        partitions.append(f"PARTITION `p{month:%Y%m}` VALUES LESS THAN ('{upper:%Y-%m-%d}')")
+        month = upper
+    return partitions
+
+
+def _parse_scan_date(value) -> date:
+    return value if isinstance(value, date) else datetime.strptime(str(value).replace('_', '-'), '%Y-%m-%d').date()
+
+
+def create_findings_table(connection, db_name: str, scan_dates) -> bool:
+    """
+    创建（或扩展）租户的 findings 分区表，保证 scan_dates 中每个日期所在的月份都有自己的分区。
+
+    - 主键 (scan_date, id)：id 仍是每个扫描日期内的序号，(日期, id) 与 UUID 一一对应；分区表的唯一键必须包含分区列。
+    - uq_fingerprint (fingerprint, scan_date)：与每日表一样，同一天内按指纹去重。
+    - idx_is_indexed_to_chroma (is_indexed_to_chroma, scan_date, id)：按日期读取未索引行的键集分页。
+    - 超出已有分区的行落入 pmax 分区，ensure_findings_partitions 会把 pmax 拆出新的月份分区。
+    """
+    scan_dates = sorted(_parse_scan_date(d) for d in scan_dates) or [date.today()]
+    if table_exists(connection, FINDINGS_TABLE, db_name, strict=True):
+        return ensure_findings_partitions(connection, db_name, scan_dates[-1])
+
+    columns_sql = [f"`{col}` {col_type}" for col, col_type in VULNERABILITY_TABLE_TEMPLATE.items()]
+    columns_sql += [
+        "`scan_date` DATE NOT NULL",
+        "PRIMARY KEY (`scan_date`, `id`)",
+        "UNIQUE KEY `uq_fingerprint` (`fingerprint`, `scan_date`)",
+        "INDEX `idx_is_indexed_to_chroma` (`is_indexed_to_chroma`, `scan_date`, `id`)",
+        *_index_definitions(VULNERABILITY_INDEXES),
+    ]
+    partitions = _month_partitions(scan_dates[0], scan_dates[-1])
+    partitions.append("PARTITION `pmax` VALUES LESS THAN (MAXVALUE)")
+    columns_sql_str = ",\n\t".join(columns_sql)
+    partitions_str = ",\n\t".join(partitions)
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute(f"""
+            CREATE TABLE IF NOT EXISTS `{db_name}`.`{FINDINGS_TABLE}` (
+                {columns_sql_str}
+            ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci
+            PARTITION BY RANGE COLUMNS (`scan_date`) (
+                {partitions_str}
+            );
+            """)
+        connection.commit()
+        MySqlCatalog.invalidate(db_name)
+        print(f"表 '{db_name}.{FINDINGS_TABLE}' 创建成功，共 {len(partitions)} 个分区。")
+        return True
+    except pymysql.MySQLError as e:
+        print(f"创建合并的 findings 表失败: {e}")
+        return False
+
+
+def ensure_findings_partitions(connection, db_name: str, scan_date) -> bool:
+    """scan_date 超出最后一个按月分区时，把 pmax 拆出到 scan_date 所在月份为止的新分区。"""
+    scan_date = _parse_scan_date(scan_date)
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT PARTITION_DESCRIPTION AS bound FROM information_schema.PARTITIONS "
+                "WHERE TABLE_SCHEMA = %s AND TABLE_NAME = %s AND PARTITION_NAME <> 'pmax'",
+                (db_name, FINDINGS_TABLE)
+            )
+            bounds = [_parse_scan_date(row['bound'].strip("'")) for row in cursor.fetchall() if row['bound']]
+            upper = max(bounds) if bounds else _month_start(scan_date)
+            if scan_date < upper:
+                return True
+            partitions = _month_partitions(upper, scan_date)
+            partitions.append("PARTITION `pmax` VALUES LESS THAN (MAXVALUE)")
+            cursor.execute(
+                f"ALTER TABLE `{db_name}`.`{FINDINGS_TABLE}` REORGANIZE PARTITION `pmax` INTO ({', '.join(partitions)})"
+            )
+        connection.commit()
+        print(f"表 '{db_name}.{FINDINGS_TABLE}' 已新增 {len(partitions) - 1} 个按月分区（至 {scan_date:%Y-%m}）。")
+        return True
+    except pymysql.MySQLError as e:
+        print(f"扩展 findings 表分区失败: {e}")
+        return False
+
+
+def select_rows_by_ids(connection, db_name: str, ids_by_table: dict) -> list:
+    """
+    按 {逻辑表名: [id, ...]} 读取完整的漏洞行。
+    合并存储的日期合并为一条语句（每个日期一个 (scan_date = ? AND id IN (...)) 条件，分区裁剪后按主键定位），
+    每日表仍是每张表一条语句；不存在的表被跳过。
+    """
+    records = []
+    consolidated = []
+    with connection.cursor() as cursor:
+        for table_name, ids in ids_by_table.items():
+            if not ids:
+                continue
+            physical_table, scan_date = resolve_findings_table(connection, db_name, table_name)
+            if scan_date:
+                consolidated.append((scan_date, list(ids)))
+                continue
+            if not table_exists(connection, physical_table, db_name):
+                print(f"警告: 表 '{db_name}.{table_name}' 不存在，跳过。")
+                continue
+            cursor.execute(
+                f"SELECT * FROM `{db_name}`.`{physical_table}` WHERE `id` IN ({', '.join(['%s'] * len(ids))})",
+                tuple(ids)
+            )
+            records.extend(cursor.fetchall())
+
+        if consolidated:
+            predicates = [f"(`scan_date` = %s AND `id` IN ({', '.join(['%s'] * len(ids))}))" for _, ids in consolidated]
+            params = [value for scan_date, ids in consolidated for value in (scan_date, *ids)]
+            cursor.execute(
+                f"SELECT * FROM `{db_name}`.`{FINDINGS_TABLE}` WHERE {' OR '.join(predicates)}", params
+            )
+            records.extend(cursor.fetchall())
+    return records
+
+
+def plan_time_shards(connection, db_name: str, start_date, end_date) -> list:
+    """
+    把扫描日期区间 [start_date, end_date] 与租户实际存在的表求交，返回需要查询的分片：
+    - 每日表：{'table': 'YYYY_MM_DD', 'scan_date': date}，只包含目录中确实存在的日期；
+    - findings 表：每个涉及的月份一个分片 {'table': 'findings', 'range': (起, 止), 'exclude': [...]}，
+      每个分片只落在一个月份分区上；仍有每日表的日期被排除（与 resolve_findings_table 一样以每日表为准），不会重复计数。
+    """
+    start_date, end_date = _parse_scan_date(start_date), _parse_scan_date(end_date)
+    if start_date > end_date:
+        raise ValueError(f"开始日期 {start_date} 晚于结束日期 {end_date}。")
+    tables = MySqlCatalog.get_catalog().tables(connection, db_name)
+
+    shards = []
+    daily_dates = []
+    for table_name in tables:
+        if DAILY_TABLE_PATTERN.match(table_name):
+            scan_date = _parse_scan_date(table_name)
+            if start_date <= scan_date <= end_date:
+                shards.append({'table': table_name, 'scan_date': scan_date})
+                daily_dates.append(scan_date)
+    if FINDINGS_TABLE in tables:
+        month = _month_start(start_date)
+        while month <= end_date:
+            upper = _next_month(month)
+            low, high = max(month, start_date), min(date.fromordinal(upper.toordinal() - 1), end_date)
+            shards.append({'table': FINDINGS_TABLE, 'range': (low, high),
+                           'exclude': [d for d in daily_dates if low <= d <= high]})
+            month = upper
+    return shards
+
+
+def _shard_query(db_name: str, shard: dict, select_sql: str, where_sql: str = "", params=(),
+                 group_by=None, limit: int = None):
+    """
+    生成单个分片的 (SQL, 参数)。findings 分片额外读取 scan_date 列，每日表的 scan_date 由 _fetch_shard 补上。
+    group_by 不为 None 时是聚合查询：findings 分片按 (scan_date, *group_by) 分组，每日表按 group_by 分组。
+    limit 不为空时按 (scan_date,) id 排序后截取。
+    """
+    conditions, values = [], []
+    is_findings = shard['table'] == FINDINGS_TABLE
+    group_cols = [f"`{col}`" for col in group_by or ()]
+    if is_findings:
+        select_sql = f"{select_sql}, `scan_date`"
+        conditions.append("`scan_date` BETWEEN %s AND %s")
+        values.extend(shard['range'])
+        if shard['exclude']:
+            conditions.append(f"`scan_date` NOT IN ({', '.join(['%s'] * len(shard['exclude']))})")
+            values.extend(shard['exclude'])
+        if group_by is not None:
+            group_cols.insert(0, "`scan_date`")
+    if where_sql:
+        conditions.append(f"({where_sql})")
+        values.extend(params)
+    sql = f"SELECT {select_sql} FROM `{db_name}`.`{shard['table']}`"
+    if conditions:
+        sql += f" WHERE {' AND '.join(conditions)}"
+    if group_cols:
+        sql += f" GROUP BY {', '.join(group_cols)}"
+    if limit:
+        sql += f" ORDER BY {'`scan_date`, ' if is_findings else ''}`id` LIMIT {int(limit)}"
+    return sql, tuple(values)
+
+
+def _fetch_shard(cursor, sql: str, params, shard: dict) -> pd.DataFrame:
+    cursor.execute(sql, params)
+    frame = pd.DataFrame(cursor.fetchall())
+    if shard.get('scan_date') and not frame.empty:
+        frame['scan_date'] = shard['scan_date']
+    return frame
+
+
+def run_time_sharded(db_name: str, shards: list, build_query, max_workers: int = None) -> list:
+    """
+    在连接池的连接上并发执行各分片的查询，按分片顺序返回 DataFrame 列表。
+    build_query(shard) 返回 (SQL, 参数)。每个工作线程借用自己的连接（pymysql 连接不能在线程间共享），
+    并发数默认为连接池上限的一半，给同时进行的请求留出连接。
+    """
+    def run(shard):
+        sql, params = build_query(shard)
+        with MySqlPool.connection(db_name) as connection:
+            with connection.cursor() as cursor:
+                return _fetch_shard(cursor, sql, params, shard)
+
+    if not shards:
+        return []
+    workers = max_workers or max(1, MySqlPool.get_pool().max_size // 2)
+    workers = min(workers, len(shards))
+    if workers == 1:
+        return [run(shard) for shard in shards]
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='mysql-shard') as executor:
+        return list(executor.map(run, shards))
+
+
+def _check_columns(columns):
+    unknown = [col for col in columns if col not in VULNERABILITY_TABLE_TEMPLATE and col != 'scan_date']
+    if unknown:
+        raise ValueError(f"未知的列: {', '.join(unknown)}")
+
+
+def query_time_sharded(db_name: str, start_date, end_date, columns=None, where_sql: str = "", params=(),
+                       limit: int = None, max_workers: int = None) -> pd.DataFrame:
+    """
+    并发读取扫描日期在 [start_date, end_date] 之间、满足 where_sql 的发现项，结果包含 scan_date 列，
+    按 (scan_date, id) 排序。只查询实际存在的每日表和 findings 中涉及的月份分区，日期区间再长也不会查询不存在的表。
+
+    :param columns: 只读取这些列（必须是漏洞表的列），None 表示全部列
+    :param where_sql: 附加的过滤条件（使用 %s 占位符），params 为对应参数；由调用方保证是安全的 SQL 片段
+    :param limit: 最多返回的行数（每个分片也最多读取这么多行）
+    """
+    if columns:
+        _check_columns(columns)
+    select_sql = ", ".join(f"`{col}`" for col in columns if col != 'scan_date') if columns else "*"
+    with MySqlPool.connection(db_name) as connection:
+        shards = plan_time_shards(connection, db_name, start_date, end_date)
+
+    frames = run_time_sharded(
+        db_name, shards,
+        lambda shard: _shard_query(db_name, shard, select_sql, where_sql, params, limit=limit),
+        max_workers
+    )
+    frames = [frame for frame in frames if not frame.empty]
+    if not frames:
+        return pd.DataFrame(columns=list(columns) if columns else [])
+    result = pd.concat(frames, ignore_index=True)
+    sort_cols = [col for col in ('scan_date', 'id') if col in result.columns]
+    if sort_cols:
+        result = result.sort_values(sort_cols, kind='stable', ignore_index=True)
+    return result.head(limit) if limit else result
+
+
+# 分片内先聚合、再在 Python 中合并的聚合函数
+SHARD_AGGREGATES = ('count', 'sum', 'min', 'max', 'avg', 'count_distinct')
+
+
+def aggregate_time_sharded(db_name: str, start_date, end_date, aggregations: dict, group_by=None,
+                           where_sql: str = "", params=(), max_workers: int = None) -> pd.DataFrame:
+    """
+    按扫描日期分片并发聚合，再在 Python 中把各分片的部分结果合并为最终结果。
+
+    :param aggregations: {结果列名: (函数, 列)}，函数为 SHARD_AGGREGATES 之一，count 的列可以是 '*'
+                         例如 {'findings': ('count', '*'), 'hosts': ('count_distinct', 'host')}
+    :param group_by: 分组列（漏洞表的列或 scan_date），按天的趋势使用 ['scan_date', ...]
+    :return: 每个分组一行，列为 group_by + aggregations 的键；没有分组时恰好一行
+
+    各分片内按 (scan_date, group_by) 分组计算部分结果：count/sum 相加，min/max 取极值，avg 由 SUM 与 COUNT 相除；
+    count_distinct 无法相加，因此把该列并入分片的分组键，合并时再计数不同的值。
+    cve 列是逗号拼接的多个 CVE：按 cve 分组时每个 CVE 各成一组（与 finding_cve 和 CVE 汇总一致），
+    count_distinct(cve) 计数不同的单个 CVE。
+    """
+    group_by = list(group_by or [])
+    _check_columns(group_by + [col for _, col in aggregations.values() if col != '*'])
+    distinct_cols = []
+    partials = []
+    for alias, (func, col) in aggregations.items():
+        if func not in SHARD_AGGREGATES:
+            raise ValueError(f"不支持的聚合函数: {func}")
+        if col == '*' and func != 'count':
+            raise ValueError(f"聚合函数 {func} 需要指定列。")
+        target = "*" if col == '*' else f"`{col}`"
+        if func == 'count_distinct':
+            if col not in distinct_cols:
+                distinct_cols.append(col)
+        elif func == 'avg':
+            partials += [f"SUM({target}) AS `{alias}__sum`", f"COUNT({target}) AS `{alias}__count`"]
+        else:
+            partials.append(f"{func.upper()}({target}) AS `{alias}`")
+    # 没有分组的每日表即使没有匹配的行也会返回一行，合并前按 __rows 去掉，与 findings 分片（没有匹配就没有行）一致
+    partials.append("COUNT(*) AS `__rows`")
+
+    shard_group = [col for col in group_by if col != 'scan_date'] + \
+        [col for col in distinct_cols if col not in group_by]
+    select_sql = ", ".join([f"`{col}`" for col in shard_group] + partials)
+    with MySqlPool.connection(db_name) as connection:
+        shards = plan_time_shards(connection, db_name, start_date, end_date)
+
+    frames = run_time_sharded(
+        db_name, shards,
+        lambda shard: _shard_query(db_name, shard, select_sql, where_sql, params, group_by=shard_group),
+        max_workers
+    )
+    frames = [frame[pd.to_numeric(frame['__rows']) > 0] for frame in frames if not frame.empty]
+    frames = [frame for frame in frames if not frame.empty]
+    partial = pd.concat(frames, ignore_index=True) if frames else pd.DataFrame()
+    return merge_partial_aggregates(partial, aggregations, group_by)
+
+
+def _cve_list(value) -> list:
+    """逗号拼接的 cve 值中不重复的单个 CVE；空值为空列表。"""
+    if not isinstance(value, str):
+        return []
+    return list(dict.fromkeys(cve.strip() for cve in value.split(',') if cve.strip()))
+
+
+def merge_partial_aggregates(partial: pd.DataFrame, aggregations: dict, group_by: list) -> pd.DataFrame:
+    """
+    把各分片的部分聚合结果合并为最终结果（见 aggregate_time_sharded）。
+    按 cve 分组时先把每行展开为其中的每个 CVE，没有 CVE 的行不参与分组。
+    """
+    if 'cve' in group_by and 'cve' in partial.columns:
+        partial = partial.assign(cve=partial['cve'].map(_cve_list)).explode('cve').dropna(subset=['cve'])
+    needed = list(group_by)
+    for alias, (func, col) in aggregations.items():
+        needed += [f"{alias}__sum", f"{alias}__count"] if func == 'avg' else \
+            [col] if func == 'count_distinct' else [alias]
+    partial = partial.reindex(columns=list(dict.fromkeys([*partial.columns, *needed])))
+
+    def combine(rows: pd.DataFrame) -> dict:
+        result = {}
+        for alias, (func, col) in aggregations.items():
+            if func == 'count':
+                result[alias] = int(pd.to_numeric(rows[alias]).fillna(0).sum())
+            elif func == 'sum':
+                values = pd.to_numeric(rows[alias], errors='coerce')
+                result[alias] = values.sum() if values.notna().any() else None
+            elif func in ('min', 'max'):
+                values = rows[alias].dropna()
+                result[alias] = (values.min() if func == 'min' else values.max()) if not values.empty else None
+            elif func == 'avg':
+                count = pd.to_numeric(rows[f"{alias}__count"]).fillna(0).sum()
+                total = pd.to_numeric(rows[f"{alias}__sum"], errors='coerce').sum()
+                result[alias] = float(total) / count if count else None
+            else:
+                values = rows[col].dropna()
+                if col == 'cve':
+                    values = values.map(_cve_list).explode().dropna()
+                result[alias] = int(values.nunique())
+        return result
+
+    if not group_by:
+        return pd.DataFrame([combine(partial)], columns=list(aggregations))
+    records = [
+        {**dict(zip(group_by, keys if isinstance(keys, tuple) else (keys,))), **combine(rows)}
+        for keys, rows in partial.groupby(group_by, sort=True, dropna=False)
+    ]
+    return pd.DataFrame(records, columns=group_by + list(aggregations))
+
+
+def select_findings_between(connection, db_name: str, start_date, end_date, columns=None,
+                            where_sql: str = "", params=()) -> pd.DataFrame:
+    """
+    读取扫描日期在 [start_date, end_date] 之间的发现项（在调用方的连接上依次查询，结果包含 scan_date 列）。
+
+    分片由 plan_time_shards 决定：只查询目录中确实存在的每日表，findings 表按月份分区查询，MySQL 只扫描涉及的分区。
+    需要并发读取时使用 query_time_sharded。
+    :param columns: 只读取这些列，None 表示全部列
+    :param where_sql: 附加的过滤条件（以 AND 连接，使用 %s 占位符），params 为对应参数
+    """
+    select_list = ", ".join(f"`{col}`" for col in columns) if columns else "*"
+    frames = []
+    with connection.cursor() as cursor:
+        for shard in plan_time_shards(connection, db_name, start_date, end_date):
+            sql, values = _shard_query(db_name, shard, select_list, where_sql, params)
+            frames.append(_fetch_shard(cursor, sql, values, shard))
+    frames = [frame for frame in frames if not frame.empty]
+    return pd.concat(frames, ignore_index=True) if frames else pd.DataFrame()
+
+
+# 漏洞表的全部列（与 create_pd_table 的漏洞模板一致）
+VULNERABILITY_COLUMNS = [
+    'id', 'uuid', 'plugin_id', 'cve', 'cvss_v2_0_base_score', 'risk',
+    'host', 'protocol', 'port', 'name', 'synopsis', 'description',
+    'solution', 'see_also', 'plugin_output', 'stig_severity',
+    'cvss_v3_0_base_score', 'cvss_v2_0_temporal_score',
+    'cvss_v3_0_temporal_score', 'risk_factor', 'bid', 'xref', 'mskb',
+    'plugin_publication_date', 'plugin_modification_date', 'timestamp',
+    'fingerprint', 'is_indexed_to_chroma'
+]
+
+# method='auto' 时，行数不少于该值且连接支持 LOCAL INFILE 才使用 LOAD DATA，小批次用多行 INSERT 更快
+LOAD_DATA_MIN_ROWS = 10000
+
+# 多行 INSERT 语句长度距 max_allowed_packet 保留的余量（字节）
+PACKET_HEADROOM = 64 * 1024
+
+
 # pd->mysql
-def insert_vulnerability_data(connection, db_name: str, table_name: str, df: pd.DataFrame) -> int:
+def insert_vulnerability_data(connection, db_name: str, table_name: str, df: pd.DataFrame,
+                              method: str = 'auto', outbox: bool = True, cves: bool = True,
+                              summaries: bool = True) -> int:
+    """
+    批量写入漏洞数据，已存在的指纹（uq_fingerprint）被忽略。
+    outbox=True 时在同一事务中把本批 id 区间写入 chroma_outbox，供后台同步按顺序消费；
+    写入方自己同步 ChromaDB 时应传 False（发件箱只由 ChromaSync 清理）。
+    cves=True 时在同一事务中把实际写入的行的 CVE 展开写入 finding_cve。
+    summaries=True 且表名是日期（YYYY_MM_DD）时，在同一事务中按实际写入的行累加当天的汇总计数（见 FINDING_SUMMARY_TABLES）。
+
+    :param method: 'multirow' - 多行 INSERT IGNORE，每条语句按服务器 max_allowed_packet 封顶；
+                   'load_data' - 把数据流式写入临时 TSV，再用 LOAD DATA LOCAL INFILE ... IGNORE 导入
+                                 （需要 config.ini [DATABASE] local_infile = true 且服务器开启 local_infile）；
+                   'auto' - 大批次且连接支持 LOCAL INFILE 时用 load_data，否则用 multirow。
+    :return: 实际插入的行数；失败返回 -1
+    """
     if df.empty:
         print("信息: 输入的 DataFrame 为空，没有数据需要插入。")
         return 0
 
-    # 1. 定义数据库表列名
-    REQUIRED_COLUMNS = [
-        'id', 'uuid', 'plugin_id', 'cve', 'cvss_v2_0_base_score', 'risk',
-        'host', 'protocol', 'port', 'name', 'synopsis', 'description',
-        'solution', 'see_also', 'plugin_output', 'stig_severity',
-        'cvss_v3_0_base_score', 'cvss_v2_0_temporal_score',
-        'cvss_v3_0_temporal_score', 'risk_factor', 'bid', 'xref', 'mskb',
-        'plugin_publication_date', 'plugin_modification_date', 'timestamp',
-        'fingerprint', 'is_indexed_to_chroma'
-    ]
-
-    # 2. 验证 DataFrame 是否包含所有必需的列
-    missing_cols = [col for col in REQUIRED_COLUMNS if col not in df.columns]
+    # 验证 DataFrame 是否包含所有必需的列
+    missing_cols = [col for col in VULNERABILITY_COLUMNS if col not in df.columns]
     if missing_cols:
         print(f"错误: 输入的 DataFrame 缺少必需的列: {', '.join(missing_cols)}")
         return -1
 
+    if method == 'auto':
+        method = 'load_data' if len(df) >= LOAD_DATA_MIN_ROWS and _local_infile_enabled(connection) \
+            else 'multirow'
+    if method not in ('multirow', 'load_data'):
+        raise ValueError(f"未知的写入方式: {method}")
+
+    # 合并存储时写入 findings 表，扫描日期取自逻辑表名
+    physical_table, scan_date = resolve_findings_table(connection, db_name, table_name)
+    columns = VULNERABILITY_COLUMNS + ['scan_date'] if scan_date else VULNERABILITY_COLUMNS
+
+    # 布尔列转为 0/1；空字符串、NaN、NaT 一律写为 NULL（整列向量化处理，不再逐行 replace）
+    values = df[VULNERABILITY_COLUMNS].assign(scan_date=scan_date)[columns] if scan_date \
+        else df[VULNERABILITY_COLUMNS].copy()
+    bool_cols = values.select_dtypes(include='bool').columns
+    values[bool_cols] = values[bool_cols].astype(int)
+    values = values.astype(object)
+    values = values.where(values.notna() & values.ne(''), None)
+
+    if outbox and not create_sync_outbox_table(connection, db_name):
+        return -1
+    cve_pairs = split_cves(df) if cves else pd.DataFrame()
+    if not cve_pairs.empty and not create_finding_cve_table(connection, db_name):
+        return -1
+    summary_day = summary_scan_date(table_name) if summaries else None
+    if summary_day and not create_finding_summary_tables(connection, db_name):
+        return -1
+
+    start = time.perf_counter()
     try:
         with connection.cursor() as cursor:
             # 切换到指定数据库
             cursor.execute(f"USE `{db_name}`")
+            if method == 'load_data':
+                rows_affected = _load_data_local_infile(cursor, physical_table, values)
+            else:
+                rows_affected = _insert_multirow(cursor, physical_table, values)
+            if outbox and rows_affected:
+                record_outbox_ranges(cursor, table_name, df['id'])
+            if rows_affected and (not cve_pairs.empty or summary_day):
+                inserted = df
+                if rows_affected < len(values):
+                    stored = _inserted_ids(cursor, physical_table, scan_date, df['id'])
+                    inserted = df[df['id'].isin(stored)]
+                    cve_pairs = cve_pairs[cve_pairs['finding_id'].isin(stored)] if not cve_pairs.empty else cve_pairs
+                record_finding_cves(cursor, table_name, cve_pairs)
+                if summary_day:
+                    record_finding_summaries(cursor, summary_day, inserted, cve_pairs if cves else split_cves(inserted))
+                    _mark_summary_day(cursor, physical_table, scan_date, summary_day, df['id'])
+        connection.commit()
+    except pymysql.MySQLError as e:
+        print(f"批量插入数据到表 '{table_name}' 时失败: {e}")
+        connection.rollback()
+        return -1
+
+    elapsed = time.perf_counter() - start
+    print(f"成功向表 '{table_name}' 插入了 {rows_affected} 条新数据 (已存在的重复数据被自动忽略)，"
+          f"方式 {method}，{len(values)} 行耗时 {elapsed:.2f}s，{len(values) / max(elapsed, 1e-9):.0f} 行/秒。")
+    return rows_affected
 
-            # 3. 构建 INSERT IGNORE SQL 语句
-            # 这是此策略的核心，将去重逻辑完全交给数据库处理。
-            cols = ", ".join([f"`{c}`" for c in REQUIRED_COLUMNS])
-            placeholders = ", ".join(["%s"] * len(REQUIRED_COLUMNS))
-            sql = f"INSERT IGNORE INTO `{table_name}` ({cols}) VALUES ({placeholders})"  # <--- 关键在这里
-
-            # 4. 准备待插入的数据元组
-            data_tuples = list(
-                map(
-                    tuple,
-                    df[REQUIRED_COLUMNS]
-                    .replace({np.nan: None, pd.NaT: None, '': None})
-                    .to_numpy()
+
+def _local_infile_enabled(connection) -> bool:
+    """客户端连接带有 LOCAL_FILES 标志，且服务器允许 local_infile 时才能使用 LOAD DATA LOCAL INFILE。"""
+    if not connection.client_flag & CLIENT.LOCAL_FILES:
+        return False
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT @@GLOBAL.local_infile AS local_infile")
+            return bool(cursor.fetchone()['local_infile'])
+    except pymysql.MySQLError:
+        return False
+
+
+def _insert_multirow(cursor, table_name: str, values: pd.DataFrame) -> int:
+    """
+    多行 INSERT IGNORE。pymysql 的 executemany 会把 INSERT ... VALUES 合并成多行语句，
+    这里把单条语句的长度上限从默认的约 1MB 提高到服务器的 max_allowed_packet，减少往返次数。
+    """
+    cursor.execute("SELECT @@SESSION.max_allowed_packet AS max_allowed_packet")
+    cursor.max_stmt_length = max(cursor.fetchone()['max_allowed_packet'] - PACKET_HEADROOM, 1024 * 1024)
+
+    cols = ", ".join([f"`{c}`" for c in values.columns])
+    placeholders = ", ".join(["%s"] * len(values.columns))
+    sql = f"INSERT IGNORE INTO `{table_name}` ({cols}) VALUES ({placeholders})"
+    return cursor.executemany(sql, list(values.itertuples(index=False, name=None)))
+
+
+def _load_data_local_infile(cursor, table_name: str, values: pd.DataFrame) -> int:
+    """
+    把数据分块流式写入临时 TSV，再用 LOAD DATA LOCAL INFILE ... IGNORE 一次导入。
+    所有字段都用双引号包围（字段内的双引号写成两个），NULL 写为空字段并在导入时由 NULLIF 还原，
+    因此字段中的制表符、换行符和字面量 'NULL' 都能原样导入。
+    """
+    with tempfile.NamedTemporaryFile(mode='w', suffix='.tsv', encoding='utf-8', newline='',
+                                     delete=False) as tmp:
+        values.to_csv(tmp, sep='\t', header=False, index=False, na_rep='', quoting=csv.QUOTE_ALL,
+                      lineterminator='\n', chunksize=50000)
+    try:
+        variables = ", ".join(f"@v{i}" for i in range(len(values.columns)))
+        assignments = ", ".join(f"`{col}` = NULLIF(@v{i}, '')" for i, col in enumerate(values.columns))
+        sql = (f"LOAD DATA LOCAL INFILE %s IGNORE INTO TABLE `{table_name}` CHARACTER SET utf8mb4 "
+               f"FIELDS TERMINATED BY '\\t' ENCLOSED BY '\"' ESCAPED BY '' LINES TERMINATED BY '\\n' "
+               f"({variables}) SET {assignments}")
+        return cursor.execute(sql, (tmp.name,))
+    finally:
+        os.remove(tmp.name)
+
+
+def get_existing_fingerprints(connection, db_name: str, table_name: str, fingerprints,
+                              chunk_size: int = 5000) -> set:
+    """
+    批量查询哪些指纹已存在于表中，返回已存在指纹的集合。
+    按 chunk_size 分批使用 IN (...) 查询，走 uq_fingerprint 唯一索引，每批只读取 fingerprint 一列。
+
+    :param fingerprints: 待检查的指纹序列
+    :return: 表中已存在的指纹集合；表不存在时返回空集合
+    """
+    fingerprints = list(dict.fromkeys(fingerprints))
+    existing = set()
+    if not fingerprints:
+        return existing
+
+    physical_table, scope_sql, scope_params = _table_scope(connection, db_name, table_name)
+    if not table_exists(connection, physical_table, db_name):
+        return existing
+
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute(f"USE `{db_name}`")
+            for start in range(0, len(fingerprints), chunk_size):
+                chunk = fingerprints[start:start + chunk_size]
+                placeholders = ", ".join(["%s"] * len(chunk))
+                cursor.execute(
+                    f"SELECT `fingerprint` FROM `{physical_table}` "
+                    f"WHERE {scope_sql}`fingerprint` IN ({placeholders})",
+                    (*scope_params, *chunk)
                 )
+                existing.update(row['fingerprint'] for row in cursor.fetchall())
+        return existing
+
+    except pymysql.MySQLError as e:
+        print(f"错误: 查询表 '{table_name}' 中已存在的指纹时出错: {e}")
+        raise
+
+
+# CVE 关联表（每个租户数据库一份）：漏洞表的 cve 列是逗号拼接的 TEXT，无法建索引；
+# 每个 (逻辑表名, id, CVE) 一行，主键以 cve 开头，“哪些主机受 CVE-X 影响”是一次索引查找。
+# id 只在逻辑表（YYYY_MM_DD）内唯一，因此与发件箱一样用 table_name + finding_id 定位发现项。
+FINDING_CVE_TABLE = 'finding_cve'
+
+
+def create_finding_cve_table(connection, db_name: str) -> bool:
+    """确保租户数据库中存在 finding_cve 表。DDL 会隐式提交，因此必须在写数据的事务开始之前调用。"""
+    if table_exists(connection, FINDING_CVE_TABLE, db_name):
+        return True
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute(f"""
+            CREATE TABLE IF NOT EXISTS `{db_name}`.`{FINDING_CVE_TABLE}` (
+                `cve` VARCHAR(32) NOT NULL,
+                `table_name` VARCHAR(64) NOT NULL,
+                `finding_id` INT UNSIGNED NOT NULL,
+                PRIMARY KEY (`cve`, `table_name`, `finding_id`),
+                INDEX `idx_finding` (`table_name`, `finding_id`)
+            ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
+            """)
+        connection.commit()
+        MySqlCatalog.invalidate(db_name)
+        return True
+    except pymysql.MySQLError as e:
+        print(f"创建 CVE 关联表失败: {e}")
+        return False
+
+
+def split_cves(df: pd.DataFrame) -> pd.DataFrame:
+    """把 id / cve 两列展开为每个 (id, CVE) 一行的 DataFrame（列为 finding_id, cve），空值和重复项被去掉。"""
+    if df.empty:
+        return pd.DataFrame(columns=['finding_id', 'cve'])
+    pairs = df[['id', 'cve']].dropna(subset=['cve'])
+    pairs = pairs.assign(cve=pairs['cve'].astype(str).str.split(',')).explode('cve')
+    pairs['cve'] = pairs['cve'].str.strip()
+    pairs = pairs[pairs['cve'].ne('') & pairs['cve'].notna()].drop_duplicates()
+    return pd.DataFrame({'finding_id': pairs['id'].astype(int), 'cve': pairs['cve']}).reset_index(drop=True)
+
+
+def record_finding_cves(cursor, table_name: str, pairs: pd.DataFrame) -> int:
+    """在调用方的事务中（使用调用方的 cursor，不提交）写入 (table_name, finding_id, cve)，已存在的组合被忽略。"""
+    if pairs.empty:
+        return 0
+    return cursor.executemany(
+        f"INSERT IGNORE INTO `{FINDING_CVE_TABLE}` (`cve`, `table_name`, `finding_id`) VALUES (%s, %s, %s)",
+        [(cve, table_name, finding_id) for finding_id, cve in pairs[['finding_id', 'cve']].itertuples(index=False)]
+    )
+
+
+def _inserted_ids(cursor, physical_table: str, scan_date, ids) -> set:
+    """
+    INSERT IGNORE 丢弃了部分行时，查出本批 ids 中确实写入了漏洞表的那些，
+    CVE 关联和汇总计数只按这些行维护，避免指向不存在的行或重复计数。
+    本批 id 来自 reserve_id_range 预留的连续区间，按主键区间查询一次即可。
+    """
+    scope_sql, scope_params = ("`scan_date` = %s AND ", (scan_date,)) if scan_date else ("", ())
+    cursor.execute(
+        f"SELECT `id` FROM `{physical_table}` WHERE {scope_sql}`id` BETWEEN %s AND %s",
+        (*scope_params, int(min(ids)), int(max(ids)))
+    )
+    return {row['id'] for row in cursor.fetchall()}
+
+
+def select_findings_by_cve(connection, db_name: str, cves, tables=None) -> list:
+    """
+    读取受任一 CVE 影响的全部发现项（完整行，附带 table_name 列）。
+    先在 finding_cve 的主键上查找 (table_name, finding_id)，再按表批量读取漏洞行，不扫描漏洞表。
+    :param tables: 只返回这些逻辑表中的发现项，None 表示全部
+    """
+    cves = list(dict.fromkeys(c.strip() for c in cves if c and c.strip()))
+    if not cves or not table_exists(connection, FINDING_CVE_TABLE, db_name):
+        return []
+    table_filter = f" AND `table_name` IN ({', '.join(['%s'] * len(tables))})" if tables else ""
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"SELECT DISTINCT `table_name`, `finding_id` FROM `{db_name}`.`{FINDING_CVE_TABLE}` "
+            f"WHERE `cve` IN ({', '.join(['%s'] * len(cves))}){table_filter}",
+            (*cves, *(tables or ()))
+        )
+        ids_by_table = {}
+        for row in cursor.fetchall():
+            ids_by_table.setdefault(row['table_name'], []).append(row['finding_id'])
+
+    # 合并存储的日期一条语句读取，按 scan_date 还原逻辑表名；每日表逐表读取
+    consolidated = {table_name: ids for table_name, ids in ids_by_table.items()
+                    if resolve_findings_table(connection, db_name, table_name)[1]}
+    records = [dict(row, table_name=f"{row['scan_date']:%Y_%m_%d}")
+               for row in select_rows_by_ids(connection, db_name, consolidated)] if consolidated else []
+    for table_name, ids in ids_by_table.items():
+        if table_name not in consolidated:
+            records.extend(dict(row, table_name=table_name)
+                           for row in select_rows_by_ids(connection, db_name, {table_name: ids}))
+    return records
+
+
+def backfill_finding_cves(connection, db_name: str, table_name: str, batch_size: int = 50000) -> int:
+    """
+    为 finding_cve 出现之前写入的逻辑表补写 CVE 关联，按主键键集分页读取 id / cve 两列，每批单独提交，
+    可以重复执行（已存在的组合被忽略）。返回新写入的关联行数；表不存在时返回 0。
+    """
+    physical_table, scope_sql, scope_params = _table_scope(connection, db_name, table_name)
+    if not table_exists(connection, physical_table, db_name) or not create_finding_cve_table(connection, db_name):
+        return 0
+    written = 0
+    last_id = 0
+    while True:
+        with connection.cursor() as cursor:
+            cursor.execute(f"USE `{db_name}`")
+            cursor.execute(
+                f"SELECT `id`, `cve` FROM `{physical_table}` "
+                f"WHERE {scope_sql}`id` > %s ORDER BY `id` LIMIT %s",
+                (*scope_params, last_id, batch_size)
             )
+            records = cursor.fetchall()
+            if not records:
+                break
+            last_id = records[-1]['id']
+            written += record_finding_cves(cursor, table_name, split_cves(pd.DataFrame(records)))
+        connection.commit()
+        if len(records) < batch_size:
+            break
+    print(f"表 '{db_name}.{table_name}' 的 CVE 关联已补写 {written} 行。")
+    return written
+
+
+# 汇总表（每个租户数据库一份）：写入漏洞表的同一事务中按实际写入的行累加每天的计数，
+# 仪表盘和统计问题读取这些小表，开销与 天数 × 分组数 成正比，而与发现项的总量无关。
+# 维度列不允许 NULL（作为主键的一部分），缺失的值记为 '' 或 0，读取时还原为 NULL。
+FINDING_SUMMARY_TABLES = {
+    'finding_counts_host_risk': ('host', 'risk'),
+    'finding_counts_plugin': ('plugin_id',),
+    'finding_counts_cve': ('cve',),
+}
+SUMMARY_COLUMN_TYPES = {
+    'host': "VARCHAR(255) NOT NULL DEFAULT ''",
+    'risk': "VARCHAR(10) NOT NULL DEFAULT ''",
+    'plugin_id': "INT UNSIGNED NOT NULL DEFAULT 0",
+    'cve': "VARCHAR(32) NOT NULL DEFAULT ''",
+}
+SUMMARY_MISSING_VALUES = {'host': '', 'risk': '', 'plugin_id': 0, 'cve': ''}
+# 汇总完整的扫描日期：当天的第一批数据就由汇总维护，或者已经用 rebuild_finding_summaries 从原始行重建过
+FINDING_SUMMARY_DAYS_TABLE = 'finding_summary_days'
+
+
+def uses_finding_summaries(connection, db_name: str) -> bool:
+    """租户是否已经按天维护汇总（存在 finding_summary_days，首次非增量入库日期表时创建，改为增量入库时删除）。"""
+    return table_exists(connection, FINDING_SUMMARY_DAYS_TABLE, db_name, cache_miss=True)
+
+
+def drop_finding_summary_tables(connection, db_name: str) -> bool:
+    """
+    删除租户的全部汇总表（租户改为增量入库时调用，增量入库的租户不提供按天统计）。
+    DDL 会隐式提交，因此必须在写数据的事务开始之前调用。
+    """
+    try:
+        with connection.cursor() as cursor:
+            for summary_table in (*FINDING_SUMMARY_TABLES, FINDING_SUMMARY_DAYS_TABLE):
+                cursor.execute(f"DROP TABLE IF EXISTS `{db_name}`.`{summary_table}`")
+        connection.commit()
+        MySqlCatalog.invalidate(db_name)
+        return True
+    except pymysql.MySQLError as e:
+        print(f"删除汇总表失败: {e}")
+        return False
+
 
-            if not data_tuples:
-                print("信息: 准备插入的数据为空，操作完成。")
-                return 0
+def summary_scan_date(table_name: str):
+    """逻辑表名对应的扫描日期；不是 YYYY_MM_DD 形式的表没有汇总，返回 None。"""
+    return _parse_scan_date(table_name) if DAILY_TABLE_PATTERN.match(table_name) else None
 
-            # 5. 高效执行批量插入
-            rows_affected = cursor.executemany(sql, data_tuples)
 
+def create_finding_summary_tables(connection, db_name: str) -> bool:
+    """确保租户数据库中存在全部汇总表。DDL 会隐式提交，因此必须在写数据的事务开始之前调用。"""
+    catalog = MySqlCatalog.get_catalog()
+    existing = catalog.tables(connection, db_name)
+    if all(name in existing for name in (*FINDING_SUMMARY_TABLES, FINDING_SUMMARY_DAYS_TABLE)):
+        return True
+    try:
+        with connection.cursor() as cursor:
+            for summary_table, dims in FINDING_SUMMARY_TABLES.items():
+                dim_sql = "".join(f"`{dim}` {SUMMARY_COLUMN_TYPES[dim]},\n" for dim in dims)
+                cursor.execute(f"""
+                CREATE TABLE IF NOT EXISTS `{db_name}`.`{summary_table}` (
+                    `scan_date` DATE NOT NULL,
+                    {dim_sql}
+                    `findings` INT UNSIGNED NOT NULL DEFAULT 0,
+                    PRIMARY KEY (`scan_date`, {', '.join(f'`{dim}`' for dim in dims)})
+                ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
+                """)
+            cursor.execute(f"""
+            CREATE TABLE IF NOT EXISTS `{db_name}`.`{FINDING_SUMMARY_DAYS_TABLE}` (
+                `scan_date` DATE NOT NULL,
+                `rebuilt_at` DATETIME NULL,
+                `created_at` DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP,
+                PRIMARY KEY (`scan_date`)
+            ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
+            """)
         connection.commit()
-        print(f"成功向表 '{table_name}' 插入了 {rows_affected} 条新数据 (已存在的重复数据被自动忽略)。")
-        return rows_affected
+        MySqlCatalog.invalidate(db_name)
+        return True
+    except pymysql.MySQLError as e:
+        print(f"创建汇总表失败: {e}")
+        return False
 
+
+def _summary_keys(values: pd.Series, missing) -> pd.Series:
+    """把一列维度值规整为汇总表的键：缺失值和空字符串换成占位值，数值维度转为整数。"""
+    if isinstance(missing, int):
+        return pd.to_numeric(values, errors='coerce').fillna(missing).astype('int64')
+    values = values.astype(object)
+    return values.where(values.notna() & values.ne(''), missing)
+
+
+def summarize_findings(df: pd.DataFrame, cve_pairs: pd.DataFrame = None) -> dict:
+    """按 FINDING_SUMMARY_TABLES 的维度对一批发现项计数，返回 {汇总表: DataFrame(维度..., findings)}。"""
+    counts = {}
+    for summary_table, dims in FINDING_SUMMARY_TABLES.items():
+        source = cve_pairs if dims == ('cve',) else df
+        if source is None or source.empty:
+            continue
+        keys = pd.DataFrame({dim: _summary_keys(source[dim], SUMMARY_MISSING_VALUES[dim]) for dim in dims})
+        counts[summary_table] = keys.groupby(list(dims), sort=False).size().reset_index(name='findings')
+    return counts
+
+
+def record_finding_summaries(cursor, scan_date, df: pd.DataFrame, cve_pairs: pd.DataFrame = None) -> int:
+    """在调用方的事务中（使用调用方的 cursor，不提交）把一批新写入的发现项累加到 scan_date 当天的汇总，返回写入的汇总行数。"""
+    written = 0
+    for summary_table, counts in summarize_findings(df, cve_pairs).items():
+        dims = FINDING_SUMMARY_TABLES[summary_table]
+        cols = ", ".join(f"`{col}`" for col in ('scan_date', *dims, 'findings'))
+        written += cursor.executemany(
+            f"INSERT INTO `{summary_table}` ({cols}) VALUES ({', '.join(['%s'] * (len(dims) + 2))}) "
+            f"ON DUPLICATE KEY UPDATE `findings` = `findings` + VALUES(`findings`)",
+            [(scan_date, *(v.item() if hasattr(v, 'item') else v for v in row))
+             for row in counts.itertuples(index=False, name=None)]
+        )
+    return written
+
+
+def _mark_summary_day(cursor, physical_table: str, scope_date, scan_date, ids):
+    """
+    当天尚未标记为汇总完整、且表中除本批之外没有更早写入的行时，把当天标记为汇总完整。
+    汇总功能上线之前就有数据的日期不会被标记，需要用 rebuild_finding_summaries 重建后才会被统计查询使用。
+    """
+    cursor.execute(f"SELECT 1 FROM `{FINDING_SUMMARY_DAYS_TABLE}` WHERE `scan_date` = %s", (scan_date,))
+    if cursor.fetchall():
+        return
+    scope_sql, scope_params = ("`scan_date` = %s AND ", (scope_date,)) if scope_date else ("", ())
+    cursor.execute(
+        f"SELECT 1 FROM `{physical_table}` WHERE {scope_sql}(`id` < %s OR `id` > %s) LIMIT 1",
+        (*scope_params, int(min(ids)), int(max(ids)))
+    )
+    if not cursor.fetchall():
+        cursor.execute(f"INSERT IGNORE INTO `{FINDING_SUMMARY_DAYS_TABLE}` (`scan_date`) VALUES (%s)", (scan_date,))
+
+
+def rebuild_finding_summaries(connection, db_name: str, table_name: str) -> bool:
+    """
+    从原始行重新计算一个逻辑表（一天）的全部汇总，并把当天标记为汇总完整。
+    CVE 汇总取自 finding_cve，因此应在 backfill_finding_cves 之后执行；整个重建在一个事务中完成。
+    """
+    scan_date = summary_scan_date(table_name)
+    physical_table, scope_sql, scope_params = _table_scope(connection, db_name, table_name)
+    if not scan_date or not table_exists(connection, physical_table, db_name) \
+            or not create_finding_summary_tables(connection, db_name):
+        return False
+    has_cves = table_exists(connection, FINDING_CVE_TABLE, db_name)
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute(f"USE `{db_name}`")
+            for summary_table, dims in FINDING_SUMMARY_TABLES.items():
+                cursor.execute(f"DELETE FROM `{summary_table}` WHERE `scan_date` = %s", (scan_date,))
+                if dims == ('cve',):
+                    if has_cves:
+                        cursor.execute(
+                            f"INSERT INTO `{summary_table}` (`scan_date`, `cve`, `findings`) "
+                            f"SELECT %s, `cve`, COUNT(*) FROM `{FINDING_CVE_TABLE}` "
+                            f"WHERE `table_name` = %s GROUP BY `cve`",
+                            (scan_date, table_name)
+                        )
+                    continue
+                dim_sql = ", ".join(f"COALESCE(`{dim}`, %s)" for dim in dims)
+                cursor.execute(
+                    f"INSERT INTO `{summary_table}` (`scan_date`, {', '.join(f'`{dim}`' for dim in dims)}, `findings`) "
+                    f"SELECT %s, {dim_sql}, COUNT(*) FROM `{physical_table}` "
+                    f"WHERE {scope_sql}1 GROUP BY {', '.join(str(i + 2) for i in range(len(dims)))}",
+                    (scan_date, *(SUMMARY_MISSING_VALUES[dim] for dim in dims), *scope_params)
+                )
+            cursor.execute(
+                f"INSERT INTO `{FINDING_SUMMARY_DAYS_TABLE}` (`scan_date`, `rebuilt_at`) VALUES (%s, NOW()) "
+                f"ON DUPLICATE KEY UPDATE `rebuilt_at` = NOW()",
+                (scan_date,)
+            )
+        connection.commit()
+        print(f"表 '{db_name}.{table_name}' 的汇总已重建。")
+        return True
     except pymysql.MySQLError as e:
-        print(f"批量插入数据到表 '{table_name}' 时失败: {e}")
+        print(f"重建表 '{table_name}' 的汇总失败: {e}")
         connection.rollback()
-        return -1
+        return False
+
+
+def summary_days_complete(connection, db_name: str, start_date, end_date) -> bool:
+    """[start_date, end_date] 内每个有数据的扫描日期是否都已汇总完整（没有汇总表时为 False）。"""
+    if not table_exists(connection, FINDING_SUMMARY_DAYS_TABLE, db_name, cache_miss=True):
+        return False
+    start_date, end_date = _parse_scan_date(start_date), _parse_scan_date(end_date)
+    tables = MySqlCatalog.get_catalog().tables(connection, db_name)
+    data_days = {_parse_scan_date(t) for t in tables
+                 if DAILY_TABLE_PATTERN.match(t) and start_date <= _parse_scan_date(t) <= end_date}
+    with connection.cursor() as cursor:
+        if FINDINGS_TABLE in tables:
+            cursor.execute(
+                f"SELECT DISTINCT `scan_date` FROM `{db_name}`.`{FINDINGS_TABLE}` WHERE `scan_date` BETWEEN %s AND %s",
+                (start_date, end_date)
+            )
+            data_days.update(row['scan_date'] for row in cursor.fetchall())
+        cursor.execute(
+            f"SELECT `scan_date` FROM `{db_name}`.`{FINDING_SUMMARY_DAYS_TABLE}` WHERE `scan_date` BETWEEN %s AND %s",
+            (start_date, end_date)
+        )
+        covered = {row['scan_date'] for row in cursor.fetchall()}
+    return data_days <= covered
 
 
-# 从单表中读取 is_to_chroma=0 的内容，保留列名称和is_to_chroma字段
-def get_max_id(connection, db_name: str, table_name: str, id_column: str = 'id') -> int:
+def aggregate_summaries(connection, db_name: str, summary_table: str, start_date, end_date, aggregations: dict,
+                        group_by=None, where_sql: str = "", params=()) -> pd.DataFrame:
     """
-    获取指定表、指定ID列的最大值。
-    如果表不存在或为空，则返回 0，以便调用方 +1 后从 1 开始。
+    在一张汇总表上计算聚合，结果格式与 aggregate_time_sharded 相同。
+    只支持 ('count', '*')（累加 findings）和对该表维度列的 count_distinct；where_sql 只能引用该表的维度列。
+    """
+    dims = FINDING_SUMMARY_TABLES[summary_table]
+    group_by = list(group_by or [])
+
+    select_parts = [f"`{col}`" for col in group_by]
+    for alias, (func, col) in aggregations.items():
+        if func == 'count' and col == '*':
+            select_parts.append(f"COALESCE(SUM(`findings`), 0) AS `{alias}`")
+        elif func == 'count_distinct' and col in dims:
+            select_parts.append(f"COUNT(DISTINCT `{col}`) AS `{alias}`")
+        else:
+            raise ValueError(f"汇总表 {summary_table} 不支持聚合 {func}({col})。")
+    # 子查询把占位值还原成 NULL，过滤条件对缺失值的三值逻辑与原始行上完全一致
+    restored = ", ".join(f"NULLIF(`{dim}`, {SUMMARY_MISSING_VALUES[dim]!r}) AS `{dim}`" for dim in dims)
+    sql = (f"SELECT {', '.join(select_parts)} FROM ("
+           f"SELECT `scan_date`, {restored}, `findings` FROM `{db_name}`.`{summary_table}` "
+           f"WHERE `scan_date` BETWEEN %s AND %s AND `findings` > 0) AS s"
+           f"{f' WHERE ({where_sql})' if where_sql else ''}")
+    if group_by:
+        sql += f" GROUP BY {', '.join(f'`{col}`' for col in group_by)} ORDER BY {', '.join(f'`{col}`' for col in group_by)}"
+    with connection.cursor() as cursor:
+        cursor.execute(sql, (_parse_scan_date(start_date), _parse_scan_date(end_date), *params))
+        records = cursor.fetchall()
+    result = pd.DataFrame(records, columns=group_by + list(aggregations))
+    for alias in aggregations:
+        result[alias] = pd.to_numeric(result[alias]).fillna(0).astype(int)
+    return result
+
+
+# 增量入库使用的发现项历史表和出现记录表（每个租户数据库各一份）
+FINDING_HISTORY_TABLE = 'finding_history'
+FINDING_SIGHTINGS_TABLE = 'finding_sightings'
+
+
+def create_finding_history_tables(connection, db_name: str) -> bool:
+    """
+    创建增量入库所需的两张表（已存在则跳过）：
+    - finding_history: 每个指纹一行，记录最近一次的内容哈希、首次/最近出现日期，以及保存完整行的日表。
+    - finding_sightings: 每个 (指纹, 扫描日期) 一行，记录“该发现项在某天的扫描中仍然存在”。
+    """
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute(f"USE `{db_name}`")
+            cursor.execute(f"""
+            CREATE TABLE IF NOT EXISTS `{FINDING_HISTORY_TABLE}` (
+                `fingerprint` VARCHAR(32) NOT NULL,
+                `content_hash` VARCHAR(16) NOT NULL,
+                `first_seen` VARCHAR(15) NOT NULL,
+                `last_seen` VARCHAR(15) NOT NULL,
+                `last_table` VARCHAR(64) NOT NULL,
+                PRIMARY KEY (`fingerprint`)
+            ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
+            """)
+            cursor.execute(f"""
+            CREATE TABLE IF NOT EXISTS `{FINDING_SIGHTINGS_TABLE}` (
+                `fingerprint` VARCHAR(32) NOT NULL,
+                `scan_date` VARCHAR(15) NOT NULL,
+                `source_table` VARCHAR(64) NOT NULL,
+                PRIMARY KEY (`fingerprint`, `scan_date`),
+                INDEX `idx_scan_date` (`scan_date`)
+            ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
+            """)
+        connection.commit()
+        MySqlCatalog.invalidate(db_name)
+        return True
+    except pymysql.MySQLError as e:
+        print(f"创建发现项历史表失败: {e}")
+        return False
+
 
-    :param connection: 数据库连接对象。
-    :param table_name: 目标数据库表名。
-    :param id_column: 主键列的名称，默认为 'id'。
-    :return: 表中最大的ID值，如果表为空或不存在则返回 0。
+def uses_delta_ingest(connection, db_name: str) -> bool:
+    """
+    租户是否增量入库过（存在 finding_history）。这类租户未变化的发现项在当天只有出现记录而没有完整行，
+    按天读取原始行的查询（分片查询、统计、汇总）会少计，因此不提供按天的统计。
     """
+    return table_exists(connection, FINDING_HISTORY_TABLE, db_name, cache_miss=True)
+
+
+def get_finding_history(connection, db_name: str, fingerprints, chunk_size: int = 5000) -> dict:
+    """
+    批量查询指纹在 finding_history 中的最近记录。
+
+    :return: {fingerprint: {'content_hash': ..., 'last_table': ...}}，历史中没有的指纹不在结果中
+    """
+    fingerprints = list(dict.fromkeys(fingerprints))
+    history = {}
     try:
         with connection.cursor() as cursor:
-            # 0. 切换到指定的数据库
             cursor.execute(f"USE `{db_name}`")
-            # 1. 检查表是否存在
-            cursor.execute("SHOW TABLES LIKE %s", (table_name,))
-            if not cursor.fetchone():
-                print(f"信息: 表 '{table_name}' 不存在，ID将从 1 开始。")
-                return 0
-
-            # 2. 检查表是否为空
-            # 使用聚合函数COUNT来检查，比SELECT *高效
-            cursor.execute(f"SELECT COUNT(`{id_column}`) AS count FROM `{table_name}`")
-            if cursor.fetchone()['count'] == 0:
-                print(f"信息: 表 '{table_name}' 为空，ID将从 1 开始。")
-                return 0
-
-            # 3. 表不为空，查询最大ID
-            cursor.execute(f"SELECT MAX(`{id_column}`) AS max_id FROM `{table_name}`")
-            result = cursor.fetchone()
-            max_id = result['max_id']
-
-            print(f"信息: 表 '{table_name}' 当前最大ID为 {max_id}。")
-            return int(max_id) if max_id is not None else 0
-
-    except (pymysql.MySQLError, KeyError) as e:
-        print(f"错误: 在查询表 '{table_name}' 的最大ID时出错: {e}")
-        # 向上抛出异常，让调用方决定如何处理错误
+            for start in range(0, len(fingerprints), chunk_size):
+                chunk = fingerprints[start:start + chunk_size]
+                placeholders = ", ".join(["%s"] * len(chunk))
+                cursor.execute(
+                    f"SELECT `fingerprint`, `content_hash`, `last_table` FROM `{FINDING_HISTORY_TABLE}` "
+                    f"WHERE `fingerprint` IN ({placeholders})",
+                    chunk
+                )
+                for row in cursor.fetchall():
+                    history[row['fingerprint']] = {'content_hash': row['content_hash'],
+                                                   'last_table': row['last_table']}
+        return history
+    except pymysql.MySQLError as e:
+        print(f"错误: 查询发现项历史时出错: {e}")
         raise
 
 
-# 读取特定数据库中所有表的is_to_chroma=0的记录并转换为Pandas DataFrame
-# 返回类型	dict[str, pd.DataFrame] (按表分离)
-def select_is_to_chroma_data(connection, db_name, is_to_chroma_col='is_to_chroma', batch_size=10000):
+def record_finding_sightings(connection, db_name: str, sightings: pd.DataFrame) -> int:
     """
-    读取特定数据库中所有表的is_to_chroma=0的记录并转换为Pandas DataFrame
+    记录一批发现项的出现，并更新 finding_history。
+    只有不早于历史中最近出现日期的记录才会更新 content_hash / last_table；first_seen 取最早的日期。
+
+    :param sightings: 需含 fingerprint / content_hash / timestamp / source_table 列。
+                      source_table 为保存该发现项完整行的表：新增或内容变化的发现项是本次写入的表，
+                      未变化的发现项是历史中记录的表。
+    :return: 新写入的出现记录数；失败返回 -1
     """
-    all_tables_data = {}
+    if sightings.empty:
+        return 0
 
+    rows = list(sightings[['fingerprint', 'content_hash', 'timestamp', 'source_table']]
+                .itertuples(index=False, name=None))
     try:
         with connection.cursor() as cursor:
-            # 获取指定数据库中的所有表名
             cursor.execute(f"USE `{db_name}`")
-            cursor.execute("SHOW TABLES")
-            tables = [table[0] for table in cursor.fetchall()]
+            cursor.executemany(
+                f"INSERT INTO `{FINDING_HISTORY_TABLE}` "
+                f"(`fingerprint`, `content_hash`, `first_seen`, `last_seen`, `last_table`) "
+                f"VALUES (%s, %s, %s, %s, %s) "
+                f"ON DUPLICATE KEY UPDATE "
+                # 赋值按顺序执行：先用旧的 last_seen 判断，补传更早的扫描时不回退最近的内容
+                f"`content_hash` = IF(VALUES(`last_seen`) >= `last_seen`, VALUES(`content_hash`), `content_hash`), "
+                f"`last_table` = IF(VALUES(`last_seen`) >= `last_seen`, VALUES(`last_table`), `last_table`), "
+                f"`first_seen` = LEAST(`first_seen`, VALUES(`first_seen`)), "
+                f"`last_seen` = GREATEST(`last_seen`, VALUES(`last_seen`))",
+                [(fingerprint, content_hash, scan_date, scan_date, source_table)
+                 for fingerprint, content_hash, scan_date, source_table in rows]
+            )
+            inserted = cursor.executemany(
+                f"INSERT IGNORE INTO `{FINDING_SIGHTINGS_TABLE}` (`fingerprint`, `scan_date`, `source_table`) "
+                f"VALUES (%s, %s, %s)",
+                [(fingerprint, scan_date, source_table)
+                 for fingerprint, _, scan_date, source_table in rows]
+            )
+        connection.commit()
+        return inserted
+    except pymysql.MySQLError as e:
+        print(f"记录发现项出现时失败: {e}")
+        connection.rollback()
+        return -1
 
-            if not tables:
-                print(f"数据库 '{db_name}' 中没有找到表")
-                return all_tables_data
 
-            print(f"开始处理数据库 '{db_name}' 中的 {len(tables)} 个表")
+# 上传文件内容哈希登记表（每个租户数据库一份）
+# 键为 (内容哈希, 目标表, 入库选项)：同一文件以不同选项上传、或在另一天上传（写入另一张日期表）都会重新入库
+UPLOAD_REGISTRY_TABLE = 'upload_registry'
 
-            # 遍历每个表
-            for table_name in tables:
-                # 检查表是否存在is_to_chroma列
+
+def get_upload_record(connection, db_name: str, content_hash: str, table_name: str, options_key: str = ''):
+    """
+    查询该租户此前以相同选项把内容相同的文件成功写入 table_name 的上传记录。
+
+    :return: {'content_hash', 'options_key', 'filename', 'job_id', 'table_name', 'result', 'created_at'}；
+             没有记录（或租户数据库/登记表尚不存在）时返回 None
+    """
+    if 'options_key' not in (MySqlCatalog.get_catalog().columns(connection, db_name, UPLOAD_REGISTRY_TABLE) or ()):
+        return None
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"SELECT `content_hash`, `options_key`, `filename`, `job_id`, `table_name`, `result`, `created_at` "
+                f"FROM `{db_name}`.`{UPLOAD_REGISTRY_TABLE}` "
+                f"WHERE `content_hash` = %s AND `table_name` = %s AND `options_key` = %s",
+                (content_hash, table_name, options_key)
+            )
+            record = cursor.fetchone()
+        if record:
+            record['result'] = json.loads(record['result']) if record['result'] else None
+            record['created_at'] = str(record['created_at'])
+        return record
+    except pymysql.MySQLError as e:
+        print(f"错误: 查询上传登记记录时出错: {e}")
+        return None
+
+
+def save_upload_record(connection, db_name: str, content_hash: str, filename: str,
+                       job_id: str, table_name: str, result: dict, options_key: str = '') -> bool:
+    """登记一次成功入库的上传；同一内容以相同选项再次强制写入同一张表时覆盖旧记录。"""
+    columns = MySqlCatalog.get_catalog().columns(connection, db_name, UPLOAD_REGISTRY_TABLE)
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute(f"USE `{db_name}`")
+            if columns is None:
                 cursor.execute(f"""
-                    SELECT COLUMN_NAME 
-                    FROM INFORMATION_SCHEMA.COLUMNS 
-                    WHERE TABLE_SCHEMA = %s 
-                    AND TABLE_NAME = %s 
-                    AND COLUMN_NAME = %s
-                """, (db_name, table_name, is_to_chroma_col))
-
-                if not cursor.fetchone():
-                    print(f"表 '{table_name}' 不包含 '{is_to_chroma_col}' 列，跳过")
-                    continue
+                CREATE TABLE IF NOT EXISTS `{UPLOAD_REGISTRY_TABLE}` (
+                    `content_hash` VARCHAR(32) NOT NULL,
+                    `table_name` VARCHAR(64) NOT NULL,
+                    `options_key` VARCHAR(191) NOT NULL DEFAULT '',
+                    `filename` VARCHAR(255),
+                    `job_id` VARCHAR(32) NOT NULL,
+                    `result` MEDIUMTEXT,
+                    `created_at` DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP,
+                    PRIMARY KEY (`content_hash`, `table_name`, `options_key`)
+                ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
+                """)
+            elif 'options_key' not in columns:
+                # 早期的登记表只以内容哈希为键
+                cursor.execute(
+                    f"ALTER TABLE `{UPLOAD_REGISTRY_TABLE}` "
+                    f"ADD COLUMN `options_key` VARCHAR(191) NOT NULL DEFAULT '' AFTER `table_name`, "
+                    f"DROP PRIMARY KEY, ADD PRIMARY KEY (`content_hash`, `table_name`, `options_key`)"
+                )
+            cursor.execute(
+                f"REPLACE INTO `{UPLOAD_REGISTRY_TABLE}` "
+                f"(`content_hash`, `table_name`, `options_key`, `filename`, `job_id`, `result`) "
+                f"VALUES (%s, %s, %s, %s, %s, %s)",
+                (content_hash, table_name, options_key, filename[:255], job_id,
+                 json.dumps(result, ensure_ascii=False))
+            )
+        connection.commit()
+        if columns is None or 'options_key' not in columns:
+            MySqlCatalog.invalidate(db_name)
+        return True
+    except pymysql.MySQLError as e:
+        print(f"登记上传记录失败: {e}")
+        connection.rollback()
+        return False
 
-                # 查询is_to_chroma=0的记录总数
-                cursor.execute(f"SELECT COUNT(*) as total FROM `{table_name}` WHERE `{is_to_chroma_col}` = 0")
-                total_records = cursor.fetchone()['total']
 
-                if total_records == 0:
-                    print(f"表 '{table_name}' 中没有is_to_chroma=0的记录")
-                    all_tables_data[table_name] = pd.DataFrame()  # 返回空DataFrame
-                    continue
+# 每个租户数据库中记录各表已分配 ID 上限的序列表
+ID_SEQUENCE_TABLE = 'id_sequences'
 
-                print(f"从表 '{table_name}' 读取 {total_records} 条is_to_chroma=0的记录")
 
-                # 分批查询数据，避免内存溢出
-                offset = 0
-                all_records = []
+def reserve_id_range(connection, db_name: str, table_name: str, count: int, id_column: str = 'id') -> int:
+    """
+    为 table_name 原子地预留 count 个连续 ID，返回区间的起始值（区间为 [start, start + count - 1]）。
+
+    每张表在 id_sequences 中有一行序列记录，预留只需一条语句：
+    UPDATE ... SET high_id = LAST_INSERT_ID(high_id + count)，只锁序列行，并通过 LAST_INSERT_ID(expr) 直接取回新的上限。
+    序列行不存在时先以表中现有的 MAX(id) 为起点插入（INSERT IGNORE ... SELECT，每张表只执行一次），
+    此后的预留不再读取漏洞表，不会等待其他任务尚未提交的插入。
+    预留完成后立即提交，释放序列行锁，因此多个上传可以同时为同一张表分配 ID，互不冲突。
+    预留后未能插入的 ID（例如因重复被忽略）会留下空洞，不会被重新分配。
+    """
+    if count <= 0:
+        raise ValueError(f"预留的 ID 数量必须为正数: {count}")
+    try:
+        sequence_exists = table_exists(connection, ID_SEQUENCE_TABLE, db_name)
+        with connection.cursor() as cursor:
+            cursor.execute(f"USE `{db_name}`")
+            if not sequence_exists:
+                cursor.execute(f"""
+                CREATE TABLE IF NOT EXISTS `{ID_SEQUENCE_TABLE}` (
+                    `table_name` VARCHAR(64) NOT NULL,
+                    `high_id` BIGINT UNSIGNED NOT NULL,
+                    PRIMARY KEY (`table_name`)
+                ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
+                """)
+                MySqlCatalog.invalidate(db_name)
+            reserve_sql = (f"UPDATE `{ID_SEQUENCE_TABLE}` SET `high_id` = LAST_INSERT_ID(`high_id` + %s) "
+                           f"WHERE `table_name` = %s")
+            if not cursor.execute(reserve_sql, (count, table_name)):
+                # 首次为这张表预留：以现有的 MAX(id) 初始化序列行并提交，并发的初始化由 INSERT IGNORE 只保留一份
+                physical_table, scope_sql, scope_params = _table_scope(connection, db_name, table_name)
+                cursor.execute(
+                    f"INSERT IGNORE INTO `{ID_SEQUENCE_TABLE}` (`table_name`, `high_id`) "
+                    f"SELECT %s, COALESCE(MAX(`{id_column}`), 0) FROM `{physical_table}` WHERE {scope_sql}1",
+                    (table_name, *scope_params)
+                )
+                connection.commit()
+                cursor.execute(reserve_sql, (count, table_name))
+            high_id = cursor.lastrowid
+        connection.commit()
+    except (pymysql.MySQLError, KeyError, TypeError) as e:
+        connection.rollback()
+        print(f"错误: 为表 '{table_name}' 预留 ID 时出错: {e}")
+        # 向上抛出异常，让调用方决定如何处理错误
+        raise
 
-                while True:
-                    cursor.execute(f"""
-                        SELECT * 
-                        FROM `{table_name}` 
-                        WHERE `{is_to_chroma_col}` = 0 
-                        LIMIT %s OFFSET %s
-                    """, (batch_size, offset))
+    start = int(high_id) - count + 1
+    print(f"信息: 为表 '{table_name}' 预留了 ID 区间 [{start}, {high_id}]。")
+    return start
 
-                    records = cursor.fetchall()
-                    if not records:
-                        break
 
-                    all_records.extend(records)
-                    offset += len(records)
-                    print(f"  已读取 {offset}/{total_records} 条记录")
+def iter_unindexed_batches(connection, db_name: str, table_name: str, batch_size: int = 5000,
+                           status_column: str = 'is_indexed_to_chroma', id_column: str = 'id', id_range=None):
+    """
+    以键集分页（WHERE status = 0 AND id > last_id ORDER BY id LIMIT n）逐批读取未索引的行，
+    每次产出一个不超过 batch_size 行的 DataFrame。
+
+    与 LIMIT/OFFSET 不同，每一批都从上一批的最大 id 之后开始，沿 (status, id) 索引直接定位，
+    不需要跳过前面的行，因此每批耗时不随表的大小增长；调用方处理完一批再取下一批，内存占用保持平稳。
+    漏洞模板表的 idx_is_indexed_to_chroma 二级索引隐含主键 id，正好覆盖这一查询。
+    id_range=(start, end) 时只读取该闭区间内的行（消费 chroma_outbox 时使用）。
+    合并存储时读取 findings 表中该日期的行，findings 的 (is_indexed_to_chroma, scan_date, id) 索引同样覆盖这一查询。
+    """
+    physical_table, scope_sql, scope_params = _table_scope(connection, db_name, table_name)
+    has_status_index = MySqlCatalog.get_catalog().has_index(connection, db_name, physical_table,
+                                                            'idx_is_indexed_to_chroma')
+    index_hint = "FORCE INDEX (`idx_is_indexed_to_chroma`)" if has_status_index else ""
+    with connection.cursor() as cursor:
+        cursor.execute(f"USE `{db_name}`")
+
+    upper_bound = f"AND `{id_column}` <= {int(id_range[1])} " if id_range else ""
+    sql = (f"SELECT * FROM `{physical_table}` {index_hint} "
+           f"WHERE {scope_sql}`{status_column}` = 0 AND `{id_column}` > %s {upper_bound}"
+           f"ORDER BY `{id_column}` LIMIT %s")
+    last_id = int(id_range[0]) - 1 if id_range else 0
+    while True:
+        with connection.cursor() as cursor:
+            cursor.execute(sql, (*scope_params, last_id, batch_size))
+            records = cursor.fetchall()
+        if not records:
+            return
+        last_id = records[-1][id_column]
+        yield pd.DataFrame(records)
+        if len(records) < batch_size:
+            return
+
+
+# 读取特定数据库中所有表的is_to_chroma=0的记录并转换为Pandas DataFrame
+# 返回类型	dict[str, pd.DataFrame] (按表分离)
+def select_is_to_chroma_data(connection, db_name, is_to_chroma_col='is_to_chroma', batch_size=10000):
+    """
+    读取特定数据库中所有表的is_to_chroma=0的记录并转换为Pandas DataFrame
+    逐批读取使用 iter_unindexed_batches 的键集分页；只需要逐批处理时请直接使用该生成器。
+    """
+    all_tables_data = {}
 
-                # 转换为DataFrame
-                if all_records:
-                    df = pd.DataFrame(all_records)
-                    all_tables_data[table_name] = df
-                    print(f"表 '{table_name}' 的数据已转换为DataFrame，形状: {df.shape}")
-                else:
-                    all_tables_data[table_name] = pd.DataFrame()
-                    print(f"表 '{table_name}' 没有符合条件的记录")
+    catalog = MySqlCatalog.get_catalog()
+    try:
+        # 获取指定数据库中的所有表名
+        tables = catalog.tables(connection, db_name)
+
+        if not tables:
+            print(f"数据库 '{db_name}' 中没有找到表")
+            return all_tables_data
+
+        print(f"开始处理数据库 '{db_name}' 中的 {len(tables)} 个表")
+
+        # 遍历每个表
+        for table_name in tables:
+            # 检查表是否存在is_to_chroma列
+            has_status_column = is_to_chroma_col in (catalog.columns(connection, db_name, table_name) or ())
+
+            if not has_status_column:
+                print(f"表 '{table_name}' 不包含 '{is_to_chroma_col}' 列，跳过")
+                continue
+
+            # 分批查询数据，避免内存溢出
+            batches = list(iter_unindexed_batches(connection, db_name, table_name, batch_size,
+                                                  status_column=is_to_chroma_col))
+            if batches:
+                df = pd.concat(batches, ignore_index=True)
+                all_tables_data[table_name] = df
+                print(f"表 '{table_name}' 的数据已转换为DataFrame，形状: {df.shape}")
+            else:
+                all_tables_data[table_name] = pd.DataFrame()
+                print(f"表 '{table_name}' 中没有is_to_chroma=0的记录")
 
     except pymysql.MySQLError as e:
         print(f"查询数据失败: {e}")
@@ -419,6 +1572,7 @@ def fetch_unindexed_data_from_all_tables(connection, db_name: str,
     扫描指定数据库中的所有表，提取尚未被索引的行，并聚合成一个 Pandas DataFrame。
     从数据库中的全部表里读取 is_to_chroma=0 的内容，保留列名称和is_to_chroma字段
     pd.DataFrame (所有数据合并)
+    积压较大时请改用 iter_unindexed_data_from_all_tables 逐批流式处理，避免一次性载入内存。
     """
     all_unindexed_dfs = []
     total_rows_found = 0
@@ -428,9 +1582,8 @@ def fetch_unindexed_data_from_all_tables(connection, db_name: str,
             # 1. 切换到目标数据库
             cursor.execute(f"USE `{db_name}`")
 
-            # 2. 获取数据库中的所有表名
-            cursor.execute("SHOW TABLES")
-            tables = [table[f'Tables_in_{db_name}'] for table in cursor.fetchall()]
+            # 2. 获取数据库中的所有表名（来自表结构目录）
+            tables = MySqlCatalog.get_catalog().tables(connection, db_name)
 
             if not tables:
                 print(f"信息: 数据库 '{db_name}' 中没有找到任何表。")
@@ -480,67 +1633,478 @@ def fetch_unindexed_data_from_all_tables(connection, db_name: str,
         return pd.DataFrame()
 
 
+
+def iter_unindexed_data_from_all_tables(connection, db_name: str, batch_size: int = 5000, columns=None,
+                                        status_column: str = 'is_indexed_to_chroma'):
+    """
+    逐表、逐批地流式读取数据库中所有表里未索引的行，产出 (table_name, DataFrame)，每个 DataFrame 不超过 batch_size 行。
+
+    使用服务器端游标（SSDictCursor）：结果集由 MySQL 逐批发送，客户端任何时刻只持有一批数据，
+    积压多大都能以恒定内存完成回填。与 fetch_unindexed_data_from_all_tables 不同，不会把所有表合并成一个 DataFrame。
+
+    注意：服务器端游标读取期间，同一个连接不能执行其他语句。回写状态（UPDATE）等操作请使用另一个连接，
+    或等当前表读完（生成器切换到下一张表）之后再执行。
+
+    :param columns: 只读取这些列（列投影），None 表示全部列；缺少其中任何一列的表会被跳过
+    """
+    catalog = MySqlCatalog.get_catalog()
+    table_columns = {table: set(catalog.columns(connection, db_name, table) or ())
+                     for table in catalog.tables(connection, db_name)}
+    with connection.cursor() as cursor:
+        cursor.execute(f"USE `{db_name}`")
+
+    for table_name in sorted(table_columns):
+        available = table_columns[table_name]
+        if status_column not in available:
+            continue
+        if columns is not None and not set(columns) <= available:
+            print(f"     ⚠️ 警告: 表 '{table_name}' 缺少列 {sorted(set(columns) - available)}，跳过此表。")
+            continue
+
+        select_list = ", ".join(f"`{col}`" for col in columns) if columns is not None else "*"
+        cursor = connection.cursor(pymysql.cursors.SSDictCursor)
+        try:
+            cursor.execute(f"SELECT {select_list} FROM `{table_name}` WHERE `{status_column}` = 0")
+            rows_streamed = 0
+            while True:
+                records = cursor.fetchmany(batch_size)
+                if not records:
+                    break
+                rows_streamed += len(records)
+                yield table_name, pd.DataFrame(records, columns=columns)
+            if rows_streamed:
+                print(f"     ✅ 已从 '{table_name}' 流式读取 {rows_streamed} 条未索引的记录。")
+        finally:
+            # 关闭时会读完并丢弃剩余结果，使连接可以继续执行其他语句
+            cursor.close()
+
+
 import chromadb
 
 
-# 将单个表中的 is_indexed_to_chroma=0 的值给放到chromadb中后，修改is_indexed_to_chroma=1
-def sync_mysql_to_chromadb(
-        connection,
-        chroma_client: chromadb.Client,
-        db_name: str,
-        table_name: str,
-        collection_name: str,
-        batch_size: int = 500
-) -> (int, int):
-    # 移除表名用户ID前缀逻辑，因为现在是独立数据库
-    print(f"\n--- 开始执行 MySQL -> ChromaDB 增量同步调度 (批次大小: {batch_size}) ---")
+def _id_ranges(ids) -> list:
+    """把 id 集合压缩为有序的连续区间 [(start, end), ...]。"""
+    ranges = []
+    for row_id in sorted(set(int(i) for i in ids)):
+        if ranges and row_id == ranges[-1][1] + 1:
+            ranges[-1][1] = row_id
+        else:
+            ranges.append([row_id, row_id])
+    return [tuple(r) for r in ranges]
+
 
+def update_status_by_ids(connection, db_name: str, table_name: str, ids, column: str, value,
+                         max_predicates: int = 500, id_column: str = 'id') -> int:
+    """
+    按主键集合批量更新状态列，不提交事务，返回更新的行数。
+
+    id 先被压缩为连续区间：区间用 `id BETWEEN a AND b`，孤立的 id 归入 `id IN (...)`，
+    每条 UPDATE 最多包含 max_predicates 个区间/id，由主键范围扫描直接定位。
+    同一次导入的批次 id 基本连续，10 万行通常只需要一条语句，而不是 10 万次按 uuid 的全表扫描。
+    """
+    ranges = _id_ranges(ids)
+    if not ranges:
+        return 0
+
+    physical_table, scope_sql, scope_params = _table_scope(connection, db_name, table_name)
+    rows_updated = 0
+    with connection.cursor() as cursor:
+        cursor.execute(f"USE `{db_name}`")
+        for start in range(0, len(ranges), max_predicates):
+            chunk = ranges[start:start + max_predicates]
+            spans = [(a, b) for a, b in chunk if b > a]
+            singles = [a for a, b in chunk if b == a]
+            predicates = [f"`{id_column}` BETWEEN %s AND %s"] * len(spans)
+            params = [value, *scope_params] + [bound for span in spans for bound in span]
+            if singles:
+                predicates.append(f"`{id_column}` IN ({', '.join(['%s'] * len(singles))})")
+                params.extend(singles)
+            rows_updated += cursor.execute(
+                f"UPDATE `{physical_table}` SET `{column}` = %s WHERE {scope_sql}({' OR '.join(predicates)})",
+                params
+            )
+    return rows_updated
+
+
+def mark_rows_indexed(connection, db_name: str, table_name: str, ids) -> int:
+    """把一批已写入 ChromaDB 的行（按主键 id）标记为已索引并提交，返回更新的行数。"""
+    rows_updated = update_status_by_ids(connection, db_name, table_name, ids, 'is_indexed_to_chroma', True)
+    connection.commit()
+    return rows_updated
+
+
+def count_unindexed_rows(connection, db_name: str, table_name: str, id_range=None) -> int:
+    """
+    统计表中尚未同步到 ChromaDB 的行数（走 idx_is_indexed_to_chroma 索引），失败返回 -1。
+    id_range=(start, end) 时只统计该 id 闭区间。
+    """
     try:
-        # --- 步骤 1: 从 MySQL 中分批读取“未索引”的数据 ---
+        physical_table, scope_sql, params = _table_scope(connection, db_name, table_name)
+        sql = (f"SELECT COUNT(*) AS backlog FROM `{db_name}`.`{physical_table}` "
+               f"WHERE {scope_sql}`is_indexed_to_chroma` = FALSE")
+        if id_range:
+            sql += " AND `id` BETWEEN %s AND %s"
+            params = (*params, int(id_range[0]), int(id_range[1]))
         with connection.cursor() as cursor:
-            cursor.execute(f"USE `{db_name}`")
-            query_sql = f"SELECT * FROM `{table_name}` WHERE `is_indexed_to_chroma` = FALSE LIMIT %s"
-            cursor.execute(query_sql, (batch_size,))
-            results = cursor.fetchall()
-
-        if not results:
-            print("信息: 没有需要同步到 ChromaDB 的新数据。调度完成。")
-            return (0, 0)
-
-        # 将查询结果转换为 Pandas DataFrame
-        incremental_df = pd.DataFrame(results)
-        print(f"从 MySQL 中查询到 {len(incremental_df)} 条新数据，准备交由处理函数进行索引。")
-
-        # --- 步骤 2: 调用核心处理函数来执行索引 ---
-        # 注意：这里的 clear_existing_index 必须为 False，因为我们是在做增量添加
-        collection = VectorDatabase.index_dataframe_to_chromadb(
-            df=incremental_df,
-            chroma_client=chroma_client,
-            collection_name=collection_name,
-            clear_existing_index=False
-        )
+            cursor.execute(sql, params)
+            backlog = cursor.fetchone()['backlog']
+        connection.commit()
+        return backlog
+    except pymysql.MySQLError as e:
+        print(f"错误: 无法统计表 '{table_name}' 的未索引行数: {e}")
+        return -1
+
+
+def list_indexable_tables(connection, tenants=None, refresh: bool = False) -> list:
+    """
+    按表结构目录列出所有租户数据库中带 is_indexed_to_chroma 列的表，返回 [(db_name, table_name), ...]。
+    tenants 不为空时只返回这些数据库中的表；refresh=True 时重新加载目录，看到其他进程新建的表。
+    合并存储的 findings 表展开为仍有未索引行的逻辑日期表（YYYY_MM_DD），由索引 (is_indexed_to_chroma, scan_date, id) 直接得出。
+    """
+    catalog = MySqlCatalog.get_catalog()
+    databases = catalog.databases(connection, refresh)
+    if tenants:
+        databases = [db_name for db_name in databases if db_name in tenants]
+    tables = []
+    for db_name in databases:
+        for table_name in catalog.tables(connection, db_name, refresh):
+            if 'is_indexed_to_chroma' not in catalog.columns(connection, db_name, table_name):
+                continue
+            if table_name == FINDINGS_TABLE:
+                with connection.cursor() as cursor:
+                    cursor.execute(
+                        f"SELECT DISTINCT `scan_date` FROM `{db_name}`.`{FINDINGS_TABLE}` "
+                        f"WHERE `is_indexed_to_chroma` = FALSE ORDER BY `scan_date`"
+                    )
+                    tables.extend((db_name, f"{row['scan_date']:%Y_%m_%d}") for row in cursor.fetchall())
+                connection.commit()
+            else:
+                tables.append((db_name, table_name))
+    return tables
 
-        # 记录成功处理的数量
-        processed_count = len(incremental_df)
 
-        # --- 步骤 3: 如果索引成功，更新 MySQL 中的状态 ---
-        uuids_to_update = incremental_df['uuid'].tolist()
+# 后台同步进度表（每个租户数据库一份）：每张表最近一次同步到的 id、累计索引行数和剩余积压
+SYNC_STATE_TABLE = 'chroma_sync_state'
 
+
+def get_sync_checkpoints(connection, db_name: str) -> dict:
+    """读取租户各表的后台同步进度，返回 {table_name: {...}}；进度表尚不存在时返回空字典。"""
+    if not table_exists(connection, SYNC_STATE_TABLE, db_name):
+        return {}
+    try:
         with connection.cursor() as cursor:
-            # 使用 executemany 以获得更好的性能和安全性
-            update_sql = f"UPDATE `{table_name}` SET `is_indexed_to_chroma` = TRUE WHERE `uuid` = %s"
-            # 准备待更新的 uuid 元组列表
-            update_tuples = [(uuid,) for uuid in uuids_to_update]
-            rows_updated = cursor.executemany(update_sql, update_tuples)
+            cursor.execute(
+                f"SELECT `table_name`, `last_indexed_id`, `rows_indexed`, `pending_rows`, `last_synced_at`, `last_error` "
+                f"FROM `{db_name}`.`{SYNC_STATE_TABLE}`"
+            )
+            records = cursor.fetchall()
+        connection.commit()
+    except pymysql.MySQLError as e:
+        print(f"错误: 读取同步进度时出错: {e}")
+        return {}
+    for record in records:
+        record['last_synced_at'] = str(record['last_synced_at']) if record['last_synced_at'] else None
+    return {record.pop('table_name'): record for record in records}
+
 
+def save_sync_checkpoint(connection, db_name: str, table_name: str, last_indexed_id: int = None,
+                         rows_indexed: int = 0, pending_rows: int = 0, error: str = None) -> bool:
+    """
+    记录一次同步后的进度：last_indexed_id 只增不减，rows_indexed 累加，pending_rows 与 last_error 覆盖。
+    行是否已索引仍以 is_indexed_to_chroma 为准（并发任务的 id 区间可能晚于更大的 id 提交），
+    这里的进度只用于观察延迟和排查，不用来跳过行。
+    """
+    state_known = table_exists(connection, SYNC_STATE_TABLE, db_name)
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute(f"USE `{db_name}`")
+            cursor.execute(f"""
+            CREATE TABLE IF NOT EXISTS `{SYNC_STATE_TABLE}` (
+                `table_name` VARCHAR(64) NOT NULL,
+                `last_indexed_id` BIGINT,
+                `rows_indexed` BIGINT NOT NULL DEFAULT 0,
+                `pending_rows` BIGINT NOT NULL DEFAULT 0,
+                `last_synced_at` DATETIME,
+                `last_error` TEXT,
+                PRIMARY KEY (`table_name`)
+            ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
+            """)
+            cursor.execute(
+                f"INSERT INTO `{SYNC_STATE_TABLE}` "
+                f"(`table_name`, `last_indexed_id`, `rows_indexed`, `pending_rows`, `last_synced_at`, `last_error`) "
+                f"VALUES (%s, %s, %s, %s, NOW(), %s) "
+                f"ON DUPLICATE KEY UPDATE "
+                f"`last_indexed_id` = GREATEST(COALESCE(`last_indexed_id`, 0), COALESCE(VALUES(`last_indexed_id`), 0)), "
+                f"`rows_indexed` = `rows_indexed` + VALUES(`rows_indexed`), "
+                f"`pending_rows` = VALUES(`pending_rows`), `last_synced_at` = NOW(), `last_error` = VALUES(`last_error`)",
+                (table_name, last_indexed_id, rows_indexed, pending_rows, error)
+            )
         connection.commit()
-        print(f"成功在 MySQL 中将 {rows_updated} 条记录的状态更新为“已索引”。")
-        print(f"--- 增量同步调度批次成功结束 ---\n")
+        if not state_known:
+            MySqlCatalog.invalidate(db_name)
+        return True
+    except pymysql.MySQLError as e:
+        print(f"记录同步进度失败: {e}")
+        connection.rollback()
+        return False
+
+
+# 变更日志（事务性发件箱，每个租户数据库一份）：写入漏洞表的同一事务中记录 (表, id 区间, 操作)，
+# 后台同步按 seq 顺序消费，发现待办工作的开销与积压量成正比，而不是与每日表的数量成正比。
+SYNC_OUTBOX_TABLE = 'chroma_outbox'
+# 目前只有写入漏洞表会产生记录；删除行的代码出现之前不定义 delete 操作，避免出现无人生产的消费分支
+OUTBOX_OPS = ('upsert',)
 
-        return (processed_count, rows_updated)
 
+def create_sync_outbox_table(connection, db_name: str) -> bool:
+    """确保租户数据库中存在 chroma_outbox 表。DDL 会隐式提交，因此必须在写数据的事务开始之前调用。"""
+    if table_exists(connection, SYNC_OUTBOX_TABLE, db_name):
+        return True
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute(f"""
+            CREATE TABLE IF NOT EXISTS `{db_name}`.`{SYNC_OUTBOX_TABLE}` (
+                `seq` BIGINT UNSIGNED NOT NULL AUTO_INCREMENT,
+                `table_name` VARCHAR(64) NOT NULL,
+                `start_id` INT UNSIGNED NOT NULL,
+                `end_id` INT UNSIGNED NOT NULL,
+                `op` ENUM('upsert') NOT NULL DEFAULT 'upsert',
+                `created_at` DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP,
+                PRIMARY KEY (`seq`)
+            ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
+            """)
+        connection.commit()
+        MySqlCatalog.invalidate(db_name)
+        return True
+    except pymysql.MySQLError as e:
+        print(f"创建同步发件箱表失败: {e}")
+        return False
+
+
+def record_outbox_ranges(cursor, table_name: str, ids, op: str = 'upsert') -> int:
+    """
+    在调用方的事务中（使用调用方的 cursor，不提交）把 ids 压缩为连续区间写入 chroma_outbox，返回写入的记录数。
+    数据和发件箱记录一起提交或一起回滚，后台同步不会错过已提交的行，也不会看到已回滚的行。
+    """
+    if op not in OUTBOX_OPS:
+        raise ValueError(f"未知的发件箱操作: {op}")
+    ranges = _id_ranges(ids)
+    if ranges:
+        cursor.executemany(
+            f"INSERT INTO `{SYNC_OUTBOX_TABLE}` (`table_name`, `start_id`, `end_id`, `op`) VALUES (%s, %s, %s, %s)",
+            [(table_name, start, end, op) for start, end in ranges]
+        )
+    return len(ranges)
+
+
+def list_outbox_tenants(connection, tenants=None) -> list:
+    """
+    按表结构目录列出带有 chroma_outbox 表的租户数据库。
+    不在目录未命中时重新加载：其他进程为新租户建的发件箱最迟在目录 ttl 之后被发现。
+    """
+    catalog = MySqlCatalog.get_catalog()
+    databases = catalog.databases(connection)
+    if tenants:
+        databases = [db_name for db_name in databases if db_name in tenants]
+    return [db_name for db_name in databases if SYNC_OUTBOX_TABLE in catalog.tables(connection, db_name)]
+
+
+def fetch_outbox_entries(connection, db_name: str, limit: int = 100) -> list:
+    """按 seq 顺序读取最早的 limit 条待处理发件箱记录（主键顺序扫描，只读到需要的行）。"""
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"SELECT `seq`, `table_name`, `start_id`, `end_id`, `op`, `created_at` "
+            f"FROM `{db_name}`.`{SYNC_OUTBOX_TABLE}` ORDER BY `seq` LIMIT %s",
+            (limit,)
+        )
+        entries = cursor.fetchall()
+    connection.commit()
+    return entries
+
+
+def complete_outbox_entries(connection, db_name: str, seqs) -> int:
+    """删除已处理完的发件箱记录并提交，发件箱中始终只有待处理的记录。"""
+    rows_deleted = 0
+    ranges = _id_ranges(seqs)
+    if not ranges:
+        return 0
+    with connection.cursor() as cursor:
+        for start, end in ranges:
+            rows_deleted += cursor.execute(
+                f"DELETE FROM `{db_name}`.`{SYNC_OUTBOX_TABLE}` WHERE `seq` BETWEEN %s AND %s", (start, end)
+            )
+    connection.commit()
+    return rows_deleted
+
+
+def get_outbox_lag(connection, db_name: str) -> dict:
+    """发件箱积压：待处理记录数、涉及的 id 数和最早一条记录的等待秒数。"""
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"SELECT COUNT(*) AS entries, COALESCE(SUM(`end_id` - `start_id` + 1), 0) AS ids, "
+            f"TIMESTAMPDIFF(SECOND, MIN(`created_at`), NOW()) AS lag_seconds "
+            f"FROM `{db_name}`.`{SYNC_OUTBOX_TABLE}`"
+        )
+        lag = cursor.fetchone()
+    connection.commit()
+    return {'entries': int(lag['entries']), 'ids': int(lag['ids']),
+            'lag_seconds': int(lag['lag_seconds']) if lag['lag_seconds'] is not None else 0}
+
+
+def _put_unless_stopped(q: queue.Queue, item, stop: threading.Event) -> bool:
+    while not stop.is_set():
+        try:
+            q.put(item, timeout=0.5)
+            return True
+        except queue.Full:
+            continue
+    return False
+
+
+def _get_unless_stopped(q: queue.Queue, stop: threading.Event):
+    while not stop.is_set():
+        try:
+            return q.get(timeout=0.5)
+        except queue.Empty:
+            continue
+    return None
+
+
+# 将单个表中的 is_indexed_to_chroma=0 的值给放到chromadb中后，修改is_indexed_to_chroma=1
+def sync_mysql_to_chromadb(
+        connection,
+        chroma_client: chromadb.Client,
+        db_name: str,
+        table_name: str,
+        collection_name: str,
+        batch_size: int = 500,
+        prefetch: int = 2,
+        on_batch=None,
+        max_rows: int = None,
+        id_range=None
+) -> (int, int):
+    """
+    把表中所有未索引的行同步到 ChromaDB，直到表被读完为止，返回 (写入 ChromaDB 的行数, 标记为已索引的行数)；失败返回 (-1, -1)。
+    max_rows 不为空时，读满约 max_rows 行（按整批计）后即停止，剩余的行留给下一次同步。
+    id_range=(start, end) 时只同步该 id 闭区间内的行（即一条 chroma_outbox 记录）。
+
+    三个阶段以有界流水线方式重叠执行：
+    - 读取线程：用从连接池借出的独立连接，按键集分页（iter_unindexed_batches）预读后续批次；
+    - 当前线程：把当前批次向量化并写入 ChromaDB；
+    - 标记线程：用调用方传入的 connection 把上一批次标记为已索引。
+    两个队列的容量都是 prefetch，内存中最多只有 2 * prefetch + 1 个批次。
+    每个批次完成后打印吞吐量和积压指标；on_batch 不为空时以指标字典调用它。
+    """
+    # 移除表名用户ID前缀逻辑，因为现在是独立数据库
+    print(f"\n--- 开始执行 MySQL -> ChromaDB 同步 (批次大小: {batch_size}，预读 {prefetch} 批) ---")
+
+    backlog = count_unindexed_rows(connection, db_name, table_name, id_range)
+    if backlog < 0:
+        return (-1, -1)
+    if backlog == 0:
+        print("信息: 没有需要同步到 ChromaDB 的新数据。调度完成。")
+        return (0, 0)
+    print(f"表 '{table_name}' 中有 {backlog} 条未索引数据，开始同步。")
+
+    stop = threading.Event()
+    read_queue = queue.Queue(maxsize=prefetch)
+    mark_queue = queue.Queue(maxsize=prefetch)
+    errors = []
+    marked = [0]
+    marker_failed = threading.Event()
+
+    def reader():
+        try:
+            with MySqlPool.connection(db_name) as read_connection:
+                batches = iter_unindexed_batches(read_connection, db_name, table_name, batch_size, id_range=id_range)
+                read_rows = 0
+                while max_rows is None or read_rows < max_rows:
+                    read_start = time.perf_counter()
+                    batch = next(batches, None)
+                    if batch is None:
+                        break
+                    read_rows += len(batch)
+                    if not _put_unless_stopped(read_queue, (batch, time.perf_counter() - read_start), stop):
+                        return
+        except Exception as e:
+            # 已读出的批次照常处理完，同步最终以失败返回
+            errors.append(e)
+        _put_unless_stopped(read_queue, None, stop)
+
+    def marker():
+        while True:
+            ids = mark_queue.get()
+            if ids is None:
+                return
+            if marker_failed.is_set():
+                continue  # 标记失败后不再标记，只把队列取空，避免当前线程阻塞
+            try:
+                marked[0] += mark_rows_indexed(connection, db_name, table_name, ids)
+            except Exception as e:
+                errors.append(e)
+                marker_failed.set()
+                stop.set()
+
+    reader_thread = threading.Thread(target=reader, name=f'chroma-sync-reader-{table_name}', daemon=True)
+    marker_thread = threading.Thread(target=marker, name=f'chroma-sync-marker-{table_name}', daemon=True)
+    reader_thread.start()
+    marker_thread.start()
+
+    processed_count = 0
+    batch_no = 0
+    sync_start = time.perf_counter()
+    try:
+        while True:
+            item = _get_unless_stopped(read_queue, stop)
+            if item is None:
+                break
+            batch, read_s = item
+            index_start = time.perf_counter()
+            # 注意：这里的 clear_existing_index 必须为 False，因为我们是在做增量添加
+            VectorDatabase.index_dataframe_to_chromadb(
+                df=batch,
+                chroma_client=chroma_client,
+                collection_name=collection_name,
+                clear_existing_index=False
+            )
+            index_s = time.perf_counter() - index_start
+            # 已写入 ChromaDB 的批次总是交给标记线程（它会一直取队列），即使读取线程已经出错
+            mark_queue.put(batch['id'].tolist())
+
+            batch_no += 1
+            processed_count += len(batch)
+            elapsed = time.perf_counter() - sync_start
+            metrics = {
+                'table': table_name,
+                'batch': batch_no,
+                'rows': len(batch),
+                'read_s': round(read_s, 3),
+                'index_s': round(index_s, 3),
+                'rows_per_second': round(processed_count / elapsed, 1) if elapsed > 0 else None,
+                'processed': processed_count,
+                'last_id': int(batch['id'].max()),
+                'backlog_remaining': max(backlog - processed_count, 0),
+            }
+            print(f"  批次 {batch_no}: {len(batch)} 行，读取 {read_s:.2f}s，索引 {index_s:.2f}s，"
+                  f"累计 {processed_count} 行 ({metrics['rows_per_second']} 行/秒)，"
+                  f"剩余约 {metrics['backlog_remaining']} 行")
+            if on_batch is not None:
+                on_batch(metrics)
     except Exception as e:
-        print(f"错误: 在同步调度过程中发生严重错误: {e}")
+        errors.append(e)
+    finally:
+        # 先让标记线程处理完已写入 ChromaDB 的批次，再停止读取线程
+        mark_queue.put(None)
+        marker_thread.join()
+        stop.set()
+        reader_thread.join()
+
+    if errors:
+        print(f"错误: 在同步调度过程中发生严重错误: {errors[0]}")
         if connection and connection.open:
             connection.rollback()
         return (-1, -1)
+
+    print(f"成功在 MySQL 中将 {marked[0]} 条记录的状态更新为“已索引”。")
+    print(f"--- 同步完成: {batch_no} 个批次，{processed_count} 行，耗时 {time.perf_counter() - sync_start:.2f}s ---\n")
+    return (processed_count, marked[0])
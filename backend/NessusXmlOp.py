@@ -0,0 +1,213 @@
+# NessusXmlOp.py
+# 直接解析 Nessus 原生导出的 .nessus (NessusClientData_v2 XML) 文件，
+# 产出与 CsvDataOp.transform_nessus_data 完全相同的列集合，无需先导出为 CSV。
+import os
+import re
+import xml.etree.ElementTree as ET
+from collections import Counter
+from typing import Iterator
+from xml.sax.saxutils import unescape
+
+import pandas as pd
+
+import CsvDataOp
+
+# ReportItem 的 severity 属性 -> CSV 导出中的 'Risk' 列
+SEVERITY_TO_RISK = {'0': 'None', '1': 'Low', '2': 'Medium', '3': 'High', '4': 'Critical'}
+
+# ReportItem 中的单值子元素 -> CSV 列名
+REPORT_ITEM_FIELDS = {
+    'synopsis': 'Synopsis',
+    'description': 'Description',
+    'solution': 'Solution',
+    'see_also': 'See Also',
+    'plugin_output': 'Plugin Output',
+    'stig_severity': 'STIG Severity',
+    'cvss_base_score': 'CVSS v2.0 Base Score',
+    'cvss3_base_score': 'CVSS v3.0 Base Score',
+    'cvss_temporal_score': 'CVSS v2.0 Temporal Score',
+    'cvss3_temporal_score': 'CVSS v3.0 Temporal Score',
+    'risk_factor': 'Risk Factor',
+    'plugin_publication_date': 'Plugin Publication Date',
+    'plugin_modification_date': 'Plugin Modification Date',
+}
+
+# ReportItem 中可以重复出现的子元素 -> CSV 列名（多个值以逗号拼接）
+MULTI_VALUE_FIELDS = {'cve': 'CVE', 'bid': 'BID', 'xref': 'XREF', 'mskb': 'MSKB'}
+
+# _report_item_to_row 可能产出的全部列
+XML_COLUMNS = ['Plugin ID', 'Risk', 'Host', 'Protocol', 'Port', 'Name'] + \
+    list(REPORT_ITEM_FIELDS.values()) + list(MULTI_VALUE_FIELDS.values())
+
+
+def _report_item_to_row(host: str, item: ET.Element) -> dict:
+    """把一个 ReportItem 元素转换为以 CSV 列名为键的字典。"""
+    row = {
+        'Plugin ID': item.get('pluginID'),
+        'Risk': SEVERITY_TO_RISK.get(item.get('severity', '0'), 'None'),
+        'Host': host,
+        'Protocol': item.get('protocol'),
+        'Port': item.get('port'),
+        'Name': item.get('pluginName'),
+    }
+    multi_values = {col: [] for col in MULTI_VALUE_FIELDS.values()}
+    for child in item:
+        text = (child.text or '').strip()
+        if not text:
+            continue
+        if child.tag in REPORT_ITEM_FIELDS:
+            row[REPORT_ITEM_FIELDS[child.tag]] = text
+        elif child.tag in MULTI_VALUE_FIELDS:
+            multi_values[MULTI_VALUE_FIELDS[child.tag]].append(text)
+
+    # CVE 与 CSV 流程的合并结果保持一致：去重、排序、逗号拼接
+    row['CVE'] = ','.join(sorted(set(multi_values.pop('CVE'))))
+    for col, values in multi_values.items():
+        row[col] = ','.join(values) if values else None
+    return row
+
+
+def iter_nessus_xml_hosts(nessus_file) -> Iterator[tuple]:
+    """
+    基于 iterparse 流式遍历 .nessus 文件，每处理完一个 ReportHost 产出 (主机名, 该主机全部 ReportItem 的行字典列表)。
+    每处理完一个 ReportHost 就清空已解析的元素，内存占用只取决于单个主机的发现项数量，与主机数量无关。
+
+    :param nessus_file: .nessus 文件路径或二进制文件对象
+    """
+    report = None
+    host = None
+    rows = []
+    for event, elem in ET.iterparse(nessus_file, events=('start', 'end')):
+        if event == 'start':
+            if elem.tag == 'Report':
+                report = elem
+            elif elem.tag == 'ReportHost':
+                host = elem.get('name')
+            continue
+
+        if elem.tag == 'ReportItem':
+            rows.append(_report_item_to_row(host, elem))
+            elem.clear()
+        elif elem.tag == 'ReportHost':
+            yield host, rows
+            elem.clear()
+            # 从父节点上摘掉已处理的主机，避免空元素在 Report 下不断累积
+            if report is not None:
+                report.clear()
+            host = None
+            rows = []
+
+
+def iter_nessus_xml_rows(nessus_file) -> Iterator[dict]:
+    """逐个产出 ReportItem 对应的行字典（见 iter_nessus_xml_hosts）。"""
+    for _, rows in iter_nessus_xml_hosts(nessus_file):
+        yield from rows
+
+
+# 预扫描 ReportHost 开始标签，只取 name 属性
+REPORT_HOST_TAG = re.compile(rb'<ReportHost\b[^>]*?\bname\s*=\s*(["\'])(.*?)\1', re.S)
+SCAN_BLOCK_SIZE = 1024 * 1024
+
+
+def _repeated_report_hosts(nessus_file):
+    """
+    不解析 XML，只按块扫描原始字节中的 ReportHost 开始标签，返回出现在多个 ReportHost 元素中的主机名集合。
+    文件对象不能回到原位置（不可 seek）时返回 None。
+    误把文本中的内容当成标签只会让主机被多算，不会漏算真正重复的主机。
+    """
+    if isinstance(nessus_file, (str, os.PathLike)):
+        with open(nessus_file, 'rb') as f:
+            return _repeated_report_hosts(f)
+    if not (hasattr(nessus_file, 'seekable') and nessus_file.seekable()):
+        return None
+
+    position = nessus_file.tell()
+    counts = Counter()
+    tail = b''
+    while True:
+        block = nessus_file.read(SCAN_BLOCK_SIZE)
+        data = tail + block
+        end = 0
+        for match in REPORT_HOST_TAG.finditer(data):
+            counts[match.group(2)] += 1
+            end = match.end()
+        if not block:
+            break
+        # 跨越块边界的标签从开头保留到下一块；已经完整但没有 name 的标签直接丢弃
+        last = data.rfind(b'<ReportHost', end)
+        if last >= 0 and data.find(b'>', last) < 0:
+            tail = data[last:]
+        else:
+            tail = data[-len(b'<ReportHost'):]
+    nessus_file.seek(position)
+    return {unescape(name.decode('utf-8', errors='replace'), {'&quot;': '"', '&apos;': "'"})
+            for name, count in counts.items() if count > 1}
+
+
+def _rows_to_frame(rows: list) -> pd.DataFrame:
+    # 固定列集合：缺少某个子元素的主机也要有对应的列，才能与其他主机拼接或增量合并
+    df = pd.DataFrame(rows, columns=XML_COLUMNS)
+    for col in ('Plugin ID', 'Port'):
+        df[col] = pd.to_numeric(df[col], errors='coerce')
+    return df
+
+
+def iter_nessus_xml_chunks(nessus_file, batch_size: int = 5000) -> Iterator[pd.DataFrame]:
+    """
+    流式解析 .nessus 文件，按 batch_size 产出与 transform_nessus_data 列集合一致的 DataFrame 批次。
+
+    处理规则与 CSV 流程对齐：
+    - 'Risk' 为 None 的信息类发现项会被丢弃（CSV 流程中它们被读成空值后删除）。
+    - 按 (Plugin ID, Host, Port) 合并重复项。同一主机的发现项都在一个 ReportHost 中，
+      因此每读完一个 ReportHost 就在主机内合并，凑满 batch_size 即产出，内存与主机数量无关。
+    - 少数文件中同一主机出现在多个 ReportHost 元素里（由 _repeated_report_hosts 预先扫描得出），
+      只有这些主机的发现项跨元素增量合并，在文件读完后产出。文件对象不可 seek 时无法预扫描，全部按这种方式处理。
+
+    :param nessus_file: .nessus 文件路径或二进制文件对象
+    :param batch_size: 每个产出批次的最大行数
+    """
+    scan_date = CsvDataOp._get_scan_date(nessus_file)
+    repeated = _repeated_report_hosts(nessus_file)
+    merger = CsvDataOp._IncrementalFindingMerger()
+    pending = []
+    pending_rows = 0
+    total_items = 0
+    total_findings = 0
+
+    def take(final: bool):
+        # 产出 pending 中凑满的批次，final=True 时连同最后不满的一批
+        frame = pd.concat(pending, ignore_index=True)
+        pending.clear()
+        full = len(frame) if final else len(frame) // batch_size * batch_size
+        for start in range(0, full, batch_size):
+            yield CsvDataOp._finalize_nessus_frame(frame.iloc[start:start + batch_size], scan_date)
+        if full < len(frame):
+            pending.append(frame.iloc[full:])
+
+    for host, rows in iter_nessus_xml_hosts(nessus_file):
+        total_items += len(rows)
+        rows = [row for row in rows if row['Risk'] != 'None']
+        if not rows:
+            continue
+        df = _rows_to_frame(rows)
+        if repeated is None or host in repeated:
+            merger.add(df, cves_are_joined=True)
+            continue
+        df = CsvDataOp._merge_duplicate_findings(df, cves_are_joined=True)
+        total_findings += len(df)
+        pending.append(df)
+        pending_rows += len(df)
+        if pending_rows >= batch_size:
+            yield from take(final=False)
+            pending_rows = sum(len(frame) for frame in pending)
+
+    merged = merger.result()
+    if merged is not None:
+        total_findings += len(merged)
+        pending.append(merged)
+    if pending:
+        yield from take(final=True)
+
+    if total_items < 1:
+        raise ValueError(f".nessus 文件 '{nessus_file}' 中没有任何 ReportItem。")
+    print(f".nessus 解析完成: 共 {total_items} 个 ReportItem，不重复发现项 {total_findings} 条。")
@@ -0,0 +1,429 @@
+# SqlAggregation.py
+# 统计类问题（“按风险等级统计和 SSL 相关的漏洞”）的 SQL 聚合引擎：
+# LLM 只负责把问题解析成 JSON 执行计划（过滤条件 + 聚合任务 + 时间范围），计数、求和、分组都在 MySQL 中完成，
+# 得到的小结果表再交给 LLM 组织语言，不再把几十条原始文档塞进提示词让模型自己数。
+#
+# 执行计划沿用 UNUSED/已经写好的mysql解析语句.py 的格式，但不再拼接字符串：
+# 列名只能是漏洞表的列（白名单），操作符只能是 OPERATOR_MAP 中的几种，所有值都以 %s 参数传给 MySQL。
+# 只涉及计数和汇总表维度的查询读取入库时维护的汇总表（MySqlSource.FINDING_SUMMARY_TABLES），
+# 其余查询由 MySqlSource.aggregate_time_sharded 按扫描日期分片并发执行。
+from datetime import date, datetime, timedelta
+from decimal import Decimal
+
+import pandas as pd
+
+import MySqlCatalog
+import MySqlPool
+import MySqlSource
+
+OPERATOR_MAP = {
+    "$eq": "=", "$ne": "!=", "$gt": ">", "$gte": ">=", "$lt": "<", "$lte": "<=",
+    "$in": "IN", "$nin": "NOT IN", "$like": "LIKE"
+}
+
+# LLM 常用的字段别名 -> 漏洞表的列名
+FIELD_ALIASES = {
+    'risk_level': 'risk', 'severity': 'risk', 'ip': 'host', 'host_ip': 'host',
+    'plugin': 'plugin_id', 'plugin_name': 'name', 'cve_id': 'cve', 'date': 'scan_date',
+}
+
+# 可以过滤和聚合的列：漏洞表的列和逻辑上的扫描日期
+FILTERABLE_FIELDS = set(MySqlSource.VULNERABILITY_TABLE_TEMPLATE) | {'scan_date'}
+
+AGGREGATION_TYPES = ('count', 'sum', 'avg', 'min', 'max', 'count_distinct')
+
+# sum / avg 只能用于数值列，否则 MySQL 会把字符串静默转换为 0
+NUMERIC_FIELDS = {col for col in MySqlSource.VULNERABILITY_TABLE_TEMPLATE if col.startswith('cvss_')} | \
+    {'port', 'plugin_id'}
+
+# 过滤条件的最大嵌套层数和 $in 列表的最大长度
+MAX_FILTER_DEPTH = 8
+MAX_IN_VALUES = 500
+
+# 交给 LLM 组织语言的结果最多保留的分组数
+MAX_RESULT_ROWS = 200
+
+# 趋势接口可以按这些维度拆分
+TREND_DIMENSIONS = ('risk', 'host', 'plugin_id', 'cve')
+
+
+class AggregationPlanError(ValueError):
+    """执行计划不合法（未知的列、操作符或聚合类型等）。调用方应退回到向量检索的问答流程。"""
+
+
+def _field(name) -> str:
+    if not isinstance(name, str) or not name.strip():
+        raise AggregationPlanError(f"无效的字段名: {name!r}")
+    name = name.strip().strip('`').lower()
+    name = FIELD_ALIASES.get(name, name)
+    if name not in FILTERABLE_FIELDS:
+        raise AggregationPlanError(f"不支持的字段: {name}")
+    return name
+
+
+def build_where_clause(condition, depth: int = 0, allow_scan_date: bool = True):
+    """
+    把 JSON 过滤条件转换为 (SQL 片段, 参数列表)。
+    支持 $and / $or / $not 嵌套，以及 {"field", "operator", "value"} 形式的叶子条件。
+
+    - cve 列是逗号拼接的列表，$eq / $ne / $in / $nin 按列表元素匹配（FIND_IN_SET），而不是整列相等。
+    - timestamp 列的格式是 YYYY_MM_DD，值中的 YYYY-MM-DD 会被转换后再比较。
+    - $contains 表示子串匹配，值中的 % 和 _ 会被转义；$like 原样使用调用方给出的模式。
+    - scan_date 条件不会出现在 SQL 中，由 extract_scan_date_bounds 转换为分片的时间范围，
+      因此只能出现在最外层（或最外层 $and 的直接子条件）中。
+    """
+    if depth > MAX_FILTER_DEPTH:
+        raise AggregationPlanError("过滤条件嵌套过深。")
+    if not condition:
+        return "", []
+    if not isinstance(condition, dict):
+        raise AggregationPlanError("条件必须是一个字典。")
+
+    for logic, joiner in (("$and", " AND "), ("$or", " OR ")):
+        if logic in condition:
+            if not isinstance(condition[logic], list) or not condition[logic]:
+                raise AggregationPlanError(f"{logic} 的值必须是非空列表。")
+            # 只有最外层 $and 的直接子条件中的 scan_date 条件可以转换为时间范围
+            child_allow = allow_scan_date and logic == "$and" and depth == 0
+            parts = [build_where_clause(cond, depth + 1, child_allow) for cond in condition[logic]]
+            parts = [(sql, params) for sql, params in parts if sql]
+            if not parts:
+                return "", []
+            return f"({joiner.join(sql for sql, _ in parts)})", [p for _, params in parts for p in params]
+    if "$not" in condition:
+        sql, params = build_where_clause(condition["$not"], depth + 1, allow_scan_date=False)
+        return (f"NOT ({sql})", params) if sql else ("", [])
+
+    field = _field(condition.get("field"))
+    operator = condition.get("operator")
+    value = condition.get("value")
+    if field == 'scan_date':
+        if not allow_scan_date:
+            raise AggregationPlanError("scan_date 条件只能出现在最外层的 $and 中。")
+        return "", []
+    if operator == "$isNull":
+        return f"`{field}` IS NULL", []
+    if operator == "$isNotNull":
+        return f"`{field}` IS NOT NULL", []
+    if operator == "$contains":
+        escaped = str(value).replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+        return f"`{field}` LIKE %s", [f"%{escaped}%"]
+    if operator not in OPERATOR_MAP:
+        raise AggregationPlanError(f"不支持的操作符: {operator}")
+
+    if operator in ("$in", "$nin"):
+        values = value if isinstance(value, list) else [value]
+        if not values or len(values) > MAX_IN_VALUES:
+            raise AggregationPlanError(f"{operator} 的值必须是 1 到 {MAX_IN_VALUES} 个元素的列表。")
+        if field == 'cve':
+            sql = " OR ".join(["FIND_IN_SET(%s, REPLACE(`cve`, ' ', ''))"] * len(values))
+            return (f"({sql})" if operator == "$in" else f"NOT ({sql})"), [str(v).strip() for v in values]
+        if field == 'timestamp':
+            values = [_timestamp_value(v) for v in values]
+        return f"`{field}` {OPERATOR_MAP[operator]} ({', '.join(['%s'] * len(values))})", list(values)
+
+    if field == 'timestamp':
+        value = _timestamp_value(value)
+    if isinstance(value, (list, dict)) or value is None:
+        raise AggregationPlanError(f"操作符 {operator} 需要一个标量值（字段 {field}）。")
+    if field == 'cve' and operator in ("$eq", "$ne"):
+        sql = "FIND_IN_SET(%s, REPLACE(`cve`, ' ', ''))"
+        return (sql if operator == "$eq" else f"NOT {sql}"), [str(value).strip()]
+    return f"`{field}` {OPERATOR_MAP[operator]} %s", [value]
+
+
+def extract_scan_date_bounds(condition):
+    """收集过滤条件最外层（或最外层 $and 中）对 scan_date 的比较，返回 (起, 止)，没有对应的比较时为 None。"""
+    leaves = condition.get("$and", [condition]) if isinstance(condition, dict) else []
+    start = end = None
+    for leaf in leaves:
+        if not isinstance(leaf, dict) or "field" not in leaf or _field(leaf["field"]) != 'scan_date':
+            continue
+        day = _parse_date(leaf.get("value"))
+        operator = leaf.get("operator")
+        if operator not in ("$eq", "$gt", "$gte", "$lt", "$lte"):
+            raise AggregationPlanError(f"scan_date 不支持操作符 {operator}。")
+        if operator in ("$eq", "$gt", "$gte"):
+            low = day + timedelta(days=1) if operator == "$gt" else day
+            start = max(start, low) if start else low
+        if operator in ("$eq", "$lt", "$lte"):
+            high = day - timedelta(days=1) if operator == "$lt" else day
+            end = min(end, high) if end else high
+    return start, end
+
+
+def _timestamp_value(value):
+    """timestamp 列保存的是 YYYY_MM_DD，把 LLM 常给出的 YYYY-MM-DD（可能带时分秒）转换为同样的格式。"""
+    if isinstance(value, str) and len(value) >= 10 and value[4] in '-_' and value[7] in '-_':
+        return value[:10].replace('-', '_')
+    return value
+
+
+def _parse_date(value) -> date:
+    try:
+        return datetime.strptime(str(value)[:10].replace('_', '-'), "%Y-%m-%d").date()
+    except ValueError:
+        raise AggregationPlanError(f"日期格式应为 YYYY-MM-DD: {value!r}")
+
+
+def parse_aggregation_tasks(tasks, outputs_map=None):
+    """
+    把聚合任务列表转换为 (aggregations, group_by)，供 MySqlSource.aggregate_time_sharded 使用。
+    每个任务形如 {"type": "count", "field": "host", "group_by": "risk", "alias": "..."}，
+    field 也可以写作 select_column_name（旧格式），group_by 可以是逗号分隔的字符串或列表。
+    """
+    if not tasks:
+        tasks = [{"type": "count"}]
+    if not isinstance(tasks, list):
+        tasks = [tasks]
+    outputs = list((outputs_map or {}).keys())
+
+    aggregations = {}
+    group_by = []
+    for task in tasks:
+        if not isinstance(task, dict):
+            raise AggregationPlanError("聚合任务必须是字典。")
+        agg_type = str(task.get("type") or "count").lower()
+        if agg_type in ("distinct_count", "count_unique", "nunique"):
+            agg_type = 'count_distinct'
+        if agg_type not in AGGREGATION_TYPES:
+            raise AggregationPlanError(f"不支持的聚合类型: {agg_type}")
+        column = task.get("field") or task.get("select_column_name") or "*"
+        column = "*" if column == "*" else _field(column)
+        if column == "*" and agg_type != 'count':
+            raise AggregationPlanError(f"聚合类型 {agg_type} 需要指定字段。")
+        if agg_type in ('sum', 'avg') and column not in NUMERIC_FIELDS:
+            raise AggregationPlanError(f"聚合类型 {agg_type} 只能用于数值字段 {sorted(NUMERIC_FIELDS)}，不能用于 {column}。")
+
+        alias = task.get("alias")
+        if not alias and len(tasks) == 1 and len(outputs) == 1:
+            alias = outputs[0]
+        if not alias:
+            alias = "count_all" if column == "*" else f"{agg_type}_{column}"
+        aggregations[str(alias)] = (agg_type, column)
+
+        task_group = task.get("group_by") or []
+        if isinstance(task_group, str):
+            task_group = task_group.split(',')
+        for col in task_group:
+            col = _field(col)
+            if col not in group_by:
+                group_by.append(col)
+    return aggregations, group_by
+
+
+def resolve_time_range(connection, db_name: str, time_range=None):
+    """
+    把执行计划中的 time_range 转换为 (起, 止) 两个日期。
+    支持 last_n_days / date_range / specific_month；为空时使用租户数据覆盖的全部日期。
+    """
+    today = date.today()
+    if time_range:
+        range_type = time_range.get("type")
+        if range_type == "last_n_days":
+            days = time_range.get("days")
+            if not isinstance(days, int) or days <= 0:
+                raise AggregationPlanError("last_n_days 类型需要一个正整数 'days'。")
+            return today - timedelta(days=days - 1), today
+        if range_type == "date_range":
+            start, end = _parse_date(time_range.get("start_date")), _parse_date(time_range.get("end_date"))
+            if start > end:
+                raise AggregationPlanError("start_date 不能晚于 end_date。")
+            return start, end
+        if range_type == "specific_month":
+            year, month = time_range.get("year"), time_range.get("month")
+            if not isinstance(year, int) or not isinstance(month, int) or not 1 <= month <= 12:
+                raise AggregationPlanError("specific_month 类型需要有效的整数 'year' 和 'month' (1-12)。")
+            start = date(year, month, 1)
+            return start, date.fromordinal(date(year + month // 12, month % 12 + 1, 1).toordinal() - 1)
+        raise AggregationPlanError(f"不支持的时间范围类型: '{range_type}'")
+    return tenant_date_range(connection, db_name)
+
+
+def tenant_date_range(connection, db_name: str):
+    """租户数据覆盖的扫描日期范围：每日表名中的日期和 findings 表中的最早、最晚 scan_date；没有数据时为 (今天, 今天)。"""
+    tables = MySqlCatalog.get_catalog().tables(connection, db_name)
+    days = [_parse_date(t) for t in tables if MySqlSource.DAILY_TABLE_PATTERN.match(t)]
+    if MySqlSource.FINDINGS_TABLE in tables:
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"SELECT MIN(`scan_date`) AS first_day, MAX(`scan_date`) AS last_day "
+                f"FROM `{db_name}`.`{MySqlSource.FINDINGS_TABLE}`"
+            )
+            row = cursor.fetchone()
+        days += [day for day in (row['first_day'], row['last_day']) if day]
+    if not days:
+        return date.today(), date.today()
+    return min(days), max(days)
+
+
+def _filter_leaves(condition) -> list:
+    """过滤条件中全部叶子条件的 (字段, 操作符)。"""
+    if not isinstance(condition, dict) or not condition:
+        return []
+    for logic in ("$and", "$or"):
+        if logic in condition:
+            return [leaf for cond in condition[logic] for leaf in _filter_leaves(cond)]
+    if "$not" in condition:
+        return _filter_leaves(condition["$not"])
+    return [(_field(condition.get("field")), condition.get("operator"))]
+
+
+def _cve_summary_matches(aggregations: dict, group_by: list, filters) -> bool:
+    """
+    CVE 汇总的每行是一个 (发现项, CVE) 对，而原始行上对 cve 的过滤按整个发现项判断。两者结果一致的情形：
+    - 没有 cve 过滤时：按 cve 分组（原始行也按单个 CVE 分组），或者只计数不同的 CVE；
+    - 唯一的 cve 过滤是最外层（或最外层 $and 中）的 $eq 时：不按 cve 分组且只计数发现项。
+    """
+    funcs = {func for func, _ in aggregations.values()}
+    cve_operators = [operator for field, operator in _filter_leaves(filters) if field == 'cve']
+    if not cve_operators:
+        return 'cve' in group_by or funcs == {'count_distinct'}
+    top = filters["$and"] if "$and" in filters else [filters]
+    direct = [leaf for leaf in top if isinstance(leaf, dict) and "field" in leaf and _field(leaf["field"]) == 'cve']
+    return cve_operators == ["$eq"] and len(direct) == 1 and 'cve' not in group_by and funcs == {'count'}
+
+
+def choose_summary_table(aggregations: dict, group_by: list, filters) -> str:
+    """
+    查询能由某张汇总表回答、且结果与聚合原始行一致时返回其表名，否则返回 None：
+    聚合只能是计数或对维度列的 count_distinct，分组和过滤只能用到该表的维度列和 scan_date；
+    CVE 汇总还需满足 _cve_summary_matches。
+    """
+    leaves = _filter_leaves(filters)
+    if any(operator in ("$isNull", "$isNotNull") for _, operator in leaves):
+        return None
+    for summary_table, dims in MySqlSource.FINDING_SUMMARY_TABLES.items():
+        allowed = set(dims) | {'scan_date'}
+        if not all(col in allowed for col in group_by) or not all(field in allowed for field, _ in leaves):
+            continue
+        if not all((func, col) == ('count', '*') or (func == 'count_distinct' and col in dims)
+                   for func, col in aggregations.values()):
+            continue
+        if dims == ('cve',) and not _cve_summary_matches(aggregations, group_by, filters or {}):
+            continue
+        return summary_table
+    return None
+
+
+def aggregate(db_name: str, start, end, aggregations: dict, group_by: list, filters=None):
+    """
+    计算 [start, end] 内的聚合，返回 (DataFrame, 'summary' 或 'raw')。
+    范围内每个有数据的日期都已汇总完整、且查询能由汇总表回答时读取汇总表，否则按分片聚合原始行。
+    增量入库的租户当天只保存新增或变化的发现项，按天统计会少计，直接拒绝。
+    """
+    filters = filters or {}
+    where_sql, params = build_where_clause(filters)
+    summary_table = choose_summary_table(aggregations, group_by, filters)
+    with MySqlPool.connection(db_name) as connection:
+        if MySqlSource.uses_delta_ingest(connection, db_name):
+            raise AggregationPlanError(f"租户 '{db_name}' 使用增量入库，未变化的发现项不在当天的表中，无法按天统计。")
+        if summary_table and MySqlSource.summary_days_complete(connection, db_name, start, end):
+            return MySqlSource.aggregate_summaries(connection, db_name, summary_table, start, end, aggregations,
+                                                   group_by, where_sql, params), 'summary'
+    return MySqlSource.aggregate_time_sharded(db_name, start, end, aggregations, group_by,
+                                              where_sql=where_sql, params=params), 'raw'
+
+
+def _plan_step(plan: dict) -> dict:
+    """取出执行计划中的聚合步骤；也接受直接给出 inputs 的简化形式。"""
+    if not isinstance(plan, dict):
+        raise AggregationPlanError("执行计划必须是 JSON 对象。")
+    steps = plan.get("execution_plan")
+    if steps is None:
+        return plan
+    if not isinstance(steps, list) or not steps or not isinstance(steps[0], dict):
+        raise AggregationPlanError("未找到有效的 'execution_plan'。")
+    return steps[0]
+
+
+def run_aggregation_plan(db_name: str, plan: dict, max_rows: int = MAX_RESULT_ROWS) -> dict:
+    """
+    校验并执行一个聚合执行计划，返回
+    {'columns': [...], 'rows': [...], 'total_groups': n, 'truncated': bool, 'start_date': ..., 'end_date': ...}。
+    有分组时按第一个聚合结果从大到小排序，最多保留 max_rows 个分组。计划不合法时抛出 AggregationPlanError。
+    """
+    step = _plan_step(plan)
+    inputs = step.get("inputs", step)
+    filters = inputs.get("filter_conditions") or {}
+    aggregations, group_by = parse_aggregation_tasks(
+        inputs.get("aggregation_tasks") or inputs.get("aggregation_operation"), step.get("outputs")
+    )
+    build_where_clause(filters)  # 先校验过滤条件，再访问数据库
+
+    with MySqlPool.connection(db_name) as connection:
+        start, end = resolve_time_range(connection, db_name, inputs.get("time_range"))
+    filter_start, filter_end = extract_scan_date_bounds(filters)
+    start, end = max(start, filter_start or start), min(end, filter_end or end)
+    if start > end:
+        result, source = MySqlSource.merge_partial_aggregates(pd.DataFrame(), aggregations, group_by), 'raw'
+    else:
+        result, source = aggregate(db_name, start, end, aggregations, group_by, filters)
+
+    total_groups = len(result)
+    if group_by and total_groups:
+        result = result.sort_values(list(aggregations)[0], ascending=False, kind='stable', na_position='last')
+    result = result.head(max_rows)
+    return {
+        'columns': list(result.columns),
+        'rows': [{col: _plain(value) for col, value in row.items()} for row in result.to_dict(orient='records')],
+        'total_groups': total_groups,
+        'truncated': total_groups > len(result),
+        'start_date': start.isoformat(),
+        'end_date': end.isoformat(),
+        'source': source,
+    }
+
+
+def findings_trend(db_name: str, start_date=None, end_date=None, days: int = 30, dimension: str = None,
+                   top: int = 10, filters=None) -> dict:
+    """
+    每天的发现项数量，可按 TREND_DIMENSIONS 之一拆分（只保留总数最多的 top 个值）。
+    未给出日期时统计截至今天的最近 days 天。返回 {'start_date', 'end_date', 'dimension', 'source', 'series': [...]}。
+    """
+    if dimension is not None and dimension not in TREND_DIMENSIONS:
+        raise AggregationPlanError(f"不支持的趋势维度: {dimension}")
+    end = _parse_date(end_date) if end_date else date.today()
+    start = _parse_date(start_date) if start_date else end - timedelta(days=max(days, 1) - 1)
+    if start > end:
+        raise AggregationPlanError("start_date 不能晚于 end_date。")
+
+    group_by = ['scan_date'] + ([dimension] if dimension else [])
+    result, source = aggregate(db_name, start, end, {'findings': ('count', '*')}, group_by, filters)
+    if dimension and top and not result.empty:
+        totals = result.groupby(dimension, dropna=False)['findings'].sum().nlargest(top)
+        result = result[result[dimension].isin(totals.index)]
+    return {
+        'start_date': start.isoformat(),
+        'end_date': end.isoformat(),
+        'dimension': dimension,
+        'source': source,
+        'series': [{col: _plain(value) for col, value in row.items()} for row in result.to_dict(orient='records')],
+    }
+
+
+def _plain(value):
+    """把 Decimal、numpy 数值、日期和 NaN 转换为可以直接序列化为 JSON 的值。"""
+    if value is None or (isinstance(value, float) and value != value):
+        return None
+    if isinstance(value, Decimal):
+        return float(value)
+    if isinstance(value, (date, datetime)):
+        return value.isoformat()
+    if hasattr(value, 'item'):
+        return _plain(value.item())
+    return value
+
+
+def format_result_for_llm(result: dict) -> str:
+    """把聚合结果转换为交给 LLM 组织语言的 Markdown 表格和说明。"""
+    header = f"统计范围: 扫描日期 {result['start_date']} 至 {result['end_date']}"
+    if result['truncated']:
+        header += f"；共 {result['total_groups']} 个分组，以下仅列出前 {len(result['rows'])} 个"
+    if not result['rows']:
+        return f"{header}\n\n（没有符合条件的数据。）"
+    lines = ["| " + " | ".join(result['columns']) + " |",
+             "| " + " | ".join("---" for _ in result['columns']) + " |"]
+    for row in result['rows']:
+        lines.append("| " + " | ".join("N/A" if row[col] is None else str(row[col]) for col in result['columns']) + " |")
+    return header + "\n\n" + "\n".join(lines)
@@ -282,8 +282,8 @@ def index_dataframe_to_chromadb(
 
     print(f"数据准备完成。开始将 {len(chroma_ids)} 条记录批量添加到 ChromaDB 集合 '{collection_name}'...")
     try:
-        # 这是函数的核心写入操作
-        collection.add(
+        # 这是函数的核心写入操作；使用 upsert，同步中断后重放同一批次不会产生重复或报错
+        collection.upsert(
             documents=chroma_documents,
             metadatas=chroma_metadatas,
             ids=chroma_ids
@@ -299,6 +299,8 @@ def index_dataframe_to_chromadb(
 
 import pandas as pd
 import pymysql
+import MySqlPool
+import MySqlSource
 from collections import defaultdict
 
 # -------------  文本json->uuid  -----------------
@@ -391,8 +393,6 @@ def get_full_documents_from_mysql(uuids_from_chroma: list, db_name: str = "rag")
     Returns:
         pd.DataFrame: 包含所有查询到的完整文档记录的Pandas DataFrame。
     """
-    # 会产生循环引用，所以放在代码里面
-    from MySqlSource import connect_to_mysql
     if not uuids_from_chroma:
         return pd.DataFrame()
 
@@ -412,35 +412,14 @@ def get_full_documents_from_mysql(uuids_from_chroma: list, db_name: str = "rag")
     if not ids_by_table:
         return pd.DataFrame()
 
-    # 2. 批量查询数据库
+    # 2. 批量查询数据库（从连接池借用连接，不再每次查询都重新建立连接）
+    # 已合并到 findings 分区表的日期由 MySqlSource.select_rows_by_ids 合并成一条语句查询
     all_records = []
-    conn = None
     try:
-
-        conn = connect_to_mysql(db_name=db_name)
-        if conn:
-            with conn.cursor() as cursor:
-                for table_name, ids in ids_by_table.items():
-                    id_placeholders = ', '.join(['%s'] * len(ids))
-
-                    # 使用反引号包裹表名是一个好习惯，可以防止与SQL关键字冲突，虽然在这里不是必须的。
-                    sql_query = f"SELECT * FROM `{table_name}` WHERE id IN ({id_placeholders});"
-
-                    try:
-                        cursor.execute(sql_query, tuple(ids))
-                        records = cursor.fetchall()
-                        all_records.extend(records)
-                    except pymysql.MySQLError as table_err:
-                        print(f"查询表 '{table_name}' 时出错: {table_err} (可能是表不存在)")
-                        continue
-        else:
-            print("无法建立 MySQL 连接，跳过数据获取。")
-
-    except pymysql.MySQLError as err:
+        with MySqlPool.connection(db_name) as conn:
+            all_records = MySqlSource.select_rows_by_ids(conn, db_name, ids_by_table)
+    except (pymysql.MySQLError, RuntimeError, TimeoutError) as err:
         print(f"数据库操作时发生错误: {err}")
-    finally:
-        if conn:
-            conn.close()
 
     # 3. 将所有结果合并为单个DataFrame
     return pd.DataFrame(all_records) if all_records else pd.DataFrame()
@@ -5,18 +5,28 @@ import os
 sys.path.append(os.path.dirname(__file__))
 
 from fastapi import FastAPI, UploadFile, File, Form, HTTPException
+from fastapi.concurrency import run_in_threadpool
 from fastapi.responses import JSONResponse, StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
 from typing import Optional, List
 import pandas as pd
-import io
+import pymysql
+import tempfile
+import time
+import xxhash
 from docx import Document
 from io import BytesIO
 
 # 导入 TEST.py 中使用的模块
+import BulkIngest
+import ChromaSync
 import CsvDataOp
+import IngestJobs
+import IngestPipeline
+import MySqlPool
 import MySqlSource
+import SqlAggregation
 import VectorDatabase
 import utils
 import ALiYunConnection
@@ -41,10 +51,18 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# 全局数据库连接和ChromaDB客户端/集合
-# 在实际生产环境中，这些连接应该通过依赖注入或更健壮的方式管理
-mysql_connect = None
+# 全局 MySQL 连接池和ChromaDB客户端/集合
+# pymysql 连接不是线程安全的，每个请求都从连接池借出自己的连接，用完归还
+mysql_pool = None
 chroma_client = None
+# 上传文件的后台入库任务队列
+ingest_jobs = None
+ingest_config = {}
+# 后台 MySQL -> ChromaDB 同步（[CHROMA_SYNC] enabled = true 时启动）
+chroma_sync_worker = None
+
+# 上传文件落盘时每次读取的块大小
+UPLOAD_CHUNK_SIZE = 1024 * 1024
 
 
 @app.on_event("startup")
@@ -52,24 +70,49 @@ async def startup_event():
     """
     应用启动时连接数据库和ChromaDB
     """
-    global mysql_connect, chroma_client
+    global mysql_pool, chroma_client, ingest_jobs, ingest_config, chroma_sync_worker
+    ingest_config = IngestJobs.load_ingest_config()
+    ingest_jobs = IngestJobs.IngestJobManager(
+        max_workers=ingest_config['max_workers'],
+        max_jobs_per_tenant=ingest_config['max_jobs_per_tenant'],
+        max_finished_jobs=ingest_config['max_finished_jobs']
+    )
+    try:
+        mysql_pool = MySqlPool.get_pool()
+    except Exception as e:
+        print(f"MySQL 连接池创建失败: {e}")
     try:
-        mysql_connect = MySqlSource.connect_to_mysql()
         chroma_client = VectorDatabase.connect_to_chromadb()
         print("数据库和ChromaDB客户端初始化成功！")
     except Exception as e:
         print(f"数据库或ChromaDB连接失败: {e}")
         # 在生产环境中，这里可能需要更优雅的错误处理，例如退出应用或记录日志
 
+    sync_config = ChromaSync.load_sync_config()
+    if sync_config['enabled'] and mysql_pool is not None and chroma_client is not None:
+        chroma_sync_worker = ChromaSync.ChromaSyncWorker(
+            chroma_client,
+            poll_interval=sync_config['poll_interval'],
+            batch_size=sync_config['batch_size'],
+            max_rows_per_table=sync_config['max_rows_per_table'],
+            max_rows_per_second=sync_config['max_rows_per_second'],
+            tenants=sync_config['tenants'],
+            outbox_batch=sync_config['outbox_batch'],
+            reconcile_interval=sync_config['reconcile_interval']
+        )
+        chroma_sync_worker.start()
+
 @app.on_event("shutdown")
 async def shutdown_event():
     """
-    应用关闭时关闭数据库连接
+    应用关闭时关闭数据库连接池
     """
-    global mysql_connect
-    if mysql_connect:
-        mysql_connect.close()
-        print("MySQL连接已关闭。")
+    if chroma_sync_worker:
+        chroma_sync_worker.stop(timeout=30)
+    if ingest_jobs:
+        ingest_jobs.shutdown()
+    BulkIngest.shutdown_transform_pool()
+    MySqlPool.close_pool()
 
 # 定义请求体模型
 class LoginRequest(BaseModel):
@@ -160,7 +203,8 @@ async def login(request: LoginRequest):
             collection_name = request.username
 
             # 创建 MySQL 数据库 (如果不存在)
-            MySqlSource.create_database(mysql_connect, db_name)
+            with mysql_pool.connection() as connection:
+                MySqlSource.create_database(connection, db_name)
 
             # 创建 ChromaDB 集合 (如果不存在)
             chroma_client.get_or_create_collection(name=collection_name)
@@ -175,71 +219,282 @@ async def login(request: LoginRequest):
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"An error occurred: {e}")
 
+async def _spool_upload_to_disk(file: UploadFile, suffix: str):
+    """
+    分块把上传内容写入磁盘临时文件，返回 (文件路径, 内容哈希)。
+    内存中始终只有一个 UPLOAD_CHUNK_SIZE 大小的块，峰值内存与文件大小无关；
+    读取器（pd.read_csv / pyarrow / iterparse）随后直接从该路径流式读取。
+    内容哈希（xxh3_128）在写盘的同时逐块计算，不需要再读一遍文件。
+    """
+    spool_dir = ingest_config.get('spool_dir') or None
+    hasher = xxhash.xxh3_128()
+    with tempfile.NamedTemporaryFile(mode='wb', suffix=suffix, dir=spool_dir, delete=False) as tmp:
+        try:
+            while chunk := await file.read(UPLOAD_CHUNK_SIZE):
+                hasher.update(chunk)
+                tmp.write(chunk)
+        except Exception:
+            tmp.close()
+            os.remove(tmp.name)
+            raise
+    return tmp.name, hasher.hexdigest()
+
+
+def _remove_spooled_files(source):
+    for path in (source if isinstance(source, list) else [source]):
+        if os.path.exists(path):
+            os.remove(path)
+
+
+# 影响入库结果的上传选项，与内容哈希、目标表一起构成上传登记的键
+UPLOAD_KEY_OPTIONS = ('source_format', 'chunked', 'engine', 'delta')
+
+
+def _upload_options_key(options: dict) -> str:
+    return ",".join(f"{name}={options[name]}" for name in UPLOAD_KEY_OPTIONS if name in options)
+
+
+def _find_upload_record(username: str, content_hash: str, table_name: str, options_key: str):
+    # 在线程池中执行，不阻塞事件循环
+    if mysql_pool is None:
+        return None
+    with mysql_pool.connection() as connection:
+        return MySqlSource.get_upload_record(connection, username, content_hash, table_name, options_key)
+
+
+def _deduplicated_response(content_hash: str, job=None, record=None) -> JSONResponse:
+    """相同上传的响应：内存中找到的任务（仍在运行时为 202），或 MySQL 上传登记表中的记录（200）。"""
+    if job is not None and job.status != 'succeeded':
+        return JSONResponse(
+            status_code=202,
+            content={
+                "message": f"An identical upload is already being processed as job {job.job_id}.",
+                "deduplicated": True,
+                "job_id": job.job_id,
+                "status": job.status,
+                "status_url": f"/api/jobs/{job.job_id}",
+                "table": job.table_name,
+                "content_hash": content_hash
+            }
+        )
+    if job is not None:
+        record = {'filename': job.filename, 'job_id': job.job_id,
+                  'created_at': time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(job.finished_at)),
+                  'table_name': job.table_name, 'result': job.result}
+    return JSONResponse(
+        status_code=200,
+        content={
+            "message": f"Identical file '{record['filename']}' was already ingested into table "
+                       f"'{record['table_name']}' with the same options at {record['created_at']}; "
+                       f"returning the previous result. Set force=true to ingest it again.",
+            "deduplicated": True,
+            "job_id": record['job_id'],
+            "status": "succeeded",
+            "table": record['table_name'],
+            "content_hash": content_hash,
+            "result": record['result']
+        }
+    )
+
+
+async def _submit_ingest_job(username: str, filename: str, source, content_hash: str = None, force: bool = False,
+                             ingest_func=IngestPipeline.ingest_nessus_upload, **options) -> JSONResponse:
+    """
+    把上传文件交给后台任务队列，立即返回 202 和任务ID。
+    source 为临时文件路径（批量上传时为路径列表），任务结束后删除。
+    给出 content_hash 且 force=False 时，内容相同、入库选项（UPLOAD_KEY_OPTIONS）相同、
+    且写入同一张表（当天的 YYYY_MM_DD 表）的上传直接返回之前的任务，不再重复入库；
+    同一文件在另一天上传时写入当天的表，会重新入库。
+    后台同步开启时任务不再自己同步 ChromaDB，数据提交到 MySQL 后即结束，由 chroma_sync_worker 追平索引。
+    """
+    if ingest_jobs is None:
+        _remove_spooled_files(source)
+        raise HTTPException(status_code=503, detail="后端服务未完全启动，任务队列不可用。")
+
+    # Define names based on username and current date
+    db_name = username
+    collection_name = username
+    table_name = utils.get_today_date_formatted()
+    options_key = _upload_options_key(options)
+
+    args = (db_name, table_name, collection_name, source, None if chroma_sync_worker else chroma_client)
+    job_kwargs = dict(content_hash=content_hash, options_key=options_key, table_name=table_name,
+                      delete_source=True, **options)
+    record = None
+    if content_hash and not force:
+        record = await run_in_threadpool(_find_upload_record, username, content_hash, table_name, options_key)
+        if record is not None:
+            job, submitted = None, False
+        else:
+            # 查找仍在运行（或刚刚成功）的相同任务和提交新任务在同一把锁内完成
+            job, submitted = ingest_jobs.submit_unless_active(username, filename, ingest_func, *args, **job_kwargs)
+    else:
+        job, submitted = ingest_jobs.submit(username, filename, ingest_func, *args, **job_kwargs), True
+    if not submitted:
+        print(f"信息: 用户 '{username}' 上传的 '{filename}' 与之前的上传相同，跳过入库。")
+        _remove_spooled_files(source)
+        return _deduplicated_response(content_hash, job=job, record=record)
+
+    return JSONResponse(
+        status_code=202,
+        content={
+            "message": f"File '{filename}' accepted for processing.",
+            "job_id": job.job_id,
+            "status": job.status,
+            "status_url": f"/api/jobs/{job.job_id}",
+            "database": db_name,
+            "table": table_name,
+            "collection": collection_name,
+            "content_hash": content_hash
+        }
+    )
+
+
 @app.post("/api/upload_csv")
-async def upload_csv(username: str = Form(...), file: UploadFile = File(...)):
+async def upload_csv(username: str = Form(...), file: UploadFile = File(...),
+                     chunked: bool = Form(False), engine: str = Form('pandas'), delta: bool = Form(False),
+                     force: bool = Form(False)):
     """
-    Receives a user's CSV file, processes it, and stores it based on username and date.
+    Receives a user's CSV file and queues it for ingestion; returns 202 with a job id.
     - MySQL database name is the username.
     - MySQL table name is the current date (YYYY-MM-DD).
     - ChromaDB collection name is the username.
+    - chunked=True reads the CSV in bounded chunks and inserts it batch by batch,
+      so memory no longer grows with the size of the scan.
+    - engine='arrow' parses the CSV with an explicit Arrow-backed schema (non-chunked mode only).
+    - delta=True stores full rows (and vectors) only for findings that are new or changed since the
+      tenant's previous scans; unchanged findings are recorded as a sighting on the scan date.
+      A delta tenant's daily tables, time-filtered retrieval and statistics only see findings on the
+      day their content last changed, so statistics (/api/stats/trend, aggregation plans) are refused
+      for delta tenants. The first delta upload of a tenant drops its per-day summary tables; the
+      switch is one-way.
+    - A file whose content and options (chunked, engine, delta) are identical to an earlier upload
+      of the same user into the same day's table is not ingested again: the previous job's result
+      is returned (200) or, if it is still running, its job id. The same file uploaded on another
+      day is ingested into that day's table. force=True ingests it anyway.
+    The upload body is spooled to a temporary file in chunks and never held in memory as a whole.
+    Progress of the parse / insert / index stages is available at /api/jobs/{job_id}.
     """
     if not file.filename.endswith('.csv'):
         raise HTTPException(status_code=400, detail="Only CSV files are accepted.")
+    if engine not in ('pandas', 'arrow'):
+        raise HTTPException(status_code=400, detail="engine must be 'pandas' or 'arrow'.")
+    if engine == 'arrow' and CsvDataOp.pa_csv is None:
+        raise HTTPException(status_code=400, detail="engine='arrow' requires pyarrow, which is not installed.")
 
+    source = None
     try:
-        # Define names based on username and current date
-        db_name = username
-        collection_name = username
-        table_name = utils.get_today_date_formatted()
-
-        # Read and process the CSV file
-        contents = await file.read()
-        sio = io.StringIO(contents.decode('utf-8'))
-        pdfile = CsvDataOp.transform_nessus_data(sio)
-
-        if pdfile.empty:
-            raise HTTPException(status_code=400, detail="Processed CSV file is empty or invalid.")
-
-        # Ensure MySQL database and table exist
-        MySqlSource.create_database(mysql_connect, db_name)
-        MySqlSource.create_pd_table(mysql_connect, db_name, table_name, use_vulnerability_template=True)
-
-        # Add unique IDs for tracking
-        pdfile = utils.add_ids_and_uuid(mysql_connect, db_name, pdfile, table_name)
-
-        # Insert data into the newly created MySQL table
-        MySqlSource.insert_vulnerability_data(mysql_connect, db_name, table_name, pdfile)
-
-        # Sync data from MySQL to ChromaDB
-        # Note: Assumes sync_mysql_to_chromadb is modified to add 'creation_date' to metadata
-        MySqlSource.sync_mysql_to_chromadb(
-            connection=mysql_connect,
-            chroma_client=chroma_client,
-            db_name=db_name,
-            table_name=table_name,
-            collection_name=collection_name,
-            batch_size=1000
-        )
-
-        return JSONResponse(
-            content={
-                "message": f"File '{file.filename}' processed and stored successfully.",
-                "database": db_name,
-                "table": table_name,
-                "collection": collection_name
-            }
-        )
+        source, content_hash = await _spool_upload_to_disk(file, suffix='.csv')
+        return await _submit_ingest_job(username, file.filename, source, content_hash, force,
+                                        source_format='csv', chunked=chunked, engine=engine, delta=delta)
+    except HTTPException:
+        raise
     except Exception as e:
+        if source is not None:
+            _remove_spooled_files(source)
         # Log the full error for debugging
         print(f"Error in upload_csv: {e}")
         raise HTTPException(status_code=500, detail=f"File processing failed: {str(e)}")
 
+@app.post("/api/upload_nessus")
+async def upload_nessus(username: str = Form(...), file: UploadFile = File(...), delta: bool = Form(False),
+                        force: bool = Form(False)):
+    """
+    Receives a native .nessus (XML v2) export and queues it exactly like /api/upload_csv,
+    without the CSV export step. The XML is parsed as a stream, host by host.
+    """
+    if not file.filename.endswith('.nessus'):
+        raise HTTPException(status_code=400, detail="Only .nessus files are accepted.")
+
+    source = None
+    try:
+        source, content_hash = await _spool_upload_to_disk(file, suffix='.nessus')
+        return await _submit_ingest_job(username, file.filename, source, content_hash, force,
+                                        source_format='nessus', delta=delta)
+    except HTTPException:
+        raise
+    except Exception as e:
+        if source is not None:
+            _remove_spooled_files(source)
+        print(f"Error in upload_nessus: {e}")
+        raise HTTPException(status_code=500, detail=f"File processing failed: {str(e)}")
+
+@app.post("/api/upload_bundle")
+async def upload_bundle(username: str = Form(...), files: List[UploadFile] = File(...),
+                        delta: bool = Form(False), force: bool = Form(False)):
+    """
+    Receives several scan exports at once (.csv, .nessus, or .zip archives of them) and queues
+    them as a single job. Files are transformed in parallel worker processes and written in
+    upload order, so ids follow the upload order of the files.
+    Re-uploading the same set of files (same contents, same order, same delta option) on the same
+    day returns the previous result unless force=True.
+    """
+    for file in files:
+        if not file.filename.lower().endswith(('.csv', '.nessus', '.zip')):
+            raise HTTPException(status_code=400, detail="Only .csv, .nessus and .zip files are accepted.")
+
+    sources = []
+    bundle_hasher = xxhash.xxh3_128()
+    try:
+        for file in files:
+            source, content_hash = await _spool_upload_to_disk(
+                file, suffix=os.path.splitext(file.filename)[1].lower())
+            sources.append(source)
+            bundle_hasher.update(content_hash.encode('ascii'))
+        return await _submit_ingest_job(username, ', '.join(file.filename for file in files), sources,
+                                        bundle_hasher.hexdigest(), force,
+                                        ingest_func=BulkIngest.ingest_bundle,
+                                        max_processes=ingest_config.get('max_processes'), delta=delta)
+    except HTTPException:
+        raise
+    except Exception as e:
+        _remove_spooled_files(sources)
+        print(f"Error in upload_bundle: {e}")
+        raise HTTPException(status_code=500, detail=f"File processing failed: {str(e)}")
+
+@app.get("/api/jobs/{job_id}")
+async def get_job(job_id: str):
+    """
+    查询后台入库任务的状态和 parse / insert / index 各阶段的进度。
+    """
+    job = ingest_jobs.get(job_id) if ingest_jobs else None
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Job '{job_id}' not found.")
+    return JSONResponse(content=job.to_dict())
+
+@app.get("/api/sync/status")
+async def get_sync_status():
+    """
+    查询后台 ChromaDB 同步的延迟：总积压行数、各租户 / 各表的积压和上次同步时间。
+    """
+    if chroma_sync_worker is None:
+        return JSONResponse(content={"enabled": False})
+    return JSONResponse(content={"enabled": True, **chroma_sync_worker.lag()})
+
+@app.get("/api/stats/trend")
+def get_findings_trend(db_name: str, days: int = 30, start_date: Optional[str] = None,
+                       end_date: Optional[str] = None, dimension: Optional[str] = None, top: int = 10):
+    """
+    每天的发现项数量趋势，可按 risk / host / plugin_id / cve 拆分（只保留总数最多的 top 个值）。
+    汇总表覆盖整个时间范围时直接读取汇总表，否则聚合原始行；返回中的 source 标明数据来源。
+    """
+    if not mysql_pool:
+        raise HTTPException(status_code=503, detail="后端服务未完全启动或数据库连接失败。")
+    try:
+        trend = SqlAggregation.findings_trend(db_name, start_date, end_date, days=days, dimension=dimension, top=top)
+    except SqlAggregation.AggregationPlanError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        print(f"Error in get_findings_trend: {e}")
+        raise HTTPException(status_code=500, detail=f"统计趋势失败: {e}")
+    return JSONResponse(content=trend)
+
 @app.post("/api/process_data")
 async def process_data(request: ProcessDataRequest):
     """
     接收前端输入的文本参数和会话消息，执行LLM查询并返回结果。
     """
-    if not mysql_connect or not chroma_client:
+    if not mysql_pool or not chroma_client:
         raise HTTPException(status_code=503, detail="后端服务未完全启动或数据库连接失败。")
     # 获取指定的ChromaDB集合
     try:
@@ -291,30 +546,51 @@ async def process_data(request: ProcessDataRequest):
         where_clause = parsed_json_output.get("chroma_where_filter", {})
         query_text = parsed_json_output.get("query_text", question) # 如果LLM没有提供query_text，则使用原始问题
 
-        uuids = VectorDatabase.query_vulnerabilities_for_uuids(query_text, request.n_results, where_clause, chroma_collection)
-
-        docs = []
-        if uuids:
-            # 使用请求中提供的db_name
-            docs = VectorDatabase.get_full_documents_from_mysql(uuids, db_name=request.db_name)
-            docs = utils.format_mysql_dataframe_for_llm(docs)
-        else:
-            docs = "未找到相关文档。"
+        # 统计类问题直接在 MySQL 中聚合，LLM 只负责组织语言；执行计划不合法时退回向量检索
+        statistics = None
+        aggregation_plan = parsed_json_output.get("aggregation_plan")
+        if aggregation_plan:
+            try:
+                statistics = SqlAggregation.run_aggregation_plan(request.db_name, aggregation_plan)
+            except SqlAggregation.AggregationPlanError as e:
+                print(f"警告: 聚合执行计划无效，改用向量检索: {e}")
+            except (ValueError, TimeoutError, RuntimeError, pymysql.MySQLError) as e:
+                # 连接池超时、分片查询失败等：统计不可用时同样退回向量检索，而不是让整个问题失败
+                print(f"警告: 聚合执行失败，改用向量检索: {e}")
 
         today_time = utils.get_today_date_formatted()
         file_path_answer_prompt = "prompt_for_answer.txt"
         with open(file_path_answer_prompt, 'r', encoding='utf-8') as file:
             prompt2 = file.read()
 
+        if statistics is not None:
+            docs = SqlAggregation.format_result_for_llm(statistics)
+            user_content = (f"{question}：今天的日期是：{today_time}以下是在数据库中统计得到的结果，"
+                            f"数字已经是最终结果，请直接引用，不要重新计算：\n\n{docs}\n要输出成markdown表格的形式")
+        else:
+            uuids = VectorDatabase.query_vulnerabilities_for_uuids(query_text, request.n_results, where_clause, chroma_collection)
+
+            docs = []
+            if uuids:
+                # 使用请求中提供的db_name
+                docs = VectorDatabase.get_full_documents_from_mysql(uuids, db_name=request.db_name)
+                docs = utils.format_mysql_dataframe_for_llm(docs)
+            else:
+                docs = "未找到相关文档。"
+            user_content = f"{question}：今天的日期是：{today_time}以下是相关文本：\n\n{docs},要输出成markdown表格的形式，同时每一回答来源都要给出原始的uuid"
+
         new_message = [
             {"role": "system", "content": f"{prompt2}"},
-            {"role": "user", "content": f"{question}：今天的日期是：{today_time}以下是相关文本：\n\n{docs},要输出成markdown表格的形式，同时每一回答来源都要给出原始的uuid" }
+            {"role": "user", "content": user_content}
         ]
 
         response2 = ALiYunConnection.qwen_query(new_message, stream=False, enable_thinking=False)
         final_answer = response2.choices[0].message.content
 
-        return JSONResponse(content={"answer": final_answer})
+        content = {"answer": final_answer}
+        if statistics is not None:
+            content["statistics"] = statistics
+        return JSONResponse(content=content)
 
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"处理请求失败: {e}")
@@ -0,0 +1,87 @@
+import os
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+import xxhash
+
+# Add the current directory to the Python path to allow importing CsvDataOp
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+import CsvDataOp
+
+
+# --- 旧实现（逐组 lambda 合并 CVE、逐行创建哈希对象），仅用于对比结果和耗时 ---
+def legacy_merge_duplicate_findings(df: pd.DataFrame) -> pd.DataFrame:
+    agg_functions = {
+        col: 'first' for col in df.columns if col not in CsvDataOp.NESSUS_GROUPING_KEY
+    }
+    agg_functions['CVE'] = lambda cves: ','.join(
+        sorted(c for c in cves.unique() if pd.notna(c) and c != '')
+    )
+    return df.groupby(CsvDataOp.NESSUS_GROUPING_KEY).agg(agg_functions).reset_index()
+
+
+def legacy_fingerprints(df: pd.DataFrame) -> list:
+    raw_strings_for_fingerprint = (df['Plugin ID'].astype(str) + '-' +
+                                   df['Host'].astype(str) + '-' +
+                                   df['Port'].astype(str))
+    return [xxhash.xxh64(s.encode('utf-8')).hexdigest() for s in raw_strings_for_fingerprint]
+
+
+def make_synthetic_scan(n_rows: int, seed: int = 0) -> pd.DataFrame:
+    """生成与 Nessus CSV 结构相同的模拟数据：约三成行没有 CVE，同一发现项会因多个 CVE 重复出现。"""
+    rng = np.random.default_rng(seed)
+    cve_numbers = rng.integers(1, 5000, n_rows)
+    return pd.DataFrame({
+        'Plugin ID': rng.integers(10000, 10500, n_rows),
+        'CVE': np.where(rng.random(n_rows) < 0.3, None,
+                        pd.Series(cve_numbers).map(lambda i: f'CVE-2020-{i:04d}')),
+        'Risk': rng.choice(['Low', 'Medium', 'High', 'Critical'], n_rows),
+        'Host': pd.Series(rng.integers(1, 255, n_rows)).map(lambda i: f'10.0.{i % 16}.{i}'),
+        'Protocol': 'tcp',
+        'Port': rng.choice([22, 80, 443, 3306, 8834], n_rows),
+        'Name': 'Synthetic finding',
+        'Plugin Output': 'output',
+    })
+
+
+def timed(func, *args):
+    start = time.perf_counter()
+    result = func(*args)
+    return result, time.perf_counter() - start
+
+
+def run_benchmark(df: pd.DataFrame):
+    print(f"原始行数: {len(df)}")
+
+    legacy_merged, legacy_merge_s = timed(legacy_merge_duplicate_findings, df)
+    merged, merge_s = timed(CsvDataOp._merge_duplicate_findings, df)
+    assert legacy_merged.to_csv(index=False) == merged.to_csv(index=False), "CVE 合并结果与旧实现不一致！"
+    print(f"CVE 合并:  旧 {legacy_merge_s:.3f}s -> 新 {merge_s:.3f}s  (x{legacy_merge_s / merge_s:.1f})，"
+          f"合并后 {len(merged)} 行，结果一致")
+
+    legacy_fps, legacy_fp_s = timed(legacy_fingerprints, merged)
+    fps, fp_s = timed(CsvDataOp.generate_fingerprints, merged['Plugin ID'], merged['Host'], merged['Port'])
+    assert legacy_fps == fps, "指纹结果与旧实现不一致！"
+    print(f"指纹生成:  旧 {legacy_fp_s:.3f}s -> 新 {fp_s:.3f}s  (x{legacy_fp_s / fp_s:.1f})，结果一致")
+
+
+def compare_read_engines(csv_path: str):
+    """对比 pandas 与 arrow 两种读取引擎的解析耗时和 DataFrame 内存占用。"""
+    for engine in ('pandas', 'arrow'):
+        df, read_s = timed(CsvDataOp._read_nessus_csv, csv_path, engine)
+        memory_mb = df.memory_usage(deep=True).sum() / 1024 / 1024
+        print(f"读取引擎 {engine:<6}: 解析 {read_s:.3f}s，内存 {memory_mb:.2f} MB")
+
+
+if __name__ == "__main__":
+    # 用法: python benchmark_transform.py [nessus导出.csv | 行数]
+    if len(sys.argv) > 1 and os.path.exists(sys.argv[1]):
+        compare_read_engines(sys.argv[1])
+        scan = pd.read_csv(sys.argv[1])
+        scan = scan.dropna(subset=['Risk'])
+    else:
+        scan = make_synthetic_scan(int(sys.argv[1]) if len(sys.argv) > 1 else 500_000)
+    run_benchmark(scan)
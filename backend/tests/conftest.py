@@ -0,0 +1,5 @@
+# 测试直接导入 backend 目录下的模块（import MySqlSource 等），与各脚本的运行方式一致
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
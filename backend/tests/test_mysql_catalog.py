@@ -0,0 +1,55 @@
+# MySqlCatalog：表结构目录缓存（用计数的假连接代替 MySQL）
+import MySqlCatalog
+
+
+class FakeCursor:
+    def __init__(self, connection):
+        self.connection = connection
+        self.sql = ''
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def execute(self, sql, params=None):
+        self.connection.queries += 1
+        self.sql = sql
+
+    def fetchall(self):
+        if 'information_schema.COLUMNS' in self.sql:
+            return [{'table_name': table, 'column_name': 'id'} for table in self.connection.tables]
+        return []
+
+
+class FakeConnection:
+    def __init__(self, tables=()):
+        self.tables = list(tables)
+        self.queries = 0
+
+    def cursor(self):
+        return FakeCursor(self)
+
+
+def test_missing_table_reloads_the_schema_after_the_miss_interval():
+    catalog = MySqlCatalog.SchemaCatalog(miss_refresh_interval=0)
+    connection = FakeConnection(['2024_05_01'])
+    for _ in range(3):
+        assert not catalog.table_exists(connection, 'tenant', 'finding_history')
+    # 首次加载 + 每次未命中各重新加载一次，每次加载两条查询（COLUMNS 和 STATISTICS）
+    assert connection.queries == 2 * 4
+
+
+def test_missing_marker_table_is_cached_until_invalidate():
+    catalog = MySqlCatalog.SchemaCatalog(miss_refresh_interval=0)
+    connection = FakeConnection(['2024_05_01'])
+    for _ in range(3):
+        assert not catalog.table_exists(connection, 'tenant', 'finding_history', cache_miss=True)
+    assert connection.queries == 2
+
+    connection.tables.append('finding_history')
+    assert not catalog.table_exists(connection, 'tenant', 'finding_history', cache_miss=True)
+    catalog.invalidate('tenant')
+    assert catalog.table_exists(connection, 'tenant', 'finding_history', cache_miss=True)
+    assert connection.queries == 4
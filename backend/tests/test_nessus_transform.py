@@ -0,0 +1,137 @@
+# Nessus 导出 -> 可入库 DataFrame 的转换（CsvDataOp / NessusXmlOp）
+import csv
+from xml.sax.saxutils import escape, quoteattr
+
+import pandas as pd
+import pytest
+
+import CsvDataOp
+import NessusXmlOp
+
+CSV_COLUMNS = ['Plugin ID', 'CVE', 'CVSS v2.0 Base Score', 'Risk', 'Host', 'Protocol', 'Port', 'Name',
+               'Synopsis', 'Description', 'Solution', 'See Also', 'Plugin Output', 'STIG Severity',
+               'CVSS v3.0 Base Score', 'CVSS v2.0 Temporal Score', 'CVSS v3.0 Temporal Score', 'Risk Factor',
+               'BID', 'XREF', 'MSKB', 'Plugin Publication Date', 'Plugin Modification Date']
+
+RISK_TO_SEVERITY = {risk: severity for severity, risk in NessusXmlOp.SEVERITY_TO_RISK.items()}
+
+
+def finding(plugin_id, host, port, cve='', risk='High', **fields):
+    row = dict.fromkeys(CSV_COLUMNS, '')
+    row.update({'Plugin ID': plugin_id, 'CVE': cve, 'Risk': risk, 'Host': host, 'Protocol': 'tcp',
+                'Port': port, 'Name': f'plugin {plugin_id}', 'Risk Factor': risk,
+                'Plugin Publication Date': '2021/01/04'})
+    row.update(fields)
+    return row
+
+
+def write_csv(tmp_path, rows, name='scan.csv'):
+    path = tmp_path / name
+    with open(path, 'w', newline='', encoding='utf-8') as f:
+        writer = csv.DictWriter(f, fieldnames=CSV_COLUMNS, quoting=csv.QUOTE_ALL)
+        writer.writeheader()
+        writer.writerows(rows)
+    return str(path)
+
+
+def write_nessus(tmp_path, report_hosts, name='scan.nessus'):
+    """report_hosts 为 [(主机, [finding 行, ...]), ...]，同一主机可以出现多次；每个 finding 行是一个 ReportItem。"""
+    child_tags = {col: tag for tag, col in NessusXmlOp.REPORT_ITEM_FIELDS.items()}
+    hosts = []
+    for host, rows in report_hosts:
+        items = []
+        for row in rows:
+            children = [f'<{child_tags[col]}>{escape(str(row[col]))}</{child_tags[col]}>'
+                        for col in child_tags if row[col] != '']
+            children += [f'<cve>{escape(cve)}</cve>' for cve in str(row['CVE']).split(',') if cve]
+            items.append(f'<ReportItem port="{row["Port"]}" protocol="tcp" severity="{RISK_TO_SEVERITY[row["Risk"]]}" '
+                         f'pluginID="{row["Plugin ID"]}" pluginName={quoteattr(row["Name"])}>'
+                         f'{"".join(children)}</ReportItem>')
+        hosts.append(f'<ReportHost name={quoteattr(host)}><HostProperties/>{"".join(items)}</ReportHost>')
+    path = tmp_path / name
+    path.write_text('<?xml version="1.0" ?><NessusClientData_v2><Report name="scan">'
+                    f'{"".join(hosts)}</Report></NessusClientData_v2>', encoding='utf-8')
+    return str(path)
+
+
+def comparable(df):
+    # 批次顺序和空值表示（None / NaN）不影响入库结果；时间戳取自文件创建时间，不参与比较
+    df = df.drop(columns='timestamp').sort_values(['plugin_id', 'host', 'port']).reset_index(drop=True)
+    return df.astype(object).where(df.notna(), None)
+
+
+# 同一发现项分散在文件各处（每行一个 CVE），较早的行缺少 synopsis 和 CVSS；另有分组键为空和 Risk 为 None 的行
+REPEATED_FINDINGS = [
+    finding(1001, '10.0.0.1', 443, 'CVE-2021-0002'),
+    finding(1002, '10.0.0.2', 80),
+    finding(1001, '', 443, 'CVE-2021-0009'),
+    finding(1003, '10.0.0.3', 22, 'CVE-2021-0005'),
+    finding(1002, '10.0.0.2', '', 'CVE-2021-0008'),
+    finding(1004, '10.0.0.1', 443, risk='None'),
+    finding(1001, '10.0.0.1', 443, 'CVE-2021-0001', Synopsis='late synopsis'),
+    finding(1002, '10.0.0.2', 80, 'CVE-2021-0003', Synopsis='second'),
+    finding(1003, '10.0.0.3', 22, 'CVE-2021-0005', **{'CVSS v3.0 Base Score': '9.8'}),
+    finding(1005, '10.0.0.5', 8080),
+    finding(1001, '10.0.0.1', 443, 'CVE-2021-0002', Synopsis='ignored'),
+]
+
+
+def test_rows_with_blank_grouping_keys_are_dropped(tmp_path):
+    # 分组键为空的行（即使带有 CVE）不属于任何发现项，与改为列式合并之前的行为一致
+    path = write_csv(tmp_path, [
+        finding(1001, '10.0.0.1', 443, 'CVE-2021-0002'),
+        finding(1001, '', 443, 'CVE-2021-0009'),
+        finding(1001, '10.0.0.1', 443, 'CVE-2021-0001'),
+        finding(1002, '10.0.0.2', '', 'CVE-2021-0003'),
+        finding(1003, '10.0.0.3', 22),
+    ])
+    result = CsvDataOp.transform_nessus_data(path)
+    assert result[['plugin_id', 'host', 'port', 'cve']].values.tolist() == [
+        [1001, '10.0.0.1', 443, 'CVE-2021-0001,CVE-2021-0002'],
+        [1003, '10.0.0.3', 22, ''],
+    ]
+
+
+def test_whole_file_merge_keeps_first_non_null_values(tmp_path):
+    result = comparable(CsvDataOp.transform_nessus_data(write_csv(tmp_path, REPEATED_FINDINGS)))
+    assert result[['plugin_id', 'port', 'cve', 'synopsis', 'cvss_v3_0_base_score']].values.tolist() == [
+        [1001, 443, 'CVE-2021-0001,CVE-2021-0002', 'late synopsis', None],
+        [1002, 80, 'CVE-2021-0003', 'second', None],
+        [1003, 22, 'CVE-2021-0005', None, 9.8],
+        [1005, 8080, '', None, None],
+    ]
+
+
+@pytest.mark.parametrize('chunksize', [1, 3, 4, 100])
+def test_chunked_transform_matches_whole_file(tmp_path, chunksize):
+    path = write_csv(tmp_path, REPEATED_FINDINGS)
+    batches = list(CsvDataOp.iter_nessus_data_chunks(path, chunksize=chunksize, batch_size=3))
+    assert [len(batch) for batch in batches] == [3, 1]
+    pd.testing.assert_frame_equal(comparable(pd.concat(batches)),
+                                  comparable(CsvDataOp.transform_nessus_data(path)))
+
+
+@pytest.mark.parametrize('batch_size', [1, 2, 5000])
+def test_nessus_transform_matches_csv(tmp_path, batch_size):
+    # CSV 导出每个 CVE 一行；.nessus 中每个发现项一个 ReportItem，10.0.0.1 出现在两个 ReportHost 中
+    rows = [row for row in REPEATED_FINDINGS if row['Host'] and row['Port'] != '']
+    by_host = {}
+    for row in rows:
+        by_host.setdefault(row['Host'], []).append(row)
+    first, *later = by_host.pop('10.0.0.1')
+    report_hosts = [('10.0.0.1', [first])] + list(by_host.items()) + [('10.0.0.1', later)]
+
+    csv_result = CsvDataOp.transform_nessus_data(write_csv(tmp_path, rows))
+    batches = list(NessusXmlOp.iter_nessus_xml_chunks(write_nessus(tmp_path, report_hosts), batch_size=batch_size))
+    assert all(len(batch) <= batch_size for batch in batches)
+    pd.testing.assert_frame_equal(comparable(pd.concat(batches)), comparable(csv_result))
+
+
+def test_arrow_engine_matches_pandas(tmp_path):
+    pytest.importorskip('pyarrow')
+    path = write_csv(tmp_path, REPEATED_FINDINGS + [
+        finding(1006, '10.0.0.6', 21, **{'Plugin Publication Date': '2021-02-03',
+                                          'Plugin Modification Date': 'not a date'}),
+    ])
+    pd.testing.assert_frame_equal(comparable(CsvDataOp.transform_nessus_data(path, engine='arrow')),
+                                  comparable(CsvDataOp.transform_nessus_data(path)))
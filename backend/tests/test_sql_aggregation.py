@@ -0,0 +1,69 @@
+# SqlAggregation：JSON 过滤条件 -> 参数化 WHERE 子句、scan_date 时间范围、聚合任务校验
+from datetime import date
+
+import pytest
+
+import SqlAggregation
+from SqlAggregation import AggregationPlanError
+
+
+def leaf(field, operator, value=None):
+    return {"field": field, "operator": operator, "value": value}
+
+
+def test_not_wraps_the_negated_condition():
+    sql, params = SqlAggregation.build_where_clause(
+        {"$not": {"$or": [leaf("risk", "$eq", "High"), leaf("port", "$gt", 1024)]}})
+    assert sql == "NOT ((`risk` = %s OR `port` > %s))"
+    assert params == ["High", 1024]
+
+
+def test_scan_date_in_top_level_and_becomes_bounds_only():
+    condition = {"$and": [leaf("scan_date", "$gte", "2024-05-01"), leaf("scan_date", "$lt", "2024-05-08"),
+                          leaf("risk", "$eq", "Critical")]}
+    assert SqlAggregation.build_where_clause(condition) == ("(`risk` = %s)", ["Critical"])
+    assert SqlAggregation.extract_scan_date_bounds(condition) == (date(2024, 5, 1), date(2024, 5, 7))
+
+
+def test_scan_date_bounds_of_a_single_leaf():
+    assert SqlAggregation.extract_scan_date_bounds(leaf("scan_date", "$eq", "2024_05_03")) == \
+        (date(2024, 5, 3), date(2024, 5, 3))
+    assert SqlAggregation.extract_scan_date_bounds(leaf("scan_date", "$gt", "2024-05-03")) == (date(2024, 5, 4), None)
+    assert SqlAggregation.extract_scan_date_bounds(leaf("risk", "$eq", "High")) == (None, None)
+
+
+@pytest.mark.parametrize("condition", [
+    {"$not": leaf("scan_date", "$eq", "2024-05-01")},
+    {"$or": [leaf("scan_date", "$eq", "2024-05-01"), leaf("risk", "$eq", "High")]},
+    {"$and": [{"$and": [leaf("scan_date", "$eq", "2024-05-01")]}]},
+])
+def test_scan_date_outside_top_level_and_is_rejected(condition):
+    with pytest.raises(AggregationPlanError):
+        SqlAggregation.build_where_clause(condition)
+
+
+def test_scan_date_rejects_unsupported_operators():
+    with pytest.raises(AggregationPlanError):
+        SqlAggregation.extract_scan_date_bounds(leaf("scan_date", "$ne", "2024-05-01"))
+
+
+def test_cve_equality_matches_list_elements():
+    assert SqlAggregation.build_where_clause(leaf("cve", "$eq", " CVE-2021-44228 ")) == \
+        ("FIND_IN_SET(%s, REPLACE(`cve`, ' ', ''))", ["CVE-2021-44228"])
+    assert SqlAggregation.build_where_clause(leaf("cve", "$ne", "CVE-2021-44228")) == \
+        ("NOT FIND_IN_SET(%s, REPLACE(`cve`, ' ', ''))", ["CVE-2021-44228"])
+
+
+def test_cve_membership_ors_one_find_in_set_per_value():
+    sql, params = SqlAggregation.build_where_clause(leaf("cve", "$nin", ["CVE-2021-1", "CVE-2021-2"]))
+    assert sql == "NOT (FIND_IN_SET(%s, REPLACE(`cve`, ' ', '')) OR FIND_IN_SET(%s, REPLACE(`cve`, ' ', '')))"
+    assert params == ["CVE-2021-1", "CVE-2021-2"]
+
+
+def test_sum_and_avg_require_numeric_fields():
+    aggregations, group_by = SqlAggregation.parse_aggregation_tasks(
+        [{"type": "avg", "field": "cvss_v3_0_base_score", "group_by": "risk"}])
+    assert aggregations == {"avg_cvss_v3_0_base_score": ("avg", "cvss_v3_0_base_score")}
+    assert group_by == ["risk"]
+    with pytest.raises(AggregationPlanError):
+        SqlAggregation.parse_aggregation_tasks([{"type": "sum", "field": "host"}])
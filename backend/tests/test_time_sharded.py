@@ -0,0 +1,55 @@
+# merge_partial_aggregates：把各分片（每日表 / findings 分区）的部分聚合结果合并为最终结果
+import pandas as pd
+
+import MySqlSource
+
+
+def test_avg_is_weighted_by_shard_row_counts():
+    # 分片 1: 2 行，合计 10；分片 2: 3 行，合计 20 -> 30 / 5，而不是两个平均值的平均
+    partial = pd.DataFrame({'avg_score__sum': [10.0, 20.0], 'avg_score__count': [2, 3], '__rows': [2, 3]})
+    result = MySqlSource.merge_partial_aggregates(partial, {'avg_score': ('avg', 'cvss_v3_0_base_score')}, [])
+    assert result['avg_score'].tolist() == [6.0]
+
+
+def test_avg_per_group_ignores_shards_without_values():
+    partial = pd.DataFrame({
+        'risk': ['High', 'High', 'Low'],
+        'avg_score__sum': [9.0, None, 3.0],
+        'avg_score__count': [1, 0, 2],
+    })
+    result = MySqlSource.merge_partial_aggregates(partial, {'avg_score': ('avg', 'cvss_v3_0_base_score')}, ['risk'])
+    assert result.to_dict('records') == [{'risk': 'High', 'avg_score': 9.0}, {'risk': 'Low', 'avg_score': 1.5}]
+
+
+def test_count_distinct_counts_values_seen_in_several_shards_once():
+    # 分片查询按 count_distinct 的列分组，同一主机在两个分片中各出现一次
+    partial = pd.DataFrame({'host': ['10.0.0.1', '10.0.0.2', '10.0.0.2', '10.0.0.3'], 'n': [4, 1, 2, 5]})
+    result = MySqlSource.merge_partial_aggregates(
+        partial, {'hosts': ('count_distinct', 'host'), 'n': ('count', '*')}, [])
+    assert result.to_dict('records') == [{'hosts': 3, 'n': 12}]
+
+
+def test_count_distinct_cve_counts_individual_cves():
+    partial = pd.DataFrame({'cve': ['CVE-2021-1,CVE-2021-2', 'CVE-2021-2', None]})
+    result = MySqlSource.merge_partial_aggregates(partial, {'cves': ('count_distinct', 'cve')}, [])
+    assert result['cves'].tolist() == [2]
+
+
+def test_group_by_cve_splits_joined_values():
+    partial = pd.DataFrame({'cve': ['CVE-2021-1,CVE-2021-2', 'CVE-2021-2', None], 'n': [1, 2, 7]})
+    result = MySqlSource.merge_partial_aggregates(partial, {'n': ('count', '*')}, ['cve'])
+    assert result.to_dict('records') == [{'cve': 'CVE-2021-1', 'n': 1}, {'cve': 'CVE-2021-2', 'n': 3}]
+
+
+def test_empty_range_without_group_by_returns_one_row():
+    aggregations = {'n': ('count', '*'), 'total': ('sum', 'port'), 'avg_score': ('avg', 'cvss_v3_0_base_score'),
+                    'latest': ('max', 'timestamp'), 'hosts': ('count_distinct', 'host')}
+    result = MySqlSource.merge_partial_aggregates(pd.DataFrame(), aggregations, [])
+    assert list(result.columns) == list(aggregations)
+    assert result.to_dict('records') == [{'n': 0, 'total': None, 'avg_score': None, 'latest': None, 'hosts': 0}]
+
+
+def test_empty_range_with_group_by_returns_no_rows():
+    result = MySqlSource.merge_partial_aggregates(pd.DataFrame(), {'n': ('count', '*')}, ['risk'])
+    assert result.empty
+    assert list(result.columns) == ['risk', 'n']
@@ -45,7 +45,8 @@ def sanitize_dataframe_for_db(df: pd.DataFrame) -> None:
             # 判断是否是“整数型”浮点数（即所有非空值都是整数，如 1.0, 2.0）
             is_int_like_float = (
                     not series_after_dropna.empty and  # 关键检查点1: 确保有非空值存在
-                    series_after_dropna.mod(1).eq(0).all()  # 关键检查点2: 检查所有非空值的小数部分是否为0
+                    # 关键检查点2: 检查所有非空值的小数部分是否为0（转为 numpy 计算，兼容 Arrow 浮点列）
+                    bool(np.all(np.mod(series_after_dropna.to_numpy(dtype=float), 1) == 0))
             )
 
             if is_int_like_float:
@@ -64,7 +65,14 @@ def sanitize_dataframe_for_db(df: pd.DataFrame) -> None:
             df[col] = df[col].fillna(-1).astype(int)
             continue
 
-        # 4. 处理对象/字符串类型
+        # 4. 处理分类类型（arrow 引擎读取的 risk/protocol 等列）
+        #    Categorical 不能直接填充不在类别中的值，先转回普通字符串再按字符串处理
+        if isinstance(df[col].dtype, pd.CategoricalDtype):
+            print(f"  - 清理分类列 '{col}' -> ''")
+            df[col] = df[col].astype(object).fillna('').astype(str)
+            continue
+
+        # 5. 处理对象/字符串类型
         if pd.api.types.is_object_dtype(df[col]) or pd.api.types.is_string_dtype(df[col]):
             print(f"  - 清理字符串/对象列 '{col}' -> ''")
             df[col] = df[col].fillna('').astype(str).replace({'None': '', 'nan': '', 'NaT': ''})
@@ -73,12 +81,26 @@ def sanitize_dataframe_for_db(df: pd.DataFrame) -> None:
     print("类型安全的空值清理完成。")
 
 
+def encode_uuids(table_name: str, ids) -> list:
+    """按表名（YYYY_MM_DD）和行 id 生成可逆的 UUID，与 decode_uuid 互逆。"""
+    extracted_value_str = table_name.replace('_', '')
+    try:
+        extracted_value_int = int(extracted_value_str)
+    except ValueError:
+        print(f"错误: 无法将文件名部分 '{extracted_value_str}' 转换为整数。")
+        raise
+
+    HASH_SALT = os.getenv("HASH_SALT", "thisishashsalt")
+    hashids_encoder = Hashids(salt=HASH_SALT, min_length=11)
+    return [hashids_encoder.encode(extracted_value_int, int(row_id)) for row_id in ids]
+
+
 def add_ids_and_uuid(
         connection,
         db_name: str,  # 添加 db_name 参数
         df: pd.DataFrame,
         table_name: str,
-        filename: str,
+        filename: str = None,
         id_column: str = 'id'
 ) -> pd.DataFrame:
     """
@@ -101,27 +123,15 @@ def add_ids_and_uuid(
 
     try:
         # 所有后续操作都在 df_copy 上进行
-        print(f"正在为表 '{db_name}.{table_name}' 决定ID起始值...")
-        max_id = MySqlSource.get_max_id(connection, db_name, table_name, id_column)
-        next_id_start = max_id + 1
-        print(f"信息: 当前最大ID为 {max_id}，新ID将从 {next_id_start} 开始计算。")
+        print(f"正在为表 '{db_name}.{table_name}' 预留 {len(df_copy)} 个ID...")
+        # 一次往返原子地预留整段 ID，并发的上传各自拿到互不重叠的区间
+        next_id_start = MySqlSource.reserve_id_range(connection, db_name, table_name, len(df_copy), id_column)
 
         df_copy[id_column] = np.arange(next_id_start, next_id_start + len(df_copy))
 
         print("正在生成 'uuid'...")
-        extracted_value_str = filename.replace('_', '')
-        try:
-            extracted_value_int = int(extracted_value_str)
-        except ValueError:
-            print(f"错误: 无法将文件名部分 '{extracted_value_str}' 转换为整数。")
-            raise
-
-        HASH_SALT = os.getenv("HASH_SALT", "thisishashsalt")
-        hashids_encoder = Hashids(salt=HASH_SALT, min_length=11)
-
-        df_copy['uuid'] = df_copy[id_column].apply(
-            lambda row_id: hashids_encoder.encode(extracted_value_int, row_id)
-        )
+        # UUID 编码的日期取自表名（YYYY_MM_DD）；filename 仅为兼容旧的调用方式保留
+        df_copy['uuid'] = encode_uuids(filename or table_name, df_copy[id_column])
         print("ID和可逆的UUID已添加完成。")
 
         # 调用清理函数，它将直接修改 df_copy